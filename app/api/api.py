@@ -1,18 +1,47 @@
 """
 API for the bot.
 """
-from fastapi import FastAPI, Depends, HTTPException, status, Request, Header, File, UploadFile
+from fastapi import FastAPI, Depends, HTTPException, status, Request, Header
 from fastapi.security import APIKeyHeader
 from fastapi.responses import JSONResponse
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session, selectinload, joinedload, aliased
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List, Optional
 import os
+import time
 from datetime import datetime
 
-from ..database.db import get_db
-from ..database.models import User, File as DBFile, Category, Format, Tag, ApiLog
-from ..utils.security import validate_api_key, sanitize_filename
+from ..database.db import get_db, get_async_db
+from ..database.models import User, File as DBFile, Category, Format, Tag
+from ..database.search import apply_file_search
+from ..utils.security import validate_api_key, sanitize_filename, hash_api_key
+from ..utils.cache import TTLCache
 from ..utils.helpers import get_file_size_str
+from .request_log import api_request_log
+from .uploads import spool_upload
+from .upload_worker import UploadJob, UploadQueueFull, upload_workers
+from ..utils.pagination import (
+    KeysetOrder, datetime_to_key, key_to_datetime, encode_cursor, keyset_filter,
+    encode_opaque_cursor, decode_opaque_cursor
+)
+
+# Resolved API keys (by key hash)
+API_KEY_CACHE_SIZE = int(os.getenv("API_KEY_CACHE_SIZE", "10000"))
+API_KEY_CACHE_TTL = int(os.getenv("API_KEY_CACHE_TTL", "60"))  # seconds
+API_KEY_NEGATIVE_TTL = int(os.getenv("API_KEY_NEGATIVE_TTL", "10"))  # seconds, for unknown keys
+
+api_key_cache = TTLCache(maxsize=API_KEY_CACHE_SIZE, ttl=API_KEY_CACHE_TTL)
+
+# Largest total counted with count=estimate
+API_COUNT_ESTIMATE_LIMIT = int(os.getenv("API_COUNT_ESTIMATE_LIMIT", "10000"))
+
+# Files are listed newest first
+FILES_ORDER = KeysetOrder(DBFile.upload_date, DBFile.id, lambda file: datetime_to_key(file.upload_date), key_to_datetime)
+
+def count_rows(column, parent_id):
+    """Correlated COUNT subquery of the rows whose column references a parent row."""
+    return select(func.count()).where(column == parent_id).scalar_subquery()
 
 # Create FastAPI app
 api_app = FastAPI(title="Telegram File Bot API", version="1.0.0")
@@ -20,24 +49,56 @@ api_app = FastAPI(title="Telegram File Bot API", version="1.0.0")
 # API key header
 API_KEY_HEADER = APIKeyHeader(name="X-API-Key")
 
-# Log API request
-async def log_api_request(request: Request, status_code: int, user_id: Optional[int] = None, db: Session = Depends(get_db)):
-    """Log API request."""
-    api_log = ApiLog(
-        user_id=user_id,
-        endpoint=request.url.path,
-        method=request.method,
-        status_code=status_code,
-        ip_address=request.client.host,
-        user_agent=request.headers.get("user-agent")
-    )
-    db.add(api_log)
-    db.commit()
+def get_endpoint(request: Request) -> str:
+    """Get the route template of a request, like /api/files/{file_id}.
+    
+    Logs and rollups are grouped by it, the raw path would split them per
+    id. Requests matching no route keep their raw path.
+    """
+    route = request.scope.get("route")
+    
+    if route is None:
+        return request.url.path
+    
+    return request.scope.get("root_path", "") + route.path
+
+# Log API requests
+@api_app.middleware("http")
+async def log_api_requests(request: Request, call_next):
+    """Queue a log row for every API request."""
+    started = time.perf_counter()
+    status_code = status.HTTP_500_INTERNAL_SERVER_ERROR
+    
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        api_request_log.record(
+            endpoint=get_endpoint(request),
+            method=request.method,
+            status_code=status_code,
+            latency_ms=int((time.perf_counter() - started) * 1000),
+            ip_address=request.client.host if request.client else None,
+            user_agent=request.headers.get("user-agent"),
+            user_id=getattr(request.state, "api_user_id", None)
+        )
 
 # Verify API key
-async def verify_api_key(api_key: str = Depends(API_KEY_HEADER), db: Session = Depends(get_db)):
+async def verify_api_key(request: Request, api_key: str = Depends(API_KEY_HEADER), db: Session = Depends(get_db)):
     """Verify API key."""
-    user = db.query(User).filter(User.api_key == api_key).first()
+    key_hash = hash_api_key(api_key)
+    user = api_key_cache.get(key_hash)
+    
+    if user is None:
+        user = db.query(User).filter(User.api_key_hash == key_hash).first()
+        
+        if user:
+            # Detach the user so it can be shared between requests
+            db.expunge(user)
+            api_key_cache.set(key_hash, user)
+        else:
+            api_key_cache.set(key_hash, False, ttl=API_KEY_NEGATIVE_TTL)
     
     if not user:
         raise HTTPException(
@@ -45,8 +106,16 @@ async def verify_api_key(api_key: str = Depends(API_KEY_HEADER), db: Session = D
             detail="Invalid API key"
         )
     
+    # Attribute the request log to the user
+    request.state.api_user_id = user.id
+    
     return user
 
+def invalidate_api_key(key_hash: Optional[str]) -> None:
+    """Drop a cached API key."""
+    if key_hash:
+        api_key_cache.invalidate(key_hash)
+
 # API routes
 @api_app.get("/")
 async def root():
@@ -54,10 +123,8 @@ async def root():
     return {"message": "Welcome to Telegram File Bot API"}
 
 @api_app.get("/users/me")
-async def get_current_user(user: User = Depends(verify_api_key), db: Session = Depends(get_db)):
+async def get_current_user(user: User = Depends(verify_api_key)):
     """Get current user."""
-    await log_api_request(Request, status.HTTP_200_OK, user.id, db)
-    
     return {
         "id": user.id,
         "telegram_id": user.telegram_id,
@@ -75,36 +142,72 @@ async def get_current_user(user: User = Depends(verify_api_key), db: Session = D
 @api_app.get("/files")
 async def get_files(
     user: User = Depends(verify_api_key),
-    db: Session = Depends(get_db),
+    async_db: AsyncSession = Depends(get_async_db),
     skip: int = 0,
     limit: int = 100,
     category_id: Optional[int] = None,
     format_id: Optional[int] = None,
-    search: Optional[str] = None
+    search: Optional[str] = None,
+    after: Optional[str] = None,
+    count: str = "exact"
 ):
-    """Get files."""
+    """Get files.
+    
+    Pass the returned next_cursor as `after` to get the next page; unlike
+    `skip`, this costs the same on every page. `count` selects how the
+    total is computed: "exact", "estimate" (counted up to
+    API_COUNT_ESTIMATE_LIMIT) or "none".
+    """
+    if count not in ("none", "estimate", "exact"):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="count must be none, estimate or exact")
+    
+    cursor = None
+    if after:
+        try:
+            cursor = decode_opaque_cursor(after)
+        except ValueError:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+    
     # Build query
-    query = db.query(DBFile)
+    query = select(DBFile)
     
     # Filter by owner
     if not user.is_admin and not user.is_moderator:
-        query = query.filter(DBFile.owner_id == user.id)
+        query = query.where(DBFile.owner_id == user.id)
     
     # Apply filters
     if category_id:
-        query = query.filter(DBFile.category_id == category_id)
+        query = query.where(DBFile.category_id == category_id)
     
     if format_id:
-        query = query.filter(DBFile.format_id == format_id)
+        query = query.where(DBFile.format_id == format_id)
     
     if search:
-        query = query.filter(DBFile.file_name.ilike(f"%{search}%"))
+        # Pages follow the (upload_date, id) order, not relevance
+        query = apply_file_search(query, search, rank=False)
     
     # Get total count
-    total = query.count()
+    total = None
+    total_is_estimate = False
+    
+    if count == "exact":
+        total = await async_db.scalar(select(func.count()).select_from(query.subquery()))
+    elif count == "estimate":
+        total = await async_db.scalar(select(func.count()).select_from(query.limit(API_COUNT_ESTIMATE_LIMIT).subquery()))
+        total_is_estimate = total >= API_COUNT_ESTIMATE_LIMIT
     
     # Apply pagination
-    files = query.order_by(DBFile.upload_date.desc()).offset(skip).limit(limit).all()
+    if cursor:
+        query = query.where(keyset_filter(FILES_ORDER, cursor))
+    
+    query = query.options(selectinload(DBFile.tags)).order_by(DBFile.upload_date.desc(), DBFile.id.desc())
+    files = (await async_db.execute(query.offset(skip).limit(limit + 1))).scalars().all()
+    
+    # One extra row tells whether there is a next page
+    next_cursor = None
+    if len(files) > limit:
+        files = files[:limit]
+        next_cursor = encode_opaque_cursor(encode_cursor(FILES_ORDER, files[-1]))
     
     # Format response
     result = []
@@ -127,12 +230,12 @@ async def get_files(
             "tags": [tag.name for tag in file.tags]
         })
     
-    await log_api_request(Request, status.HTTP_200_OK, user.id, db)
-    
     return {
         "total": total,
+        "total_is_estimate": total_is_estimate,
         "skip": skip,
         "limit": limit,
+        "next_cursor": next_cursor,
         "files": result
     }
 
@@ -143,16 +246,24 @@ async def get_file(
     db: Session = Depends(get_db)
 ):
     """Get file details."""
-    # Get file
-    file = db.query(DBFile).filter(DBFile.id == file_id).first()
+    # Get file with its tags, category, format and owner
+    file = (
+        db.query(DBFile)
+        .options(
+            selectinload(DBFile.tags),
+            joinedload(DBFile.category),
+            joinedload(DBFile.format),
+            joinedload(DBFile.owner)
+        )
+        .filter(DBFile.id == file_id)
+        .first()
+    )
     
     if not file:
-        await log_api_request(Request, status.HTTP_404_NOT_FOUND, user.id, db)
         raise HTTPException(status_code=404, detail="File not found")
     
     # Check if user has access to file
     if not user.is_admin and not user.is_moderator and file.owner_id != user.id:
-        await log_api_request(Request, status.HTTP_403_FORBIDDEN, user.id, db)
         raise HTTPException(status_code=403, detail="Access denied")
     
     # Format response
@@ -196,8 +307,6 @@ async def get_file(
         }
     }
     
-    await log_api_request(Request, status.HTTP_200_OK, user.id, db)
-    
     return result
 
 @api_app.get("/categories")
@@ -207,8 +316,9 @@ async def get_categories(
     parent_id: Optional[int] = None
 ):
     """Get categories."""
-    # Build query
-    query = db.query(Category)
+    # Build query with subcategory counts
+    subcategory = aliased(Category)
+    query = db.query(Category, count_rows(subcategory.parent_id, Category.id).label("subcategories_count"))
     
     # Filter by parent
     if parent_id is not None:
@@ -221,7 +331,7 @@ async def get_categories(
     
     # Format response
     result = []
-    for category in categories:
+    for category, subcategories_count in categories:
         result.append({
             "id": category.id,
             "name_en": category.name_en,
@@ -229,12 +339,10 @@ async def get_categories(
             "parent_id": category.parent_id,
             "is_active": category.is_active,
             "created_at": category.created_at.isoformat(),
-            "subcategories_count": len(category.subcategories),
-            "files_count": len(category.files)
+            "subcategories_count": subcategories_count,
+            "files_count": category.files_count
         })
     
-    await log_api_request(Request, status.HTTP_200_OK, user.id, db)
-    
     return result
 
 @api_app.get("/formats")
@@ -265,11 +373,9 @@ async def get_formats(
             "category_id": format.category_id,
             "is_active": format.is_active,
             "created_at": format.created_at.isoformat(),
-            "files_count": len(format.files)
+            "files_count": format.files_count
         })
     
-    await log_api_request(Request, status.HTTP_200_OK, user.id, db)
-    
     return result
 
 @api_app.get("/tags")
@@ -296,16 +402,27 @@ async def get_tags(
             "id": tag.id,
             "name": tag.name,
             "created_at": tag.created_at.isoformat(),
-            "files_count": len(tag.files)
+            "files_count": tag.files_count
         })
     
-    await log_api_request(Request, status.HTTP_200_OK, user.id, db)
-    
     return result
 
-@api_app.post("/upload")
+@api_app.post("/upload", openapi_extra={
+    "requestBody": {
+        "required": True,
+        "content": {
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {"file": {"type": "string", "format": "binary"}},
+                    "required": ["file"]
+                }
+            }
+        }
+    }
+})
 async def upload_file(
-    file: UploadFile = File(...),
+    request: Request,
     category_id: Optional[int] = None,
     format_id: Optional[int] = None,
     tags: Optional[str] = None,
@@ -317,90 +434,69 @@ async def upload_file(
     """Upload file."""
     # Check if user can upload
     if not user.can_upload and not user.is_admin and not user.is_moderator:
-        await log_api_request(Request, status.HTTP_403_FORBIDDEN, user.id, db)
         raise HTTPException(status_code=403, detail="User cannot upload files")
     
     # Check file size
     from ..database.db import get_setting
     max_file_size = int(get_setting(db, "max_file_size", "50")) * 1024 * 1024
     
-    if file.size > max_file_size:
-        await log_api_request(Request, status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, user.id, db)
-        raise HTTPException(status_code=413, detail=f"File too large. Maximum size is {max_file_size / (1024 * 1024)} MB")
+    # Stream the file to the spool directory, enforcing the size limit
+    upload = await spool_upload(request, max_file_size)
     
     # Sanitize filename
-    file_name = sanitize_filename(file.filename)
-    
-    # Save file temporarily
-    temp_file_path = f"temp_{file_name}"
-    with open(temp_file_path, "wb") as f:
-        f.write(await file.read())
+    file_name = sanitize_filename(upload.file_name)
+    
+    # Parse tags
+    from ..utils.helpers import parse_tags
+    tag_names = parse_tags(tags)
+    
+    # Hash password if provided
+    hashed_password = None
+    if password:
+        from ..database.db import hash_password
+        hashed_password = hash_password(password)
+    
+    job = UploadJob(
+        user_id=user.id,
+        path=upload.path,
+        file_name=file_name,
+        content_type=upload.content_type,
+        size=upload.size,
+        category_id=category_id,
+        format_id=format_id,
+        tags=tag_names,
+        source_url=source_url,
+        password=hashed_password
+    )
     
+    # The workers send the file to Telegram and remove the spooled file
     try:
-        # TODO: Implement file upload to Telegram
-        # For now, just return success
-        
-        # Parse tags
-        tag_list = []
-        if tags:
-            from ..utils.helpers import parse_tags, get_or_create_tags
-            tag_names = parse_tags(tags)
-            tag_list = get_or_create_tags(db, tag_names)
-        
-        # Generate share code and link
-        from ..database.db import generate_share_code
-        from ..utils.helpers import generate_share_link
-        share_code = generate_share_code()
-        bot_username = "your_bot_username"  # TODO: Get from settings
-        share_link = generate_share_link(bot_username, share_code)
-        
-        # Hash password if provided
-        hashed_password = None
-        if password:
-            from ..database.db import hash_password
-            hashed_password = hash_password(password)
-        
-        # Create file record
-        new_file = DBFile(
-            telegram_file_id="temp_id",  # TODO: Get from Telegram
-            file_unique_id="temp_unique_id",  # TODO: Get from Telegram
-            file_name=file_name,
-            file_size=os.path.getsize(temp_file_path),
-            file_type=file.content_type,
-            message_id=0,  # TODO: Get from Telegram
-            category_id=category_id,
-            format_id=format_id,
-            owner_id=user.id,
-            source_url=source_url,
-            share_link=share_link,
-            share_code=share_code,
-            password=hashed_password
-        )
-        
-        db.add(new_file)
-        db.commit()
-        db.refresh(new_file)
-        
-        # Add tags
-        if tag_list:
-            new_file.tags = tag_list
-            db.commit()
-        
-        await log_api_request(Request, status.HTTP_201_CREATED, user.id, db)
-        
-        return {
-            "id": new_file.id,
-            "file_name": new_file.file_name,
-            "file_size": new_file.file_size,
-            "file_size_str": get_file_size_str(new_file.file_size),
-            "share_link": new_file.share_link,
-            "share_code": new_file.share_code
+        upload_workers.submit(job)
+    except UploadQueueFull:
+        os.remove(upload.path)
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Upload queue is full, try again later")
+    
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content={
+            **job.to_dict(),
+            "file_size_str": get_file_size_str(job.size),
+            "status_url": f"{request.scope.get('root_path', '')}/upload/{job.id}"
         }
+    )
+
+@api_app.get("/upload/{job_id}")
+async def get_upload_status(
+    job_id: str,
+    user: User = Depends(verify_api_key)
+):
+    """Get the status of an upload."""
+    job = upload_workers.get_job(job_id)
     
-    finally:
-        # Clean up temporary file
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+    if not job or job.user_id != user.id:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    
+    return job.to_dict()
 
 @api_app.delete("/files/{file_id}")
 async def delete_file(
@@ -413,18 +509,14 @@ async def delete_file(
     file = db.query(DBFile).filter(DBFile.id == file_id).first()
     
     if not file:
-        await log_api_request(Request, status.HTTP_404_NOT_FOUND, user.id, db)
         raise HTTPException(status_code=404, detail="File not found")
     
     # Check if user has access to file
     if not user.is_admin and not user.is_moderator and file.owner_id != user.id:
-        await log_api_request(Request, status.HTTP_403_FORBIDDEN, user.id, db)
         raise HTTPException(status_code=403, detail="Access denied")
     
     # Delete file
     db.delete(file)
     db.commit()
     
-    await log_api_request(Request, status.HTTP_200_OK, user.id, db)
-    
     return {"message": "File deleted successfully"}
\ No newline at end of file
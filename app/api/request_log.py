@@ -0,0 +1,125 @@
+"""
+Batched API request logging.
+
+Requests are recorded in memory by the API middleware and written to
+api_logs in bulk by a background task, so logging never adds a database
+round trip to a request.
+"""
+import os
+import asyncio
+import logging
+import threading
+from collections import deque
+from datetime import datetime
+from typing import Optional
+from sqlalchemy import insert
+
+from ..database.db import async_engine
+from ..database.models import ApiLog
+
+# Queue and flush settings
+API_LOG_QUEUE_SIZE = int(os.getenv("API_LOG_QUEUE_SIZE", "10000"))
+API_LOG_BATCH_SIZE = int(os.getenv("API_LOG_BATCH_SIZE", "500"))
+API_LOG_FLUSH_INTERVAL = int(os.getenv("API_LOG_FLUSH_INTERVAL", "500"))  # milliseconds
+
+class ApiRequestLog:
+    """Bounded in-memory queue of API requests, bulk-inserted in the background."""
+    
+    def __init__(self, maxsize: int = API_LOG_QUEUE_SIZE, batch_size: int = API_LOG_BATCH_SIZE,
+                 flush_interval: int = API_LOG_FLUSH_INTERVAL):
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval / 1000
+        self.written = 0
+        self.dropped = 0
+        self._queue: deque = deque()
+        self._lock = threading.Lock()
+        self._batch_ready: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+    
+    def record(self, endpoint: str, method: str, status_code: int, latency_ms: int,
+               ip_address: Optional[str] = None, user_agent: Optional[str] = None,
+               user_id: Optional[int] = None) -> None:
+        """Queue a request log row, dropping it if the queue is full."""
+        row = {
+            "user_id": user_id,
+            "endpoint": endpoint[:255],
+            "method": method,
+            "status_code": status_code,
+            "latency_ms": latency_ms,
+            "ip_address": ip_address,
+            "user_agent": user_agent[:255] if user_agent else None,
+            "created_at": datetime.utcnow()
+        }
+        
+        with self._lock:
+            if len(self._queue) >= self.maxsize:
+                self.dropped += 1
+                return
+            
+            self._queue.append(row)
+            size = len(self._queue)
+        
+        self._ensure_started()
+        
+        if size >= self.batch_size:
+            self._batch_ready.set()
+    
+    def _ensure_started(self) -> None:
+        """Start the writer task on the running event loop."""
+        if self._task is None or self._task.done():
+            self._batch_ready = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+    
+    async def _run(self) -> None:
+        """Write the queue every flush interval, or sooner when a batch is full."""
+        while True:
+            try:
+                await asyncio.wait_for(self._batch_ready.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            
+            self._batch_ready.clear()
+            await self.flush()
+    
+    async def flush(self) -> int:
+        """Write all queued rows in batches."""
+        total = 0
+        
+        while True:
+            with self._lock:
+                rows = [self._queue.popleft() for _ in range(min(self.batch_size, len(self._queue)))]
+            
+            if not rows:
+                return total
+            
+            try:
+                async with async_engine.begin() as connection:
+                    await connection.execute(insert(ApiLog), rows)
+            except Exception as e:
+                # Logs are best effort, a failed batch is counted as dropped
+                self.dropped += len(rows)
+                logging.error(f"Error writing {len(rows)} API log rows: {e}")
+                return total
+            
+            self.written += len(rows)
+            total += len(rows)
+    
+    async def close(self) -> None:
+        """Stop the writer task and write what is left."""
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        
+        await self.flush()
+    
+    def stats(self) -> dict:
+        """Get queue statistics."""
+        return {
+            "queued": len(self._queue),
+            "maxsize": self.maxsize,
+            "written": self.written,
+            "dropped": self.dropped
+        }
+
+api_request_log = ApiRequestLog()
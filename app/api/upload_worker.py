@@ -0,0 +1,259 @@
+"""
+Background upload workers for the API.
+
+API uploads are spooled to disk by the endpoint and queued here. A fixed
+number of workers push each file to the storage channel with the bot's
+send_document and then create the file record with the real Telegram ids,
+so the request returns as soon as the file is spooled. Job status is kept
+in memory for UPLOAD_JOB_TTL seconds to be polled by the client.
+"""
+import os
+import uuid
+import asyncio
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.types import FSInputFile
+from sqlalchemy.orm import Session
+
+from ..database.db import AsyncSessionLocal, generate_share_code
+from ..database.models import File
+from ..utils.cache import TTLCache
+from ..utils.helpers import get_or_create_tags, generate_share_link
+
+# Worker settings
+UPLOAD_WORKERS = int(os.getenv("UPLOAD_WORKERS", "2"))
+UPLOAD_QUEUE_SIZE = int(os.getenv("UPLOAD_QUEUE_SIZE", "100"))
+UPLOAD_MAX_RETRIES = int(os.getenv("UPLOAD_MAX_RETRIES", "3"))
+UPLOAD_JOB_TTL = int(os.getenv("UPLOAD_JOB_TTL", "3600"))  # seconds
+
+# File type of parts sent without a Content-Type
+DEFAULT_CONTENT_TYPE = "application/octet-stream"
+
+# Job statuses
+QUEUED = "queued"
+UPLOADING = "uploading"
+DONE = "done"
+FAILED = "failed"
+
+class UploadQueueFull(Exception):
+    """The upload queue has no room for another job."""
+
+class UploadJob:
+    """Spooled file waiting to be pushed to the storage channel."""
+    
+    def __init__(self, user_id: int, path: str, file_name: str, content_type: Optional[str], size: int,
+                 category_id: Optional[int] = None, format_id: Optional[int] = None,
+                 tags: Optional[List[str]] = None, source_url: Optional[str] = None,
+                 password: Optional[str] = None):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.path = path
+        self.file_name = file_name
+        self.content_type = content_type
+        self.size = size
+        self.category_id = category_id
+        self.format_id = format_id
+        self.tags = tags or []
+        self.source_url = source_url
+        self.password = password  # already hashed
+        self.status = QUEUED
+        self.error: Optional[str] = None
+        self.file: Optional[Dict[str, Any]] = None
+        self.created_at = datetime.utcnow()
+        self.finished_at: Optional[datetime] = None
+    
+    def to_dict(self) -> Dict[str, Any]:
+        """Get the job status for API clients."""
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "file_name": self.file_name,
+            "file_size": self.size,
+            "error": self.error,
+            "file": self.file,
+            "created_at": self.created_at.isoformat(),
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None
+        }
+
+class UploadWorkerPool:
+    """Bounded queue of upload jobs and the workers sending them to Telegram."""
+    
+    def __init__(self, workers: int = UPLOAD_WORKERS, maxsize: int = UPLOAD_QUEUE_SIZE):
+        self.workers = workers
+        self.maxsize = maxsize
+        self.uploaded = 0
+        self.failed = 0
+        self.jobs = TTLCache(maxsize=10000, ttl=UPLOAD_JOB_TTL)
+        self._queue: Optional[asyncio.Queue] = None
+        self._save_lock: Optional[asyncio.Lock] = None
+        self._tasks: List[asyncio.Task] = []
+        self._bot: Optional[Bot] = None
+        self._bot_username: Optional[str] = None
+    
+    def submit(self, job: UploadJob) -> None:
+        """Queue a job, raising UploadQueueFull if there is no room."""
+        self._ensure_started()
+        
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise UploadQueueFull()
+        
+        self.jobs.set(job.id, job)
+    
+    def get_job(self, job_id: str) -> Optional[UploadJob]:
+        """Get a job by id."""
+        return self.jobs.get(job_id)
+    
+    def _ensure_started(self) -> None:
+        """Start the workers on the running event loop."""
+        if self._queue is None:
+            self._queue = asyncio.Queue(maxsize=self.maxsize)
+            self._save_lock = asyncio.Lock()
+        
+        self._tasks = [task for task in self._tasks if not task.done()]
+        loop = asyncio.get_running_loop()
+        
+        while len(self._tasks) < self.workers:
+            self._tasks.append(loop.create_task(self._run()))
+    
+    def _get_bot(self) -> Bot:
+        """Get the bot used by the workers.
+        
+        The API runs on its own event loop, so it doesn't share the polling
+        bot's HTTP session.
+        """
+        if self._bot is None:
+            self._bot = Bot(token=os.getenv("BOT_TOKEN"))
+        
+        return self._bot
+    
+    async def _run(self) -> None:
+        """Process queued jobs one at a time."""
+        while True:
+            job = await self._queue.get()
+            
+            try:
+                await self.process(job)
+            finally:
+                self._queue.task_done()
+    
+    async def process(self, job: UploadJob) -> None:
+        """Send a job's file to the storage channel and create its record."""
+        job.status = UPLOADING
+        
+        try:
+            message = await self._send(job)
+            document = message.document or message.video or message.audio or message.animation
+            
+            if document is None:
+                raise ValueError("Telegram did not return a file")
+            
+            if self._bot_username is None:
+                self._bot_username = (await self._get_bot().get_me()).username
+            
+            # Sends run concurrently, records are saved one at a time so
+            # get_or_create_tags doesn't race on new tag names
+            async with self._save_lock, AsyncSessionLocal() as db:
+                job.file = await db.run_sync(self._save_file, job, message.message_id, document)
+            
+            job.status = DONE
+            self.uploaded += 1
+        except Exception as e:
+            job.status = FAILED
+            job.error = str(e)
+            self.failed += 1
+            logging.error(f"Error uploading API file {job.file_name}: {e}")
+        finally:
+            job.finished_at = datetime.utcnow()
+            
+            # Clean up spooled file
+            if os.path.exists(job.path):
+                os.remove(job.path)
+    
+    async def _send(self, job: UploadJob):
+        """Send the spooled file, waiting out Telegram flood limits."""
+        attempt = 0
+        
+        while True:
+            try:
+                return await self._get_bot().send_document(
+                    chat_id=os.getenv("STORAGE_CHANNEL_ID"),
+                    document=FSInputFile(job.path, filename=job.file_name),
+                    caption=job.file_name
+                )
+            except TelegramRetryAfter as e:
+                attempt += 1
+                
+                if attempt > UPLOAD_MAX_RETRIES:
+                    raise
+                
+                await asyncio.sleep(e.retry_after)
+    
+    def _save_file(self, db: Session, job: UploadJob, message_id: int, document) -> Dict[str, Any]:
+        """Create the file record of a sent job."""
+        share_code = generate_share_code()
+        
+        new_file = File(
+            telegram_file_id=document.file_id,
+            file_unique_id=document.file_unique_id,
+            file_name=job.file_name,
+            file_size=job.size,
+            file_type=(job.content_type or DEFAULT_CONTENT_TYPE)[:50],
+            message_id=message_id,
+            category_id=job.category_id,
+            format_id=job.format_id,
+            owner_id=job.user_id,
+            source_url=job.source_url,
+            share_link=generate_share_link(self._bot_username, share_code),
+            share_code=share_code,
+            password=job.password
+        )
+        
+        if job.tags:
+            new_file.tags = get_or_create_tags(db, job.tags)
+        
+        db.add(new_file)
+        db.commit()
+        
+        return {
+            "id": new_file.id,
+            "file_name": new_file.file_name,
+            "file_size": new_file.file_size,
+            "share_link": new_file.share_link,
+            "share_code": new_file.share_code
+        }
+    
+    async def close(self) -> None:
+        """Stop the workers, dropping queued jobs and their spooled files."""
+        for task in self._tasks:
+            task.cancel()
+        
+        self._tasks = []
+        
+        while self._queue is not None and not self._queue.empty():
+            job = self._queue.get_nowait()
+            job.status = FAILED
+            job.error = "Server shutting down"
+            
+            if os.path.exists(job.path):
+                os.remove(job.path)
+        
+        if self._bot is not None:
+            await self._bot.session.close()
+            self._bot = None
+    
+    def stats(self) -> dict:
+        """Get queue statistics."""
+        return {
+            "queued": self._queue.qsize() if self._queue is not None else 0,
+            "maxsize": self.maxsize,
+            "workers": self.workers,
+            "uploaded": self.uploaded,
+            "failed": self.failed
+        }
+
+upload_workers = UploadWorkerPool()
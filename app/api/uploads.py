@@ -0,0 +1,176 @@
+"""
+Streaming multipart uploads for the API.
+
+The request body is parsed as it arrives and the file part is written to a
+unique file in UPLOAD_SPOOL_DIR in UPLOAD_CHUNK_SIZE chunks, so memory per
+upload stays constant and oversized uploads are rejected as soon as they
+cross the limit.
+"""
+import os
+import tempfile
+from typing import NamedTuple, Optional
+from fastapi import HTTPException, Request, status
+
+try:
+    from python_multipart.exceptions import MultipartParseError
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.exceptions import MultipartParseError
+    from multipart.multipart import MultipartParser, parse_options_header
+
+# Spool settings
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR", os.path.join(tempfile.gettempdir(), "telegram_file_bot_uploads"))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))  # bytes
+
+# Room for multipart boundaries and part headers in Content-Length
+MULTIPART_OVERHEAD = 64 * 1024
+
+class SpooledUpload(NamedTuple):
+    """Uploaded file written to the spool directory."""
+    path: str
+    file_name: str
+    content_type: Optional[str]
+    size: int
+
+class UploadTooLarge(Exception):
+    """The uploaded file is larger than the limit."""
+
+class _FilePartWriter:
+    """Multipart parser callbacks that spool one file field to disk."""
+    
+    def __init__(self, field_name: str, max_size: int):
+        self.field_name = field_name
+        self.max_size = max_size
+        self.path = None
+        self.file_name = None
+        self.content_type = None
+        self.size = 0
+        self._file = None
+        self._buffer = bytearray()
+        self._headers = {}
+        self._header_field = b""
+        self._header_value = b""
+        self._writing = False
+    
+    def on_part_begin(self):
+        self._headers = {}
+        self._writing = False
+    
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._header_field += data[start:end]
+    
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._header_value += data[start:end]
+    
+    def on_header_end(self):
+        self._headers[self._header_field.lower()] = self._header_value
+        self._header_field = b""
+        self._header_value = b""
+    
+    def on_headers_finished(self):
+        _, options = parse_options_header(self._headers.get(b"content-disposition", b""))
+        name = options.get(b"name", b"").decode("utf-8", "replace")
+        file_name = options.get(b"filename")
+        
+        # Only the first file in the expected field is kept
+        if name != self.field_name or file_name is None or self.path is not None:
+            return
+        
+        os.makedirs(UPLOAD_SPOOL_DIR, exist_ok=True)
+        fd, self.path = tempfile.mkstemp(dir=UPLOAD_SPOOL_DIR, prefix="upload_")
+        self._file = os.fdopen(fd, "wb")
+        self.file_name = file_name.decode("utf-8", "replace")
+        content_type = self._headers.get(b"content-type")
+        self.content_type = content_type.decode("latin-1") if content_type else None
+        self._writing = True
+    
+    def on_part_data(self, data: bytes, start: int, end: int):
+        if not self._writing:
+            return
+        
+        self.size += end - start
+        
+        if self.size > self.max_size:
+            raise UploadTooLarge()
+        
+        self._buffer += data[start:end]
+        
+        # Write full chunks only
+        while len(self._buffer) >= UPLOAD_CHUNK_SIZE:
+            self._file.write(self._buffer[:UPLOAD_CHUNK_SIZE])
+            del self._buffer[:UPLOAD_CHUNK_SIZE]
+    
+    def on_part_end(self):
+        if self._writing:
+            self._file.write(self._buffer)
+            self._buffer.clear()
+            self._file.close()
+            self._file = None
+            self._writing = False
+    
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+    
+    def discard(self):
+        """Close and delete the spooled file."""
+        self.close()
+        
+        if self.path and os.path.exists(self.path):
+            os.remove(self.path)
+
+async def spool_upload(request: Request, max_size: int, field_name: str = "file") -> SpooledUpload:
+    """Stream the file field of a multipart request to the spool directory.
+    
+    Raises 413 as soon as the file exceeds max_size and 400 if the request
+    has no file. The caller removes the spooled file when done.
+    """
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    boundary = options.get(b"boundary")
+    
+    if content_type != b"multipart/form-data" or not boundary:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Expected a multipart/form-data upload")
+    
+    too_large = HTTPException(
+        status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+        detail=f"File too large. Maximum size is {max_size / (1024 * 1024)} MB"
+    )
+    
+    # Reject before reading anything when the declared size is already too big
+    content_length = request.headers.get("content-length")
+    if content_length and content_length.isdigit() and int(content_length) > max_size + MULTIPART_OVERHEAD:
+        raise too_large
+    
+    writer = _FilePartWriter(field_name, max_size)
+    parser = MultipartParser(boundary, callbacks={
+        "on_part_begin": writer.on_part_begin,
+        "on_header_field": writer.on_header_field,
+        "on_header_value": writer.on_header_value,
+        "on_header_end": writer.on_header_end,
+        "on_headers_finished": writer.on_headers_finished,
+        "on_part_data": writer.on_part_data,
+        "on_part_end": writer.on_part_end,
+    })
+    
+    try:
+        async for chunk in request.stream():
+            parser.write(chunk)
+        
+        parser.finalize()
+    except UploadTooLarge:
+        writer.discard()
+        raise too_large
+    except MultipartParseError:
+        writer.discard()
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Malformed multipart upload")
+    except Exception:
+        writer.discard()
+        raise
+    finally:
+        writer.close()
+    
+    if writer.path is None:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=f"Missing file field '{field_name}'")
+    
+    return SpooledUpload(writer.path, writer.file_name, writer.content_type, writer.size)
@@ -9,7 +9,13 @@ from aiogram.enums import ParseMode
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
 from .database.db import init_db, add_admin_user
+from .database.file_counts import reconcile_file_counts, FILE_COUNTS_RECONCILE_INTERVAL
+from .utils.api_logs import maintain_api_logs, API_LOG_ROLLUP_INTERVAL
+from .utils.broadcast import broadcasts
+from .utils.notifications import download_notifications, DOWNLOAD_NOTIFICATION_WINDOW
 from .utils.helpers import create_backup
+from .utils.activity import activity_buffer, ACTIVITY_FLUSH_INTERVAL
+from .utils.counters import file_counters, COUNTER_FLUSH_INTERVAL
 
 # Load environment variables
 load_dotenv()
@@ -95,18 +101,45 @@ async def on_startup():
     
     # Schedule backups
     scheduler.add_job(scheduled_backup, 'interval', hours=BACKUP_INTERVAL)
+    
+    # Schedule buffered activity writes
+    scheduler.add_job(activity_buffer.flush, 'interval', seconds=ACTIVITY_FLUSH_INTERVAL)
+    scheduler.add_job(file_counters.flush, 'interval', seconds=COUNTER_FLUSH_INTERVAL)
+    
+    # Schedule file count repairs
+    scheduler.add_job(reconcile_file_counts, 'interval', hours=FILE_COUNTS_RECONCILE_INTERVAL)
+    
+    # Schedule API log rollups and retention
+    scheduler.add_job(maintain_api_logs, 'interval', minutes=API_LOG_ROLLUP_INTERVAL)
+    
+    # Schedule download digests to file owners
+    scheduler.add_job(download_notifications.flush, 'interval', minutes=DOWNLOAD_NOTIFICATION_WINDOW, args=[bot])
     scheduler.start()
     
+    # Resume broadcasts interrupted by the last shutdown
+    await broadcasts.resume(bot)
+    
     # Log startup
     logging.info(f"Bot started at {datetime.now()}")
 
 async def on_shutdown():
     """Actions to perform on bot shutdown."""
-    # Close storage
-    await storage.close()
-    
-    # Shutdown scheduler
-    scheduler.shutdown()
+    try:
+        # Stop running broadcasts, they resume on the next start
+        await broadcasts.stop()
+        
+        # Send the download digests collected so far
+        await download_notifications.flush(bot)
+        
+        # Close storage
+        await storage.close()
+        
+        # Shutdown scheduler
+        scheduler.shutdown()
+    finally:
+        # Write buffered activity and counters even if shutdown failed
+        activity_buffer.flush()
+        file_counters.flush()
     
     # Log shutdown
     logging.info(f"Bot stopped at {datetime.now()}")
@@ -119,7 +152,8 @@ async def main():
         register_admin_handlers,
         register_file_handlers,
         register_search_handlers,
-        register_callback_handlers
+        register_callback_handlers,
+        register_membership_handlers
     )
     
     register_user_handlers(dp)
@@ -127,11 +161,17 @@ async def main():
     register_file_handlers(dp)
     register_search_handlers(dp)
     register_callback_handlers(dp)
+    register_membership_handlers(dp)
+    
+    # Open one database session per update
+    from .middlewares import DbSessionMiddleware
+    dp.update.outer_middleware(DbSessionMiddleware())
     
     # Start the bot
     await on_startup()
     try:
-        await dp.start_polling(bot)
+        # chat_member updates are only sent when asked for explicitly
+        await dp.start_polling(bot, allowed_updates=dp.resolve_used_update_types())
     finally:
         await on_shutdown()
 
@@ -3,29 +3,133 @@ import logging
 import secrets
 import string
 import hashlib
+import time
+import threading
 import bcrypt
 from datetime import datetime
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, text
+from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
 from dotenv import load_dotenv
 
+from .pool import TimedQueuePool, TimedAsyncQueuePool, get_pool_stats
+
 # Load environment variables
 load_dotenv()
 
 # Get database URL
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///app/database/bot_database.db")
 
+# Drivers usable by the async engine
+ASYNC_DRIVERS = ("sqlite+aiosqlite", "postgresql+asyncpg", "mysql+aiomysql", "mysql+asyncmy")
+
+def get_async_database_url(database_url: str) -> str:
+    """Get the async driver URL for a database URL."""
+    if database_url.split("://", 1)[0] in ASYNC_DRIVERS:
+        return database_url
+    
+    if database_url.startswith("sqlite:///"):
+        return database_url.replace("sqlite:///", "sqlite+aiosqlite:///", 1)
+    
+    if database_url.startswith("postgres://"):
+        return database_url.replace("postgres://", "postgresql+asyncpg://", 1)
+    
+    if database_url.startswith("postgresql://"):
+        return database_url.replace("postgresql://", "postgresql+asyncpg://", 1)
+    
+    for prefix in ("mysql://", "mysql+pymysql://", "mysql+mysqldb://"):
+        if database_url.startswith(prefix):
+            return database_url.replace(prefix, "mysql+aiomysql://", 1)
+    
+    raise ValueError(
+        f"No async driver known for {database_url.split('://', 1)[0]}, "
+        "set ASYNC_DATABASE_URL to the database URL with an async driver"
+    )
+
+# Get async database URL
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or get_async_database_url(DATABASE_URL)
+
+# SQLite connection settings
+SQLITE_JOURNAL_MODE = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+SQLITE_BUSY_TIMEOUT = int(os.getenv("SQLITE_BUSY_TIMEOUT", "5000"))  # milliseconds
+SQLITE_MMAP_SIZE = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))  # bytes
+SQLITE_CACHE_SIZE = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # pages, or KiB if negative
+SQLITE_TEMP_STORE = os.getenv("SQLITE_TEMP_STORE", "MEMORY")
+
+# Connection pool settings (not used for SQLite)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "5"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))  # seconds
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # seconds
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() == "true"
+
+def get_pool_options(poolclass) -> dict:
+    """Get engine pool options for the configured database."""
+    if DATABASE_URL.startswith("sqlite"):
+        return {}
+    
+    return {
+        "poolclass": poolclass,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING
+    }
+
+# Settings cache lifetime, so changes made by another process are picked up
+SETTINGS_CACHE_TTL = float(os.getenv("SETTINGS_CACHE_TTL", "30"))  # seconds
+
 # Create database directory if it doesn't exist
 db_path = DATABASE_URL.replace("sqlite:///", "")
 os.makedirs(os.path.dirname(db_path), exist_ok=True)
 
 # Create engine
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {})
+engine = create_engine(
+    DATABASE_URL,
+    connect_args={"check_same_thread": False} if DATABASE_URL.startswith("sqlite") else {},
+    **get_pool_options(TimedQueuePool)
+)
 
 # Create session
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Create async engine for the bot and API hot paths
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **get_pool_options(TimedAsyncQueuePool))
+
+# Create async session
+AsyncSessionLocal = sessionmaker(bind=async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """Apply SQLite pragmas to a new connection."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute(f"PRAGMA journal_mode={SQLITE_JOURNAL_MODE}")
+    cursor.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT}")
+    cursor.execute(f"PRAGMA synchronous={SQLITE_SYNCHRONOUS}")
+    cursor.execute(f"PRAGMA mmap_size={SQLITE_MMAP_SIZE}")
+    cursor.execute(f"PRAGMA cache_size={SQLITE_CACHE_SIZE}")
+    cursor.execute(f"PRAGMA temp_store={SQLITE_TEMP_STORE}")
+    cursor.close()
+
+# Apply SQLite pragmas on connect
+if DATABASE_URL.startswith("sqlite"):
+    event.listen(engine, "connect", set_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", set_sqlite_pragmas)
+
+def log_sqlite_pragmas():
+    """Log the SQLite pragmas in effect."""
+    if not DATABASE_URL.startswith("sqlite"):
+        return
+    
+    pragmas = ["journal_mode", "busy_timeout", "synchronous", "mmap_size", "cache_size", "temp_store"]
+    
+    with engine.connect() as connection:
+        values = {pragma: connection.execute(text(f"PRAGMA {pragma}")).scalar() for pragma in pragmas}
+    
+    logging.info("SQLite pragmas: " + ", ".join(f"{pragma}={value}" for pragma, value in values.items()))
+
 # Create base
 Base = declarative_base()
 
@@ -37,10 +141,28 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    """Get async database session."""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+def get_engine_pool_stats() -> dict:
+    """Get connection pool statistics for both engines."""
+    return {
+        "sync": get_pool_stats(engine.pool),
+        "async": get_pool_stats(async_engine.sync_engine.pool)
+    }
+
 def init_db():
     """Initialize database."""
     from .models import User, File, Category, Format, Tag, FileDownload, SubscriptionChannel, Settings, Backup
-    Base.metadata.create_all(bind=engine)
+    from .migrations import run_migrations
+    
+    # Apply pending schema migrations
+    run_migrations()
+    
+    # Log SQLite pragmas
+    log_sqlite_pragmas()
     
     # Initialize settings if they don't exist
     db = next(get_db())
@@ -55,6 +177,10 @@ def init_db():
         ]
         db.add_all(settings)
         db.commit()
+    
+    # Load settings into memory
+    load_settings(db)
+    db.close()
 
 def add_admin_user(telegram_id: int):
     """Add admin user."""
@@ -68,6 +194,10 @@ def add_admin_user(telegram_id: int):
         # Update user to admin
         user.is_admin = True
         db.commit()
+        
+        # Drop cached user
+        from ..utils.helpers import invalidate_user
+        invalidate_user(telegram_id)
     else:
         # Create new admin user
         referral_code = f"ref_{secrets.token_hex(8)}"
@@ -100,15 +230,40 @@ def generate_share_code() -> str:
     
     return code
 
+# In-memory copy of the settings table
+_settings_cache = {}
+_settings_loaded_at = None
+_settings_lock = threading.Lock()
+
+def load_settings(db: Session) -> None:
+    """Load the whole settings table into memory."""
+    global _settings_cache, _settings_loaded_at
+    from .models import Settings
+    
+    settings = {setting.key: setting.value for setting in db.query(Settings).all()}
+    
+    with _settings_lock:
+        _settings_cache = settings
+        _settings_loaded_at = time.monotonic()
+
+def invalidate_settings() -> None:
+    """Reload settings from the database on next access."""
+    global _settings_loaded_at
+    
+    with _settings_lock:
+        _settings_loaded_at = None
+
 def get_setting(db: Session, key: str, default: str = None) -> str:
     """Get setting value."""
-    from .models import Settings
-    setting = db.query(Settings).filter(Settings.key == key).first()
+    loaded_at = _settings_loaded_at
     
-    if not setting:
+    if loaded_at is None or time.monotonic() - loaded_at > SETTINGS_CACHE_TTL:
+        load_settings(db)
+    
+    if key not in _settings_cache:
         return default
     
-    return setting.value
+    return _settings_cache[key]
 
 def update_setting(db: Session, key: str, value: str) -> bool:
     """Update setting value."""
@@ -121,4 +276,7 @@ def update_setting(db: Session, key: str, value: str) -> bool:
     setting.value = value
     db.commit()
     
+    # Reload cached settings on next access
+    invalidate_settings()
+    
     return True
\ No newline at end of file
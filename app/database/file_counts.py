@@ -0,0 +1,116 @@
+"""
+Denormalized file counts of categories, formats and tags.
+
+Category.files_count, Format.files_count and Tag.files_count are
+recounted in the same transaction whenever a flush inserts, deletes or
+recategorizes files or changes their tags. reconcile_file_counts()
+rebuilds every counter from scratch and runs as a scheduled job to repair
+any drift from writes made outside the ORM.
+"""
+import os
+import logging
+from itertools import chain
+from sqlalchemy import event, func, inspect, select, update
+from sqlalchemy.orm import Session
+
+from .db import SessionLocal
+from .models import Category, Format, Tag, File, file_tags
+
+# How often the counters are rebuilt from scratch
+FILE_COUNTS_RECONCILE_INTERVAL = int(os.getenv("FILE_COUNTS_RECONCILE_INTERVAL", "24"))  # hours
+
+# Number of files of each row
+FILE_COUNT_QUERIES = {
+    Category: select(func.count()).where(File.category_id == Category.id).scalar_subquery(),
+    Format: select(func.count()).where(File.format_id == Format.id).scalar_subquery(),
+    Tag: select(func.count()).where(file_tags.c.tag_id == Tag.id).scalar_subquery(),
+}
+
+def recount_files(connection, model, ids=None) -> None:
+    """Recount the files of the given rows (all rows if ids is None)."""
+    statement = update(model).values(files_count=FILE_COUNT_QUERIES[model])
+    
+    if ids is not None:
+        statement = statement.where(model.id.in_(ids))
+    
+    connection.execute(statement)
+
+def reconcile_file_counts() -> None:
+    """Rebuild every file counter."""
+    db = SessionLocal()
+    
+    try:
+        for model in FILE_COUNT_QUERIES:
+            recount_files(db.connection(), model)
+        
+        db.commit()
+        logging.info("Reconciled category, format and tag file counts")
+    except Exception as e:
+        db.rollback()
+        logging.error(f"Error reconciling file counts: {e}")
+    finally:
+        db.close()
+
+@event.listens_for(Session, "before_flush")
+def collect_file_count_changes(session, flush_context, instances):
+    """Remember the categories, formats and tags whose files are about to change."""
+    affected = session.info.setdefault("file_count_affected", [])
+    
+    for obj in chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, File):
+            state = inspect(obj)
+            
+            if obj in session.deleted:
+                # Load the tags so their history is known after the flush
+                obj.tags
+            
+            changed = obj in session.new or obj in session.deleted or any(
+                state.attrs[name].history.has_changes()
+                for name in ("category_id", "format_id", "category", "format", "tags")
+            )
+            
+            if not changed:
+                continue
+            
+            if obj in session.dirty and state.key is not None:
+                # The previous values are not in the history if they were never loaded
+                previous = session.connection().execute(
+                    select(File.category_id, File.format_id).where(File.id == obj.id)
+                ).first()
+                
+                if previous:
+                    affected.extend(((Category, previous.category_id), (Format, previous.format_id)))
+            
+            for name, model in (("category_id", Category), ("format_id", Format)):
+                history = state.attrs[name].history
+                affected.extend((model, value) for value in chain(*history) if value is not None)
+            
+            for name in ("category", "format", "tags"):
+                history = state.attrs[name].history
+                affected.extend(value for value in chain(*history) if value is not None)
+        
+        elif isinstance(obj, Tag) and obj not in session.deleted:
+            if inspect(obj).attrs.files.history.has_changes():
+                affected.append(obj)
+
+@event.listens_for(Session, "after_flush")
+def update_file_counts(session, flush_context):
+    """Recount the files of the rows collected before the flush."""
+    affected = session.info.pop("file_count_affected", None)
+    
+    if not affected:
+        return
+    
+    ids = {model: set() for model in FILE_COUNT_QUERIES}
+    
+    for item in affected:
+        model, row_id = item if isinstance(item, tuple) else (type(item), item.id)
+        
+        if model in ids and row_id is not None:
+            ids[model].add(row_id)
+    
+    connection = session.connection()
+    
+    for model, model_ids in ids.items():
+        if model_ids:
+            recount_files(connection, model, model_ids)
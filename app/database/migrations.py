@@ -0,0 +1,460 @@
+"""
+Versioned schema migrations for the database.
+
+Every migration runs once per database and is recorded in the
+`schema_migrations` table. Migration 1 creates the current schema on a
+fresh database, so later migrations must be idempotent: they check for
+the column, index or table before creating it.
+"""
+import os
+import time
+import hashlib
+import logging
+from datetime import datetime
+from typing import Callable, List, Optional, Tuple
+from sqlalchemy import Column, DateTime, Index, Integer, MetaData, String, Table, inspect, select, text
+from sqlalchemy.engine import Engine
+
+from .db import engine, Base
+
+# Backfill settings
+MIGRATION_BATCH_SIZE = int(os.getenv("MIGRATION_BATCH_SIZE", "5000"))
+MIGRATION_BATCH_PAUSE = float(os.getenv("MIGRATION_BATCH_PAUSE", "0.05"))  # seconds between batches
+
+# Applied migrations table
+migration_metadata = MetaData()
+schema_migrations = Table(
+    'schema_migrations',
+    migration_metadata,
+    Column('version', Integer, primary_key=True),
+    Column('name', String(255), nullable=False),
+    Column('applied_at', DateTime, default=datetime.utcnow)
+)
+
+# Registered migrations (version, name, function)
+MIGRATIONS: List[Tuple[int, str, Callable]] = []
+
+def migration(version: int, name: str):
+    """Register a migration."""
+    def decorator(func: Callable) -> Callable:
+        MIGRATIONS.append((version, name, func))
+        return func
+    return decorator
+
+class MigrationContext:
+    """Schema operations available to migrations."""
+    
+    def __init__(self, bind: Engine):
+        self.engine = bind
+        self.dialect = bind.dialect.name
+    
+    def has_table(self, table_name: str) -> bool:
+        """Check if a table exists."""
+        return inspect(self.engine).has_table(table_name)
+    
+    def has_column(self, table_name: str, column_name: str) -> bool:
+        """Check if a column exists."""
+        return any(column["name"] == column_name for column in inspect(self.engine).get_columns(table_name))
+    
+    def has_index(self, table_name: str, index_name: str) -> bool:
+        """Check if an index exists."""
+        return any(index["name"] == index_name for index in inspect(self.engine).get_indexes(table_name))
+    
+    def execute(self, sql: str, **params):
+        """Execute a statement in its own transaction."""
+        with self.engine.begin() as connection:
+            return connection.execute(text(sql), params)
+    
+    def execute_autocommit(self, sql: str, **params):
+        """Execute a statement outside of a transaction."""
+        with self.engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            return connection.execute(text(sql), params)
+    
+    def create_tables(self, *tables: Table):
+        """Create tables that don't exist yet."""
+        Base.metadata.create_all(bind=self.engine, tables=list(tables) or None)
+    
+    def add_column(self, table_name: str, column: Column):
+        """Add a column to an existing table."""
+        if self.has_column(table_name, column.name):
+            return
+        
+        column_type = column.type.compile(dialect=self.engine.dialect)
+        sql = f"ALTER TABLE {table_name} ADD COLUMN {column.name} {column_type}"
+        
+        if column.server_default is not None:
+            sql += f" DEFAULT {column.server_default.arg}"
+        
+        if not column.nullable and column.server_default is not None:
+            sql += " NOT NULL"
+        
+        self.execute(sql)
+    
+    def create_index(self, index: Index):
+        """Create an index without blocking writes where the database supports it."""
+        if self.has_index(index.table.name, index.name):
+            return
+        
+        if self.dialect == "postgresql":
+            # CREATE INDEX CONCURRENTLY can't run inside a transaction
+            columns = ", ".join(column.name for column in index.columns)
+            unique = "UNIQUE " if index.unique else ""
+            self.execute_autocommit(f"CREATE {unique}INDEX CONCURRENTLY IF NOT EXISTS {index.name} ON {index.table.name} ({columns})")
+        elif self.dialect == "mysql":
+            columns = ", ".join(column.name for column in index.columns)
+            unique = "UNIQUE " if index.unique else ""
+            self.execute(f"CREATE {unique}INDEX {index.name} ON {index.table.name} ({columns}) ALGORITHM=INPLACE LOCK=NONE")
+        else:
+            index.create(bind=self.engine, checkfirst=True)
+    
+    def drop_index(self, table_name: str, index_name: str):
+        """Drop an index if it exists."""
+        if not self.has_index(table_name, index_name):
+            return
+        
+        if self.dialect == "postgresql":
+            self.execute_autocommit(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+        elif self.dialect == "mysql":
+            self.execute(f"DROP INDEX {index_name} ON {table_name}")
+        else:
+            self.execute(f"DROP INDEX {index_name}")
+    
+    def backfill(self, table_name: str, set_sql: str, where_sql: Optional[str] = None, batch_size: int = None, **params):
+        """Update a large table in short id-ordered batches.
+        
+        Each batch commits on its own, so writers are only blocked for the
+        duration of one batch.
+        """
+        batch_size = batch_size or MIGRATION_BATCH_SIZE
+        where = f"AND ({where_sql})" if where_sql else ""
+        last_id = 0
+        total = 0
+        
+        while True:
+            with self.engine.begin() as connection:
+                ids = connection.execute(
+                    text(f"SELECT id FROM {table_name} WHERE id > :last_id {where} ORDER BY id LIMIT :batch_size"),
+                    {"last_id": last_id, "batch_size": batch_size, **params}
+                ).scalars().all()
+                
+                if not ids:
+                    break
+                
+                connection.execute(
+                    text(f"UPDATE {table_name} SET {set_sql} WHERE id >= :first_id AND id <= :last_id {where}"),
+                    {"first_id": ids[0], "last_id": ids[-1], **params}
+                )
+            
+            last_id = ids[-1]
+            total += len(ids)
+            time.sleep(MIGRATION_BATCH_PAUSE)
+        
+        logging.info(f"Backfilled {total} rows in {table_name}")
+
+def get_applied_versions(bind: Engine) -> set:
+    """Get versions of applied migrations."""
+    migration_metadata.create_all(bind=bind)
+    
+    with bind.connect() as connection:
+        return set(connection.execute(select(schema_migrations.c.version)).scalars().all())
+
+def run_migrations(bind: Engine = None) -> int:
+    """Apply pending migrations in version order."""
+    from . import models  # noqa: F401 (registers the tables)
+    
+    bind = bind or engine
+    context = MigrationContext(bind)
+    applied = get_applied_versions(bind)
+    count = 0
+    
+    for version, name, func in sorted(MIGRATIONS):
+        if version in applied:
+            continue
+        
+        logging.info(f"Applying migration {version}: {name}")
+        started = time.perf_counter()
+        func(context)
+        
+        with bind.begin() as connection:
+            connection.execute(schema_migrations.insert().values(version=version, name=name, applied_at=datetime.utcnow()))
+        
+        logging.info(f"Applied migration {version} in {time.perf_counter() - started:.1f} s")
+        count += 1
+    
+    if count:
+        # The search index may have been created
+        from .search import reset_search_backend
+        reset_search_backend()
+    
+    return count
+
+@migration(1, "initial schema")
+def initial_schema(context: MigrationContext):
+    context.create_tables()
+
+# Indexes of migration 2 as (table, index, columns). They are listed here
+# instead of read from the models, whose indexes include columns that only
+# later migrations add.
+SECONDARY_INDEXES = [
+    ("users", "ix_users_last_activity", ("last_activity",)),
+    ("users", "ix_users_referred_by", ("referred_by",)),
+    ("users", "ix_users_api_key", ("api_key",)),
+    ("files", "ix_files_category_id", ("category_id",)),
+    ("files", "ix_files_format_id", ("format_id",)),
+    ("files", "ix_files_owner_id", ("owner_id",)),
+    ("files", "ix_files_upload_date", ("upload_date",)),
+    ("file_download_stats", "ix_file_download_stats_file_id_user_id", ("file_id", "user_id")),
+    ("notifications", "ix_notifications_user_id_is_read_created_at", ("user_id", "is_read", "created_at")),
+    ("api_logs", "ix_api_logs_created_at", ("created_at",)),
+]
+
+@migration(2, "secondary indexes for hot queries")
+def secondary_indexes(context: MigrationContext):
+    for table_name, index_name, columns in SECONDARY_INDEXES:
+        # Stand-in table, only the column names matter for CREATE INDEX
+        table = Table(table_name, MetaData(), *(Column(column, Integer) for column in columns))
+        context.create_index(Index(index_name, *(table.c[column] for column in columns)))
+
+# Search document of the files selected by {where}: file name, tag names,
+# category names and format name
+FILES_FTS_SELECT = """
+SELECT f.id, f.file_name,
+    COALESCE((SELECT group_concat(t.name, ' ') FROM file_tags ft JOIN tags t ON t.id = ft.tag_id WHERE ft.file_id = f.id), ''),
+    COALESCE((SELECT c.name_en || ' ' || c.name_ar FROM categories c WHERE c.id = f.category_id), ''),
+    COALESCE((SELECT fm.name FROM formats fm WHERE fm.id = f.format_id), '')
+FROM files f WHERE {where}
+"""
+
+FILES_FTS_INSERT = "INSERT INTO files_fts (rowid, file_name, tags, category, format) " + FILES_FTS_SELECT
+
+def files_fts_refresh(where: str) -> str:
+    """Trigger body that rebuilds the search documents of the selected files."""
+    return (
+        f"DELETE FROM files_fts WHERE rowid IN (SELECT f.id FROM files f WHERE {where}); "
+        + FILES_FTS_INSERT.format(where=where).strip() + ";"
+    )
+
+FILES_FTS_TRIGGERS = {
+    "files_fts_insert": "AFTER INSERT ON files BEGIN " + FILES_FTS_INSERT.format(where="f.id = new.id").strip() + "; END",
+    "files_fts_update": "AFTER UPDATE OF file_name, category_id, format_id ON files BEGIN "
+        "DELETE FROM files_fts WHERE rowid = old.id; " + FILES_FTS_INSERT.format(where="f.id = new.id").strip() + "; END",
+    "files_fts_delete": "AFTER DELETE ON files BEGIN DELETE FROM files_fts WHERE rowid = old.id; END",
+    "file_tags_fts_insert": "AFTER INSERT ON file_tags BEGIN " + files_fts_refresh("f.id = new.file_id") + " END",
+    "file_tags_fts_delete": "AFTER DELETE ON file_tags BEGIN " + files_fts_refresh("f.id = old.file_id") + " END",
+    "tags_fts_update": "AFTER UPDATE OF name ON tags BEGIN "
+        + files_fts_refresh("f.id IN (SELECT file_id FROM file_tags WHERE tag_id = new.id)") + " END",
+    "categories_fts_update": "AFTER UPDATE OF name_en, name_ar ON categories BEGIN "
+        + files_fts_refresh("f.category_id = new.id") + " END",
+    "formats_fts_update": "AFTER UPDATE OF name ON formats BEGIN "
+        + files_fts_refresh("f.format_id = new.id") + " END",
+}
+
+FILES_SEARCH_VECTOR_FUNCTION = """
+CREATE OR REPLACE FUNCTION files_search_vector_update() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector :=
+        setweight(to_tsvector('simple', COALESCE(NEW.file_name, '')), 'A') ||
+        setweight(to_tsvector('simple', COALESCE((SELECT string_agg(t.name, ' ') FROM file_tags ft JOIN tags t ON t.id = ft.tag_id WHERE ft.file_id = NEW.id), '')), 'B') ||
+        setweight(to_tsvector('simple', COALESCE((SELECT c.name_en || ' ' || c.name_ar FROM categories c WHERE c.id = NEW.category_id), '')), 'C') ||
+        setweight(to_tsvector('simple', COALESCE((SELECT fm.name FROM formats fm WHERE fm.id = NEW.format_id), '')), 'C');
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql
+"""
+
+# Touching file_name re-runs the files trigger, which rebuilds the vector
+FILES_SEARCH_TOUCH_FUNCTION = """
+CREATE OR REPLACE FUNCTION files_search_vector_touch() RETURNS trigger AS $$
+BEGIN
+    IF TG_TABLE_NAME = 'file_tags' THEN
+        UPDATE files SET file_name = file_name WHERE id = COALESCE(NEW.file_id, OLD.file_id);
+    ELSIF TG_TABLE_NAME = 'tags' THEN
+        UPDATE files SET file_name = file_name WHERE id IN (SELECT file_id FROM file_tags WHERE tag_id = NEW.id);
+    ELSIF TG_TABLE_NAME = 'categories' THEN
+        UPDATE files SET file_name = file_name WHERE category_id = NEW.id;
+    ELSE
+        UPDATE files SET file_name = file_name WHERE format_id = NEW.id;
+    END IF;
+    RETURN NULL;
+END
+$$ LANGUAGE plpgsql
+"""
+
+@migration(3, "full-text search index for files")
+def files_full_text_search(context: MigrationContext):
+    if context.dialect == "sqlite":
+        try:
+            context.execute(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS files_fts USING fts5("
+                "file_name, tags, category, format, tokenize = 'unicode61 remove_diacritics 2')"
+            )
+        except Exception as e:
+            # SQLite built without FTS5, search keeps using LIKE
+            logging.error(f"Error creating files_fts, full-text search disabled: {e}")
+            return
+        
+        for name, body in FILES_FTS_TRIGGERS.items():
+            context.execute(f"CREATE TRIGGER IF NOT EXISTS {name} {body}")
+        
+        # Index existing files in id ranges
+        context.execute("DELETE FROM files_fts")
+        max_id = context.execute("SELECT COALESCE(MAX(id), 0) FROM files").scalar()
+        
+        for first_id in range(1, max_id + 1, MIGRATION_BATCH_SIZE):
+            context.execute(
+                FILES_FTS_INSERT.format(where="f.id >= :first_id AND f.id < :next_id"),
+                first_id=first_id,
+                next_id=first_id + MIGRATION_BATCH_SIZE
+            )
+            time.sleep(MIGRATION_BATCH_PAUSE)
+    
+    elif context.dialect == "postgresql":
+        if not context.has_column("files", "search_vector"):
+            context.execute("ALTER TABLE files ADD COLUMN search_vector tsvector")
+        
+        context.execute(FILES_SEARCH_VECTOR_FUNCTION)
+        context.execute(FILES_SEARCH_TOUCH_FUNCTION)
+        context.execute("DROP TRIGGER IF EXISTS files_search_vector ON files")
+        context.execute(
+            "CREATE TRIGGER files_search_vector BEFORE INSERT OR UPDATE OF file_name, category_id, format_id ON files "
+            "FOR EACH ROW EXECUTE FUNCTION files_search_vector_update()"
+        )
+        
+        for table_name, event in (
+            ("file_tags", "INSERT OR DELETE"),
+            ("tags", "UPDATE OF name"),
+            ("categories", "UPDATE OF name_en, name_ar"),
+            ("formats", "UPDATE OF name"),
+        ):
+            context.execute(f"DROP TRIGGER IF EXISTS {table_name}_search_vector ON {table_name}")
+            context.execute(
+                f"CREATE TRIGGER {table_name}_search_vector AFTER {event} ON {table_name} "
+                "FOR EACH ROW EXECUTE FUNCTION files_search_vector_touch()"
+            )
+        
+        context.backfill("files", "file_name = file_name")
+        context.execute_autocommit(
+            "CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_files_search_vector ON files USING GIN (search_vector)"
+        )
+
+@migration(4, "denormalized file counts")
+def denormalized_file_counts(context: MigrationContext):
+    for table_name, foreign_key in (("categories", "files.category_id"), ("formats", "files.format_id")):
+        context.add_column(table_name, Column("files_count", Integer, nullable=False, server_default="0"))
+        context.backfill(table_name, f"files_count = (SELECT COUNT(*) FROM files WHERE {foreign_key} = {table_name}.id)")
+    
+    context.add_column("tags", Column("files_count", Integer, nullable=False, server_default="0"))
+    context.backfill("tags", "files_count = (SELECT COUNT(*) FROM file_tags WHERE file_tags.tag_id = tags.id)")
+
+@migration(5, "hashed api keys")
+def hashed_api_keys(context: MigrationContext):
+    from .models import User
+    
+    context.add_column("users", Column("api_key_hash", String(64), nullable=True))
+    
+    # A key shared by several users can't be told apart, and its hash
+    # would break the unique index, so those users get no key
+    with context.engine.begin() as connection:
+        shared = connection.execute(text(
+            "SELECT id FROM users WHERE api_key IN "
+            "(SELECT api_key FROM users WHERE api_key IS NOT NULL GROUP BY api_key HAVING COUNT(*) > 1) "
+            "ORDER BY id"
+        )).scalars().all()
+        
+        if shared:
+            connection.execute(text("UPDATE users SET api_key = NULL WHERE id = :id"), [{"id": user_id} for user_id in shared])
+            logging.warning(f"Cleared API keys shared by several users, they must generate new ones: user ids {shared}")
+    
+    for index in User.__table__.indexes:
+        if index.name == "ix_users_api_key_hash":
+            context.create_index(index)
+    
+    # Replace plaintext keys with their hashes
+    total = 0
+    while True:
+        with context.engine.begin() as connection:
+            rows = connection.execute(
+                text("SELECT id, api_key FROM users WHERE api_key IS NOT NULL ORDER BY id LIMIT :batch_size"),
+                {"batch_size": MIGRATION_BATCH_SIZE}
+            ).all()
+            
+            if not rows:
+                break
+            
+            connection.execute(
+                text("UPDATE users SET api_key_hash = :key_hash, api_key = NULL WHERE id = :id"),
+                [{"id": row.id, "key_hash": hashlib.sha256(row.api_key.encode()).hexdigest()} for row in rows]
+            )
+        
+        total += len(rows)
+        time.sleep(MIGRATION_BATCH_PAUSE)
+    
+    logging.info(f"Hashed {total} API keys")
+
+@migration(6, "api log latency")
+def api_log_latency(context: MigrationContext):
+    context.add_column("api_logs", Column("latency_ms", Integer, nullable=True))
+
+@migration(7, "api log rollups")
+def api_log_rollups(context: MigrationContext):
+    from .models import ApiLogRollup
+    
+    context.create_tables(ApiLogRollup.__table__)
+
+@migration(8, "broadcast jobs")
+def broadcast_jobs(context: MigrationContext):
+    from .models import BroadcastJob
+    
+    context.create_tables(BroadcastJob.__table__)
+
+@migration(9, "channel members")
+def channel_members(context: MigrationContext):
+    from .models import ChannelMember
+    
+    context.create_tables(ChannelMember.__table__)
+
+@migration(10, "drop legacy api key index")
+def drop_legacy_api_key_index(context: MigrationContext):
+    # Keys are looked up by hash since migration 5, which also cleared api_key
+    context.drop_index("users", "ix_users_api_key")
+
+@migration(11, "unique download records")
+def unique_download_records(context: MigrationContext):
+    from .models import FileDownload
+    
+    index_name = "ix_file_download_stats_file_id_user_id"
+    
+    if any(
+        index["name"] == index_name and index["unique"]
+        for index in inspect(context.engine).get_indexes("file_download_stats")
+    ):
+        return
+    
+    # Merge duplicate (file, user) records into the oldest one
+    with context.engine.begin() as connection:
+        groups = connection.execute(text(
+            "SELECT MIN(id) AS id, file_id, user_id, SUM(download_count) AS download_count, "
+            "MIN(first_download) AS first_download, MAX(last_download) AS last_download "
+            "FROM file_download_stats GROUP BY file_id, user_id HAVING COUNT(*) > 1"
+        )).all()
+        
+        if groups:
+            connection.execute(
+                text(
+                    "UPDATE file_download_stats SET download_count = :download_count, "
+                    "first_download = :first_download, last_download = :last_download WHERE id = :id"
+                ),
+                [row._asdict() for row in groups]
+            )
+            connection.execute(
+                text("DELETE FROM file_download_stats WHERE file_id = :file_id AND user_id = :user_id AND id <> :id"),
+                [{"id": row.id, "file_id": row.file_id, "user_id": row.user_id} for row in groups]
+            )
+    
+    logging.info(f"Merged duplicate download records of {len(groups)} (file, user) pairs")
+    
+    context.drop_index("file_download_stats", index_name)
+    
+    for index in FileDownload.__table__.indexes:
+        if index.name == index_name:
+            context.create_index(index)
@@ -3,11 +3,10 @@ Database models for the bot.
 """
 import uuid
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Table, Float, Text, LargeBinary
-from sqlalchemy.orm import relationship
-from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Table, Float, Text, LargeBinary, Index
+from sqlalchemy.orm import query_expression, relationship
 
-Base = declarative_base()
+from .db import Base
 
 # Association table for file tags
 file_tags = Table(
@@ -41,10 +40,11 @@ class User(Base):
     is_banned = Column(Boolean, default=False)
     can_upload = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
-    last_activity = Column(DateTime, default=datetime.utcnow)
+    last_activity = Column(DateTime, default=datetime.utcnow, index=True)
     referral_code = Column(String(255), unique=True, nullable=False)
-    referred_by = Column(Integer, ForeignKey('users.id'), nullable=True)
-    api_key = Column(String(255), nullable=True)
+    referred_by = Column(Integer, ForeignKey('users.id'), nullable=True, index=True)
+    api_key = Column(String(255), nullable=True)  # legacy plaintext key, cleared by migration 5
+    api_key_hash = Column(String(64), nullable=True, unique=True, index=True)
     
     # Relationships
     files = relationship('File', back_populates='owner')
@@ -62,6 +62,7 @@ class Category(Base):
     parent_id = Column(Integer, ForeignKey('categories.id'), nullable=True)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    files_count = Column(Integer, nullable=False, default=0, server_default='0')
     
     # Relationships
     subcategories = relationship('Category', backref='parent', remote_side=[id])
@@ -79,6 +80,7 @@ class Format(Base):
     category_id = Column(Integer, ForeignKey('categories.id'), nullable=True)
     is_active = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    files_count = Column(Integer, nullable=False, default=0, server_default='0')
     
     # Relationships
     category = relationship('Category', back_populates='formats')
@@ -91,6 +93,7 @@ class Tag(Base):
     id = Column(Integer, primary_key=True)
     name = Column(String(255), nullable=False, unique=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    files_count = Column(Integer, nullable=False, default=0, server_default='0')
     
     # Relationships
     files = relationship('File', secondary=file_tags, back_populates='tags')
@@ -106,21 +109,24 @@ class File(Base):
     file_size = Column(Integer, nullable=False)
     file_type = Column(String(50), nullable=False)
     message_id = Column(Integer, nullable=False)
-    category_id = Column(Integer, ForeignKey('categories.id'), nullable=True)
-    format_id = Column(Integer, ForeignKey('formats.id'), nullable=True)
-    owner_id = Column(Integer, ForeignKey('users.id'), nullable=False)
+    category_id = Column(Integer, ForeignKey('categories.id'), nullable=True, index=True)
+    format_id = Column(Integer, ForeignKey('formats.id'), nullable=True, index=True)
+    owner_id = Column(Integer, ForeignKey('users.id'), nullable=False, index=True)
     source_url = Column(String(255), nullable=True)
     share_link = Column(String(255), nullable=False)
     share_code = Column(String(255), nullable=False, unique=True)
     password = Column(String(255), nullable=True)
     is_encrypted = Column(Boolean, default=False)
-    upload_date = Column(DateTime, default=datetime.utcnow)
+    upload_date = Column(DateTime, default=datetime.utcnow, index=True)
     expiry_date = Column(DateTime, nullable=True)
     download_count = Column(Integer, default=0)
     view_count = Column(Integer, default=0)
     rating = Column(Float, default=0.0)
     rating_count = Column(Integer, default=0)
     
+    # Search relevance, loaded by search queries with with_expression()
+    search_rank = query_expression()
+    
     # Relationships
     category = relationship('Category', back_populates='files')
     format = relationship('Format', back_populates='files')
@@ -133,6 +139,9 @@ class File(Base):
 class FileDownload(Base):
     """File download model."""
     __tablename__ = 'file_download_stats'
+    __table_args__ = (
+        Index('ix_file_download_stats_file_id_user_id', 'file_id', 'user_id', unique=True),
+    )
     
     id = Column(Integer, primary_key=True)
     file_id = Column(Integer, ForeignKey('files.id'), nullable=False)
@@ -184,6 +193,19 @@ class SubscriptionChannel(Base):
     is_required = Column(Boolean, default=True)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+class ChannelMember(Base):
+    """Membership of a user in a subscription channel, kept from chat_member updates."""
+    __tablename__ = 'channel_members'
+    __table_args__ = (
+        Index('ix_channel_members_telegram_id_channel_id', 'telegram_id', 'channel_id', unique=True),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    channel_id = Column(String(255), nullable=False)  # as configured in subscription_channels
+    telegram_id = Column(Integer, nullable=False)
+    is_member = Column(Boolean, nullable=False, default=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
 class Settings(Base):
     """Settings model."""
     __tablename__ = 'settings'
@@ -207,6 +229,9 @@ class Backup(Base):
 class Notification(Base):
     """Notification model."""
     __tablename__ = 'notifications'
+    __table_args__ = (
+        Index('ix_notifications_user_id_is_read_created_at', 'user_id', 'is_read', 'created_at'),
+    )
     
     id = Column(Integer, primary_key=True)
     user_id = Column(Integer, ForeignKey('users.id'), nullable=False)
@@ -228,9 +253,52 @@ class ApiLog(Base):
     endpoint = Column(String(255), nullable=False)
     method = Column(String(10), nullable=False)
     status_code = Column(Integer, nullable=False)
+    latency_ms = Column(Integer, nullable=True)
     ip_address = Column(String(50), nullable=True)
     user_agent = Column(String(255), nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    
+    # Relationships
+    user = relationship('User')
+
+class ApiLogRollup(Base):
+    """Hourly API usage per endpoint, status and user."""
+    __tablename__ = 'api_log_rollups'
+    
+    id = Column(Integer, primary_key=True)
+    hour = Column(DateTime, nullable=False, index=True)
+    endpoint = Column(String(255), nullable=False)
+    method = Column(String(10), nullable=False)
+    status_code = Column(Integer, nullable=False)
+    user_id = Column(Integer, ForeignKey('users.id'), nullable=True)
+    request_count = Column(Integer, nullable=False, default=0)
+    latency_p50_ms = Column(Integer, nullable=True)
+    latency_p95_ms = Column(Integer, nullable=True)
+    
+    # Relationships
+    user = relationship('User')
+
+class BroadcastJob(Base):
+    """Broadcast to users, resumable from the last recipient id sent."""
+    __tablename__ = 'broadcast_jobs'
+    
+    id = Column(Integer, primary_key=True)
+    created_by = Column(Integer, ForeignKey('users.id'), nullable=True)
+    audience = Column(String(20), nullable=False, default='all')  # all, active
+    active_days = Column(Integer, nullable=True)
+    message = Column(Text, nullable=False)
+    status = Column(String(20), nullable=False, default='running', index=True)  # running, done, cancelled, failed
+    last_user_id = Column(Integer, nullable=False, default=0)  # recipients are sent in users.id order
+    total_count = Column(Integer, nullable=False, default=0)
+    sent_count = Column(Integer, nullable=False, default=0)
+    failed_count = Column(Integer, nullable=False, default=0)
+    admin_chat_id = Column(Integer, nullable=True)
+    status_message_id = Column(Integer, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime, nullable=True)
     
     # Relationships
-    user = relationship('User')
\ No newline at end of file
+    creator = relationship('User')
+
+# Keep the denormalized file counts in sync (registers session events)
+from . import file_counts  # noqa: E402,F401
\ No newline at end of file
@@ -0,0 +1,69 @@
+"""
+Connection pool instrumentation for the database engines.
+"""
+import time
+import threading
+from typing import Any, Dict
+from sqlalchemy import exc
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
+
+class TimedPoolMixin:
+    """Record how long callers wait for a pooled connection."""
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._stats_lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+    
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - started
+            with self._stats_lock:
+                self.checkouts += 1
+                self.total_wait += waited
+                self.max_wait = max(self.max_wait, waited)
+    
+    def wait_stats(self) -> Dict[str, Any]:
+        """Get checkout wait statistics."""
+        with self._stats_lock:
+            return {
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(self.total_wait / self.checkouts * 1000, 3) if self.checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait * 1000, 3)
+            }
+
+class TimedQueuePool(TimedPoolMixin, QueuePool):
+    """Queue pool with checkout wait statistics."""
+
+class TimedAsyncQueuePool(TimedPoolMixin, AsyncAdaptedQueuePool):
+    """Async queue pool with checkout wait statistics."""
+
+def get_pool_stats(pool) -> Dict[str, Any]:
+    """Get statistics for a connection pool."""
+    stats = {"pool_class": type(pool).__name__}
+    
+    if isinstance(pool, QueuePool):
+        stats.update({
+            "size": pool.size(),
+            "checked_in": pool.checkedin(),
+            "checked_out": pool.checkedout(),
+            "overflow": pool.overflow(),
+            "max_overflow": pool._max_overflow,
+            "timeout": pool.timeout()
+        })
+    
+    if isinstance(pool, TimedPoolMixin):
+        stats.update(pool.wait_stats())
+    
+    return stats
@@ -0,0 +1,150 @@
+"""
+Full-text file search for the bot.
+
+On SQLite the `files_fts` FTS5 table (created by a migration and kept in
+sync by triggers) indexes file names, tag names, category names and format
+names, with the file id as rowid. On PostgreSQL the same text is stored in
+the `files.search_vector` tsvector column. Any other database, or a SQLite
+build without FTS5, falls back to a LIKE match on the file name.
+"""
+import os
+import re
+import time
+from typing import Optional
+from sqlalchemy import Integer, cast, column, func, inspect, literal, literal_column, table
+
+from .db import engine
+from .models import File
+
+# Column weights for bm25 (file_name, tags, category, format)
+FTS_WEIGHTS = (10.0, 5.0, 2.0, 2.0)
+
+# Relevance is scaled to an integer for keyset cursors
+RELEVANCE_SCALE = 1000000
+
+# Seconds before the LIKE fallback checks again for a search index, which
+# another process may create by running the migrations
+SEARCH_BACKEND_RECHECK = float(os.getenv("SEARCH_BACKEND_RECHECK", "60"))
+
+files_fts = table('files_fts', column('rowid'))
+
+_backend: Optional[str] = None
+_like_checked_at: Optional[float] = None
+
+def detect_search_backend() -> str:
+    """Detect the full-text search backend of the database."""
+    inspector = inspect(engine)
+    
+    if engine.dialect.name == "sqlite" and inspector.has_table("files_fts"):
+        return "fts5"
+    
+    if engine.dialect.name == "postgresql" and any(
+        column["name"] == "search_vector" for column in inspector.get_columns("files")
+    ):
+        return "tsvector"
+    
+    return "like"
+
+def get_search_backend() -> str:
+    """Get the full-text search backend of the database ("fts5", "tsvector" or "like").
+    
+    A search index never goes away once created, so only its presence is
+    cached for good.
+    """
+    global _backend, _like_checked_at
+    
+    if _backend is not None:
+        return _backend
+    
+    now = time.monotonic()
+    
+    if _like_checked_at is not None and now - _like_checked_at < SEARCH_BACKEND_RECHECK:
+        return "like"
+    
+    backend = detect_search_backend()
+    
+    if backend == "like":
+        _like_checked_at = now
+    else:
+        _backend = backend
+    
+    return backend
+
+def reset_search_backend() -> None:
+    """Detect the search backend again on next use."""
+    global _backend, _like_checked_at
+    
+    _backend = None
+    _like_checked_at = None
+
+def get_search_terms(text: str) -> list:
+    """Split a search string into word tokens."""
+    return re.findall(r"\w+", text or "", re.UNICODE)
+
+def build_fts5_query(text: str) -> Optional[str]:
+    """Build an FTS5 MATCH expression where every word is a prefix match."""
+    terms = get_search_terms(text)
+    
+    if not terms:
+        return None
+    
+    return " ".join(f'"{term}"*' for term in terms)
+
+def build_tsquery(text: str) -> Optional[str]:
+    """Build a to_tsquery expression where every word is a prefix match."""
+    terms = get_search_terms(text)
+    
+    if not terms:
+        return None
+    
+    return " & ".join(f"{term}:*" for term in terms)
+
+def apply_file_search(query, text: str, rank: bool = True):
+    """Filter a File query or select() by a search string and order it by relevance.
+    
+    The best matches come first; any order_by added by the caller afterwards
+    only breaks ties. With rank=False the query is only filtered, for
+    callers that page by their own order.
+    """
+    backend = get_search_backend()
+    
+    if backend == "fts5":
+        match = build_fts5_query(text)
+        
+        if match is None:
+            return query.where(File.id.is_(None))
+        
+        fts = literal_column("files_fts")
+        query = query.join(files_fts, files_fts.c.rowid == File.id).where(fts.op("MATCH")(match))
+        return query.order_by(func.bm25(fts, *FTS_WEIGHTS)) if rank else query
+    
+    if backend == "tsvector":
+        tsquery_text = build_tsquery(text)
+        
+        if tsquery_text is None:
+            return query.where(File.id.is_(None))
+        
+        vector = literal_column("files.search_vector")
+        tsquery = func.to_tsquery("simple", tsquery_text)
+        query = query.where(vector.op("@@")(tsquery))
+        return query.order_by(func.ts_rank_cd(vector, tsquery).desc()) if rank else query
+    
+    return query.where(File.file_name.ilike(f"%{text}%"))
+
+def get_search_relevance(text: str):
+    """Get the relevance of the rows of a query filtered by apply_file_search.
+    
+    The relevance is a non-negative integer, higher for better matches, so
+    result pages can be keyed on (relevance, id). It is 0 for every row
+    on the LIKE fallback.
+    """
+    backend = get_search_backend()
+    
+    if backend == "fts5" and build_fts5_query(text) is not None:
+        relevance = -func.bm25(literal_column("files_fts"), *FTS_WEIGHTS)
+    elif backend == "tsvector" and build_tsquery(text) is not None:
+        relevance = func.ts_rank_cd(literal_column("files.search_vector"), func.to_tsquery("simple", build_tsquery(text)))
+    else:
+        return literal(0)
+    
+    return cast(func.round(relevance * RELEVANCE_SCALE), Integer)
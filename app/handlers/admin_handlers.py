@@ -4,24 +4,28 @@ from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 import os
+import logging
 from datetime import datetime, timedelta
+from sqlalchemy.orm import Session
 
-from ..database.db import get_db, update_setting, create_backup, restore_backup
+from ..database.db import update_setting
 from ..database.models import User, File, Category, Format, SubscriptionChannel, Settings, Backup
 from ..utils.states import AdminStates
 from ..utils.helpers import (
-    get_user_language, is_admin, get_active_users,
-    get_total_storage_used, get_file_size_str
+    get_user_language, is_admin, get_active_users, get_cached_user,
+    get_total_storage_used, get_file_size_str,
+    create_backup, restore_backup
+)
+from ..utils.broadcast import (
+    broadcasts, count_recipients, create_broadcast_job,
+    format_broadcast_progress, broadcast_progress_markup
 )
 from ..localization.strings import get_string
 
 router = Router()
 
-async def admin_command(message: Message, state: FSMContext):
+async def admin_command(message: Message, state: FSMContext, db: Session):
     """Handle /admin command."""
-    # Get database session
-    db = next(get_db())
-    
     # Check if user is admin
     if not is_admin(message.from_user.id, db):
         # Get user language
@@ -56,11 +60,8 @@ async def admin_command(message: Message, state: FSMContext):
         reply_markup=builder.as_markup()
     )
 
-async def handle_admin_users(callback: CallbackQuery, state: FSMContext):
+async def handle_admin_users(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle admin users."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -90,11 +91,8 @@ async def handle_admin_users(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_admin_categories(callback: CallbackQuery, state: FSMContext):
+async def handle_admin_categories(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle admin categories."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -125,11 +123,8 @@ async def handle_admin_categories(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_admin_formats(callback: CallbackQuery, state: FSMContext):
+async def handle_admin_formats(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle admin formats."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -159,11 +154,8 @@ async def handle_admin_formats(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_admin_subscriptions(callback: CallbackQuery, state: FSMContext):
+async def handle_admin_subscriptions(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle admin subscriptions."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -193,11 +185,8 @@ async def handle_admin_subscriptions(callback: CallbackQuery, state: FSMContext)
     # Answer callback
     await callback.answer()
 
-async def handle_admin_settings(callback: CallbackQuery, state: FSMContext):
+async def handle_admin_settings(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle admin settings."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -225,11 +214,8 @@ async def handle_admin_settings(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_admin_statistics(callback: CallbackQuery, state: FSMContext):
+async def handle_admin_statistics(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle admin statistics."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -264,11 +250,8 @@ async def handle_admin_statistics(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_admin_backup(callback: CallbackQuery, state: FSMContext):
+async def handle_admin_backup(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle admin backup."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -304,11 +287,8 @@ async def handle_admin_backup(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_admin_broadcast(callback: CallbackQuery, state: FSMContext):
+async def handle_admin_broadcast(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle admin broadcast."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -331,11 +311,8 @@ async def handle_admin_broadcast(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_create_backup(callback: CallbackQuery, state: FSMContext):
+async def handle_create_backup(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle create backup."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -379,11 +356,8 @@ async def handle_create_backup(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_backup_selection(callback: CallbackQuery, state: FSMContext):
+async def handle_backup_selection(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle backup selection."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -417,11 +391,8 @@ async def handle_backup_selection(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_restore_backup(callback: CallbackQuery, state: FSMContext):
+async def handle_restore_backup(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle restore backup."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -466,11 +437,8 @@ async def handle_restore_backup(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_delete_backup(callback: CallbackQuery, state: FSMContext):
+async def handle_delete_backup(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle delete backup."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -517,11 +485,8 @@ async def handle_delete_backup(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_broadcast_all(callback: CallbackQuery, state: FSMContext):
+async def handle_broadcast_all(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle broadcast to all users."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -544,11 +509,8 @@ async def handle_broadcast_all(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_broadcast_active(callback: CallbackQuery, state: FSMContext):
+async def handle_broadcast_active(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle broadcast to active users."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -571,11 +533,8 @@ async def handle_broadcast_active(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_broadcast_message(message: Message, state: FSMContext):
+async def handle_broadcast_message(message: Message, state: FSMContext, db: Session):
     """Handle broadcast message input."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(message.from_user.id, db)
     
@@ -590,10 +549,7 @@ async def handle_broadcast_message(message: Message, state: FSMContext):
     await state.set_state(AdminStates.confirming_broadcast)
     
     # Get users count
-    if broadcast_type == 'all':
-        users_count = db.query(User).count()
-    else:  # active
-        users_count = len(get_active_users(db, 7))
+    users_count = count_recipients(db, broadcast_type)
     
     # Create confirmation keyboard
     builder = InlineKeyboardBuilder()
@@ -606,11 +562,8 @@ async def handle_broadcast_message(message: Message, state: FSMContext):
         reply_markup=builder.as_markup()
     )
 
-async def handle_confirm_broadcast(callback: CallbackQuery, state: FSMContext):
+async def handle_confirm_broadcast(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle confirm broadcast."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -619,37 +572,25 @@ async def handle_confirm_broadcast(callback: CallbackQuery, state: FSMContext):
     broadcast_type = data.get('broadcast_type', 'all')
     broadcast_message = data.get('broadcast_message', '')
     
-    # Send broadcasting message
-    await callback.message.edit_text("⏳ Broadcasting message...")
-    
     try:
-        # Get users
-        if broadcast_type == 'all':
-            users = db.query(User).all()
-        else:  # active
-            users = get_active_users(db, 7)
-        
-        # Send message to users
-        sent_count = 0
-        for user in users:
-            try:
-                await callback.bot.send_message(
-                    chat_id=user.telegram_id,
-                    text=broadcast_message
-                )
-                sent_count += 1
-            except Exception as e:
-                # Log error
-                logging.error(f"Error sending broadcast to user {user.telegram_id}: {e}")
-        
-        # Send success message
-        builder = InlineKeyboardBuilder()
-        builder.button(text=get_string("back_button", lang), callback_data="back_to_admin")
+        # Create broadcast job, the status message shows its progress
+        admin = get_cached_user(db, callback.from_user.id)
+        job = create_broadcast_job(
+            db,
+            admin.id if admin else None,
+            broadcast_type,
+            broadcast_message,
+            callback.message.chat.id,
+            callback.message.message_id
+        )
         
         await callback.message.edit_text(
-            f"✅ Broadcast sent successfully to {sent_count} users!",
-            reply_markup=builder.as_markup()
+            format_broadcast_progress(job),
+            reply_markup=broadcast_progress_markup(job, lang)
         )
+        
+        # Send in the background
+        broadcasts.start(callback.bot, job.id)
     except Exception as e:
         # Send error message
         builder = InlineKeyboardBuilder()
@@ -666,6 +607,29 @@ async def handle_confirm_broadcast(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
+async def handle_stop_broadcast(callback: CallbackQuery, db: Session):
+    """Handle cancelling a running broadcast."""
+    # Check if user is admin
+    if not is_admin(callback.from_user.id, db):
+        await callback.answer(get_string("not_authorized", get_user_language(callback.from_user.id, db)))
+        return
+    
+    # Get user language
+    lang = get_user_language(callback.from_user.id, db)
+    
+    # Cancel broadcast
+    job_id = int(callback.data.split("_")[2])
+    job = await broadcasts.cancel(job_id)
+    
+    if job:
+        await callback.message.edit_text(
+            format_broadcast_progress(job),
+            reply_markup=broadcast_progress_markup(job, lang)
+        )
+    
+    # Answer callback
+    await callback.answer()
+
 def register_admin_handlers(dp):
     """Register admin handlers."""
     # Admin command
@@ -692,6 +656,7 @@ def register_admin_handlers(dp):
     dp.callback_query.register(handle_broadcast_active, F.data == "broadcast_active")
     dp.message.register(handle_broadcast_message, AdminStates.entering_broadcast_message)
     dp.callback_query.register(handle_confirm_broadcast, F.data == "confirm_broadcast")
+    dp.callback_query.register(handle_stop_broadcast, F.data.startswith("stop_broadcast_"))
     
     # Add router to dispatcher
     dp.include_router(router)
\ No newline at end of file
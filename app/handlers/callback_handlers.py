@@ -2,25 +2,19 @@ from aiogram import Router, F
 from aiogram.types import CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from sqlalchemy.orm import Session
 
-from ..database.db import get_db
 from ..database.models import User, File
-from ..utils.helpers import get_user_language, check_subscription, get_subscription_buttons
+from ..utils.helpers import get_user_language, is_admin, invalidate_user, check_subscription, get_subscription_buttons
 from ..localization.strings import get_string
 
 router = Router()
 
-async def handle_back_to_main(callback: CallbackQuery, state: FSMContext):
+async def handle_back_to_main(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle back to main menu."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
-    # Get user
-    user = db.query(User).filter(User.telegram_id == callback.from_user.id).first()
-    
     # Create main menu keyboard
     builder = InlineKeyboardBuilder()
     builder.button(text=get_string("upload_button", lang), callback_data="upload")
@@ -31,7 +25,7 @@ async def handle_back_to_main(callback: CallbackQuery, state: FSMContext):
     builder.button(text=get_string("help_button", lang), callback_data="help")
     
     # Add admin button if user is admin
-    if user and user.is_admin:
+    if is_admin(callback.from_user.id, db):
         builder.button(text=get_string("admin_button", lang), callback_data="admin")
     
     builder.adjust(2)
@@ -48,11 +42,8 @@ async def handle_back_to_main(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_back_to_settings(callback: CallbackQuery, state: FSMContext):
+async def handle_back_to_settings(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle back to settings."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -72,11 +63,8 @@ async def handle_back_to_settings(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_back_to_admin(callback: CallbackQuery, state: FSMContext):
+async def handle_back_to_admin(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle back to admin panel."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -102,10 +90,10 @@ async def handle_back_to_admin(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_back_to_backup(callback: CallbackQuery, state: FSMContext):
+async def handle_back_to_backup(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle back to backup management."""
     from .admin_handlers import handle_admin_backup
-    await handle_admin_backup(callback, state)
+    await handle_admin_backup(callback, state, db)
 
 async def handle_language(callback: CallbackQuery, state: FSMContext):
     """Handle language selection."""
@@ -125,11 +113,8 @@ async def handle_language(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_set_language(callback: CallbackQuery, state: FSMContext):
+async def handle_set_language(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle set language."""
-    # Get database session
-    db = next(get_db())
-    
     # Get language code
     lang_code = callback.data.split("_")[2]
     
@@ -138,18 +123,16 @@ async def handle_set_language(callback: CallbackQuery, state: FSMContext):
     if user:
         user.language_code = lang_code
         db.commit()
+        invalidate_user(user.telegram_id)
     
     # Send language changed message
     await callback.answer(get_string("language_changed", lang_code))
     
     # Return to settings
-    await handle_back_to_settings(callback, state)
+    await handle_back_to_settings(callback, state, db)
 
-async def handle_my_referral(callback: CallbackQuery, state: FSMContext):
+async def handle_my_referral(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle my referral."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user
     user = db.query(User).filter(User.telegram_id == callback.from_user.id).first()
     
@@ -180,11 +163,8 @@ async def handle_my_referral(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_upload(callback: CallbackQuery, state: FSMContext):
+async def handle_upload(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle upload button."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -211,56 +191,20 @@ async def handle_upload(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_my_files(callback: CallbackQuery, state: FSMContext):
+async def handle_my_files(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle my files button."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
-    # Get user files
-    from ..utils.helpers import get_user_files
-    files = get_user_files(db, callback.from_user.id)
-    
-    if not files:
-        # No files
-        builder = InlineKeyboardBuilder()
-        builder.button(text=get_string("upload_button", lang), callback_data="upload")
-        builder.button(text=get_string("back_button", lang), callback_data="back_to_main")
-        
-        await callback.message.edit_text(
-            get_string("no_files", lang),
-            reply_markup=builder.as_markup()
-        )
-        return
-    
-    # Create files keyboard
-    builder = InlineKeyboardBuilder()
-    
-    for file in files:
-        builder.button(
-            text=f"{file.file_name} ({file.download_count} ⬇️)",
-            callback_data=f"file_{file.id}"
-        )
-    
-    builder.button(text=get_string("back_button", lang), callback_data="back_to_main")
-    builder.adjust(1)
-    
-    # Send files message
-    await callback.message.edit_text(
-        get_string("my_files", lang),
-        reply_markup=builder.as_markup()
-    )
+    # Show the first page of user files
+    from .search_handlers import display_search_results, RESULTS_MY_FILES
+    await display_search_results(callback.message, state, db, callback.from_user.id, lang, RESULTS_MY_FILES)
     
     # Answer callback
     await callback.answer()
 
-async def handle_file_details(callback: CallbackQuery, state: FSMContext):
+async def handle_file_details(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle file details."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -331,11 +275,8 @@ Uploaded: {upload_date}
     # Answer callback
     await callback.answer()
 
-async def handle_search(callback: CallbackQuery, state: FSMContext):
+async def handle_search(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle search button."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -357,11 +298,8 @@ async def handle_search(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_cancel_upload(callback: CallbackQuery, state: FSMContext):
+async def handle_cancel_upload(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle cancel upload."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -369,16 +307,13 @@ async def handle_cancel_upload(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     
     # Return to main menu
-    await handle_back_to_main(callback, state)
+    await handle_back_to_main(callback, state, db)
     
     # Answer callback with cancelled message
     await callback.answer(get_string("operation_cancelled", lang))
 
-async def handle_cancel_search(callback: CallbackQuery, state: FSMContext):
+async def handle_cancel_search(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle cancel search."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -386,16 +321,13 @@ async def handle_cancel_search(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     
     # Return to search menu
-    await handle_search(callback, state)
+    await handle_search(callback, state, db)
     
     # Answer callback with cancelled message
     await callback.answer(get_string("operation_cancelled", lang))
 
-async def handle_cancel_download(callback: CallbackQuery, state: FSMContext):
+async def handle_cancel_download(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle cancel download."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -403,16 +335,13 @@ async def handle_cancel_download(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     
     # Return to main menu
-    await handle_back_to_main(callback, state)
+    await handle_back_to_main(callback, state, db)
     
     # Answer callback with cancelled message
     await callback.answer(get_string("operation_cancelled", lang))
 
-async def handle_cancel_broadcast(callback: CallbackQuery, state: FSMContext):
+async def handle_cancel_broadcast(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle cancel broadcast."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -420,27 +349,24 @@ async def handle_cancel_broadcast(callback: CallbackQuery, state: FSMContext):
     await state.clear()
     
     # Return to admin panel
-    await handle_back_to_admin(callback, state)
+    await handle_back_to_admin(callback, state, db)
     
     # Answer callback with cancelled message
     await callback.answer(get_string("operation_cancelled", lang))
 
-async def handle_check_subscription(callback: CallbackQuery, state: FSMContext):
+async def handle_check_subscription(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle check subscription."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
     # Check if user is subscribed to required channels
-    if not check_subscription(callback.from_user.id, callback.bot, db):
+    if not await check_subscription(callback.from_user.id, callback.bot, db):
         # User is not subscribed to required channels
         await callback.answer(get_string("subscription_required", lang), show_alert=True)
         return
     
     # User is subscribed, show main menu
-    await handle_back_to_main(callback, state)
+    await handle_back_to_main(callback, state, db)
     
     # Answer callback with success message
     await callback.answer(get_string("subscription_checked", lang))
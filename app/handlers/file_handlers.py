@@ -4,8 +4,10 @@ from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 import os
 from dotenv import load_dotenv
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..database.db import get_db, hash_password, verify_password, generate_share_code
+from ..database.db import hash_password, verify_password, generate_share_code, get_setting
 from ..database.models import File, Category, Format, Tag
 from ..utils.states import FileUploadStates, FileDownloadStates
 from ..utils.helpers import (
@@ -13,6 +15,7 @@ from ..utils.helpers import (
     parse_tags, get_or_create_tags, get_file_by_share_code,
     update_file_stats, add_file_download
 )
+from ..utils.notifications import notify_file_download
 from ..localization.strings import get_string
 
 # Load environment variables
@@ -23,11 +26,8 @@ STORAGE_CHANNEL_ID = os.getenv("STORAGE_CHANNEL_ID")
 
 router = Router()
 
-async def handle_file_upload(message: Message, state: FSMContext):
+async def handle_file_upload(message: Message, state: FSMContext, db: Session):
     """Handle file upload."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(message.from_user.id, db)
     
@@ -76,7 +76,7 @@ async def handle_file_upload(message: Message, state: FSMContext):
         file_type = "video_note"
     
     # Check file size
-    max_file_size = int(db.query(db.query("Settings").filter_by(key="max_file_size").first().value or "50"))
+    max_file_size = int(get_setting(db, "max_file_size", "50"))
     if file_size > max_file_size * 1024 * 1024:
         await message.answer(get_string("file_too_large", lang).format(max_size=max_file_size))
         return
@@ -100,13 +100,10 @@ async def handle_file_upload(message: Message, state: FSMContext):
     )
     
     # Forward to category selection
-    await select_category(message, state)
+    await select_category(message, state, db)
 
-async def select_category(message: Message, state: FSMContext):
+async def select_category(message: Message, state: FSMContext, db: Session):
     """Select category for file."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(message.from_user.id, db)
     
@@ -132,11 +129,8 @@ async def select_category(message: Message, state: FSMContext):
         reply_markup=builder.as_markup()
     )
 
-async def handle_category_selection(callback: CallbackQuery, state: FSMContext):
+async def handle_category_selection(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle category selection."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -171,12 +165,12 @@ async def handle_category_selection(callback: CallbackQuery, state: FSMContext):
         )
     else:
         # No subcategories, proceed to format selection
-        await select_format(callback.message, state, category_id)
+        await select_format(callback.message, state, category_id, db)
     
     # Answer callback
     await callback.answer()
 
-async def handle_subcategory_selection(callback: CallbackQuery, state: FSMContext):
+async def handle_subcategory_selection(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle subcategory selection."""
     # Get subcategory ID
     subcategory_id = int(callback.data.split("_")[1])
@@ -185,16 +179,13 @@ async def handle_subcategory_selection(callback: CallbackQuery, state: FSMContex
     await state.update_data(category_id=subcategory_id)
     
     # Proceed to format selection
-    await select_format(callback.message, state, subcategory_id)
+    await select_format(callback.message, state, subcategory_id, db)
     
     # Answer callback
     await callback.answer()
 
-async def select_format(message: Message, state: FSMContext, category_id):
+async def select_format(message: Message, state: FSMContext, category_id, db: Session):
     """Select format for file."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(message.from_user.id, db)
     
@@ -223,11 +214,8 @@ async def select_format(message: Message, state: FSMContext, category_id):
         reply_markup=builder.as_markup()
     )
 
-async def handle_format_selection(callback: CallbackQuery, state: FSMContext):
+async def handle_format_selection(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle format selection."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -254,11 +242,8 @@ async def handle_format_selection(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_source_input(message: Message, state: FSMContext):
+async def handle_source_input(message: Message, state: FSMContext, db: Session):
     """Handle source URL input."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(message.from_user.id, db)
     
@@ -282,11 +267,8 @@ async def handle_source_input(message: Message, state: FSMContext):
         reply_markup=builder.as_markup()
     )
 
-async def handle_skip_source(callback: CallbackQuery, state: FSMContext):
+async def handle_skip_source(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle skip source."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -313,11 +295,8 @@ async def handle_skip_source(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_filename_input(message: Message, state: FSMContext):
+async def handle_filename_input(message: Message, state: FSMContext, db: Session):
     """Handle filename input."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(message.from_user.id, db)
     
@@ -338,11 +317,8 @@ async def handle_filename_input(message: Message, state: FSMContext):
         reply_markup=builder.as_markup()
     )
 
-async def handle_skip_filename(callback: CallbackQuery, state: FSMContext):
+async def handle_skip_filename(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle skip filename."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -365,11 +341,8 @@ async def handle_skip_filename(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_tags_input(message: Message, state: FSMContext):
+async def handle_tags_input(message: Message, state: FSMContext, db: Session):
     """Handle tags input."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(message.from_user.id, db)
     
@@ -380,7 +353,7 @@ async def handle_tags_input(message: Message, state: FSMContext):
     await state.update_data(tags=tags)
     
     # Check if password protection is enabled
-    password_protection = db.query(db.query("Settings").filter_by(key="password_protection").first().value or "true")
+    password_protection = get_setting(db, "password_protection", "true")
     
     if password_protection.lower() == "true":
         # Proceed to password prompt
@@ -400,13 +373,10 @@ async def handle_tags_input(message: Message, state: FSMContext):
     else:
         # Skip password, proceed to file upload
         await state.update_data(password=None)
-        await upload_file_to_channel(message, state)
+        await upload_file_to_channel(message, state, db)
 
-async def handle_skip_tags(callback: CallbackQuery, state: FSMContext):
+async def handle_skip_tags(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle skip tags."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -414,7 +384,7 @@ async def handle_skip_tags(callback: CallbackQuery, state: FSMContext):
     await state.update_data(tags=[])
     
     # Check if password protection is enabled
-    password_protection = db.query(db.query("Settings").filter_by(key="password_protection").first().value or "true")
+    password_protection = get_setting(db, "password_protection", "true")
     
     if password_protection.lower() == "true":
         # Proceed to password prompt
@@ -434,16 +404,13 @@ async def handle_skip_tags(callback: CallbackQuery, state: FSMContext):
     else:
         # Skip password, proceed to file upload
         await state.update_data(password=None)
-        await upload_file_to_channel(callback.message, state)
+        await upload_file_to_channel(callback.message, state, db)
     
     # Answer callback
     await callback.answer()
 
-async def handle_set_password_yes(callback: CallbackQuery, state: FSMContext):
+async def handle_set_password_yes(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle set password yes."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -463,22 +430,19 @@ async def handle_set_password_yes(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_set_password_no(callback: CallbackQuery, state: FSMContext):
+async def handle_set_password_no(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle set password no."""
     # Store empty password in state
     await state.update_data(password=None)
     
     # Proceed to file upload
-    await upload_file_to_channel(callback.message, state)
+    await upload_file_to_channel(callback.message, state, db)
     
     # Answer callback
     await callback.answer()
 
-async def handle_password_input(message: Message, state: FSMContext):
+async def handle_password_input(message: Message, state: FSMContext, db: Session):
     """Handle password input."""
-    # Get database session
-    db = next(get_db())
-    
     # Hash password
     hashed_password = hash_password(message.text)
     
@@ -486,13 +450,10 @@ async def handle_password_input(message: Message, state: FSMContext):
     await state.update_data(password=hashed_password)
     
     # Proceed to file upload
-    await upload_file_to_channel(message, state)
+    await upload_file_to_channel(message, state, db)
 
-async def upload_file_to_channel(message: Message, state: FSMContext):
+async def upload_file_to_channel(message: Message, state: FSMContext, db: Session):
     """Upload file to storage channel."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(message.from_user.id, db)
     
@@ -607,16 +568,13 @@ async def upload_file_to_channel(message: Message, state: FSMContext):
         # Reset state
         await state.clear()
 
-async def download_file(message: Message, file_code: str):
+async def download_file(message: Message, file_code: str, db: Session, async_db: AsyncSession):
     """Download file using share code."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(message.from_user.id, db)
     
     # Get file by share code
-    file = get_file_by_share_code(db, file_code)
+    file = await get_file_by_share_code(async_db, file_code)
     
     if not file:
         await message.answer(get_string("file_not_found", lang))
@@ -644,13 +602,10 @@ async def download_file(message: Message, file_code: str):
         return
     
     # No password, proceed to download
-    await send_file(message, file)
+    await send_file(message, file, db, async_db)
 
-async def handle_download_password(message: Message, state: FSMContext):
+async def handle_download_password(message: Message, state: FSMContext, db: Session, async_db: AsyncSession):
     """Handle download password input."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(message.from_user.id, db)
     
@@ -681,13 +636,10 @@ async def handle_download_password(message: Message, state: FSMContext):
     
     # Password correct, proceed to download
     await state.clear()
-    await send_file(message, file)
+    await send_file(message, file, db, async_db)
 
-async def send_file(message: Message, file):
+async def send_file(message: Message, file, db: Session, async_db: AsyncSession):
     """Send file to user."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(message.from_user.id, db)
     
@@ -703,10 +655,13 @@ async def send_file(message: Message, file):
         )
         
         # Update file stats
-        update_file_stats(db, file.id, is_download=True)
+        update_file_stats(file.id, is_download=True)
         
         # Add download record
-        add_file_download(db, file.id, message.from_user.id)
+        await add_file_download(async_db, file.id, message.from_user.id)
+        
+        # Tell the owner in the next download digest
+        notify_file_download(db, file, message.from_user.id)
         
         # Delete downloading message
         await downloading_message.delete()
@@ -0,0 +1,48 @@
+"""
+Channel membership handlers for the bot.
+
+The bot is an admin of the subscription channels, so Telegram sends it a
+chat_member update whenever a user joins or leaves one. The updates are
+stored in channel_members, which check_subscription reads before asking
+Telegram.
+"""
+from typing import Optional
+from aiogram import Router
+from aiogram.types import Chat, ChatMemberUpdated
+from sqlalchemy.orm import Session
+
+from ..utils.helpers import get_required_channels, store_membership
+
+router = Router()
+
+def get_subscription_channel_id(chat: Chat, db: Session) -> Optional[str]:
+    """Get the configured channel ID of a chat, None if it isn't a required channel."""
+    # Channels are configured by numeric ID or @username
+    keys = {str(chat.id)}
+    if chat.username:
+        keys.add(f"@{chat.username}".lower())
+    
+    for channel in get_required_channels(db):
+        if channel.channel_id.lower() in keys:
+            return channel.channel_id
+    
+    return None
+
+async def handle_chat_member(update: ChatMemberUpdated, db: Session):
+    """Handle a user joining or leaving a channel."""
+    channel_id = get_subscription_channel_id(update.chat, db)
+    
+    if channel_id is None:
+        return
+    
+    # Check if user is a member (not left or kicked)
+    is_member = update.new_chat_member.status not in ["left", "kicked"]
+    
+    store_membership(db, update.new_chat_member.user.id, channel_id, is_member)
+
+def register_membership_handlers(dp):
+    """Register membership handlers."""
+    dp.chat_member.register(handle_chat_member)
+    
+    # Add router to dispatcher
+    dp.include_router(router)
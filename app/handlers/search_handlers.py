@@ -2,23 +2,35 @@ from aiogram import Router, F
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from sqlalchemy import func
+from sqlalchemy.orm import Session, with_expression
 
-from ..database.db import get_db
-from ..database.models import Category, Format, Tag, File
+from ..database.models import Category, Format, Tag, File, file_tags
+from ..database.search import apply_file_search, get_search_relevance
 from ..utils.states import SearchStates
-from ..utils.helpers import (
-    get_user_language, search_files_by_name, search_files_by_tag,
-    search_files_by_category, search_files_by_format
+from ..utils.helpers import get_user_language, get_cached_user
+from ..utils.pagination import (
+    KeysetOrder, NEXT, PREVIOUS, datetime_to_key, key_to_datetime,
+    encode_cursor, fetch_page, page_callback, parse_page_callback
 )
 from ..localization.strings import get_string
 
 router = Router()
 
-async def search_by_name(callback: CallbackQuery, state: FSMContext):
+# Result list kinds used in page callback_data
+RESULTS_NAME = "n"
+RESULTS_TAG = "t"
+RESULTS_CATEGORY = "c"
+RESULTS_FORMAT = "f"
+RESULTS_MY_FILES = "m"
+
+# Name search results are ordered by relevance, other results by downloads,
+# my files by upload date
+SEARCH_ORDER = KeysetOrder(func.coalesce(File.download_count, 0), File.id, lambda file: file.download_count or 0, int)
+MY_FILES_ORDER = KeysetOrder(File.upload_date, File.id, lambda file: datetime_to_key(file.upload_date), key_to_datetime)
+
+async def search_by_name(callback: CallbackQuery, state: FSMContext, db: Session):
     """Search files by name."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -41,11 +53,8 @@ async def search_by_name(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def search_by_tag(callback: CallbackQuery, state: FSMContext):
+async def search_by_tag(callback: CallbackQuery, state: FSMContext, db: Session):
     """Search files by tag."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -53,7 +62,7 @@ async def search_by_tag(callback: CallbackQuery, state: FSMContext):
     await state.set_state(SearchStates.selecting_tag)
     
     # Get popular tags
-    tags = db.query(Tag).join(Tag.files).group_by(Tag.id).order_by(db.func.count(File.id).desc()).limit(10).all()
+    tags = db.query(Tag).filter(Tag.files_count > 0).order_by(Tag.files_count.desc()).limit(10).all()
     
     if not tags:
         # No tags found, switch to entering query
@@ -74,7 +83,7 @@ async def search_by_tag(callback: CallbackQuery, state: FSMContext):
         builder = InlineKeyboardBuilder()
         
         for tag in tags:
-            builder.button(text=tag.name, callback_data=f"tag_{tag.id}")
+            builder.button(text=f"{tag.name} ({tag.files_count})", callback_data=f"tag_{tag.id}")
         
         builder.button(text=get_string("search_prompt", lang), callback_data="enter_tag_query")
         builder.button(text=get_string("back_button", lang), callback_data="back_to_search")
@@ -90,11 +99,8 @@ async def search_by_tag(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def search_by_category(callback: CallbackQuery, state: FSMContext):
+async def search_by_category(callback: CallbackQuery, state: FSMContext, db: Session):
     """Search files by category."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -109,7 +115,7 @@ async def search_by_category(callback: CallbackQuery, state: FSMContext):
     
     for category in categories:
         category_name = category.name_en if lang == "en" else category.name_ar
-        builder.button(text=category_name, callback_data=f"search_category_{category.id}")
+        builder.button(text=f"{category_name} ({category.files_count})", callback_data=f"search_category_{category.id}")
     
     builder.button(text=get_string("back_button", lang), callback_data="back_to_search")
     builder.button(text=get_string("cancel_button", lang), callback_data="cancel_search")
@@ -124,11 +130,8 @@ async def search_by_category(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def search_by_format(callback: CallbackQuery, state: FSMContext):
+async def search_by_format(callback: CallbackQuery, state: FSMContext, db: Session):
     """Search files by format."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -145,7 +148,7 @@ async def search_by_format(callback: CallbackQuery, state: FSMContext):
         format_name = format.name
         format_description = format.description_en if lang == "en" else format.description_ar
         display_text = f"{format_name} - {format_description}" if format_description else format_name
-        builder.button(text=display_text, callback_data=f"search_format_{format.id}")
+        builder.button(text=f"{display_text} ({format.files_count})", callback_data=f"search_format_{format.id}")
     
     builder.button(text=get_string("back_button", lang), callback_data="back_to_search")
     builder.button(text=get_string("cancel_button", lang), callback_data="cancel_search")
@@ -160,11 +163,8 @@ async def search_by_format(callback: CallbackQuery, state: FSMContext):
     # Answer callback
     await callback.answer()
 
-async def handle_search_query(message: Message, state: FSMContext):
+async def handle_search_query(message: Message, state: FSMContext, db: Session):
     """Handle search query input."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(message.from_user.id, db)
     
@@ -172,53 +172,36 @@ async def handle_search_query(message: Message, state: FSMContext):
     data = await state.get_data()
     search_type = data.get('search_type', 'name')
     
-    # Perform search
-    if search_type == 'name':
-        files = search_files_by_name(db, message.text)
-    elif search_type == 'tag':
-        files = search_files_by_tag(db, message.text)
+    # Leave the query state but keep the query for the next pages
+    await state.set_state(None)
     
     # Display search results
-    await display_search_results(message, files, lang)
-    
-    # Reset state
-    await state.clear()
+    if search_type == 'tag':
+        tag = db.query(Tag).filter(Tag.name.ilike(f"%{message.text}%")).first()
+        await display_search_results(message, state, db, message.from_user.id, lang, RESULTS_TAG, tag.id if tag else 0, edit=False)
+    else:
+        await state.update_data(search_query=message.text)
+        await display_search_results(message, state, db, message.from_user.id, lang, RESULTS_NAME, edit=False)
 
-async def handle_tag_selection(callback: CallbackQuery, state: FSMContext):
+async def handle_tag_selection(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle tag selection."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
     # Get tag ID
     tag_id = int(callback.data.split("_")[1])
     
-    # Get tag
-    tag = db.query(Tag).filter(Tag.id == tag_id).first()
-    
-    if not tag:
-        await callback.answer(get_string("error_occurred", lang))
-        return
-    
-    # Get files with tag
-    files = tag.files
-    
-    # Display search results
-    await display_search_results(callback.message, files, lang)
-    
     # Reset state
     await state.clear()
     
+    # Display search results
+    await display_search_results(callback.message, state, db, callback.from_user.id, lang, RESULTS_TAG, tag_id)
+    
     # Answer callback
     await callback.answer()
 
-async def handle_category_selection_search(callback: CallbackQuery, state: FSMContext):
+async def handle_category_selection_search(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle category selection for search."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
@@ -240,7 +223,7 @@ async def handle_category_selection_search(callback: CallbackQuery, state: FSMCo
         
         for subcategory in subcategories:
             subcategory_name = subcategory.name_en if lang == "en" else subcategory.name_ar
-            builder.button(text=subcategory_name, callback_data=f"search_subcategory_{subcategory.id}")
+            builder.button(text=f"{subcategory_name} ({subcategory.files_count})", callback_data=f"search_subcategory_{subcategory.id}")
         
         builder.button(text=get_string("back_button", lang), callback_data="back_to_categories_search")
         builder.button(text=get_string("cancel_button", lang), callback_data="cancel_search")
@@ -252,76 +235,94 @@ async def handle_category_selection_search(callback: CallbackQuery, state: FSMCo
             reply_markup=builder.as_markup()
         )
     else:
-        # No subcategories, search files in this category
-        files = search_files_by_category(db, category_id)
-        
-        # Display search results
-        await display_search_results(callback.message, files, lang)
-        
         # Reset state
         await state.clear()
+        
+        # No subcategories, search files in this category
+        await display_search_results(callback.message, state, db, callback.from_user.id, lang, RESULTS_CATEGORY, category_id)
     
     # Answer callback
     await callback.answer()
 
-async def handle_subcategory_selection_search(callback: CallbackQuery, state: FSMContext):
+async def handle_subcategory_selection_search(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle subcategory selection for search."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
     # Get subcategory ID
     subcategory_id = int(callback.data.split("_")[2])
     
-    # Search files in subcategory
-    files = search_files_by_category(db, subcategory_id)
-    
-    # Display search results
-    await display_search_results(callback.message, files, lang)
-    
     # Reset state
     await state.clear()
     
+    # Search files in subcategory
+    await display_search_results(callback.message, state, db, callback.from_user.id, lang, RESULTS_CATEGORY, subcategory_id)
+    
     # Answer callback
     await callback.answer()
 
-async def handle_format_selection_search(callback: CallbackQuery, state: FSMContext):
+async def handle_format_selection_search(callback: CallbackQuery, state: FSMContext, db: Session):
     """Handle format selection for search."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(callback.from_user.id, db)
     
     # Get format ID
     format_id = int(callback.data.split("_")[2])
     
-    # Search files with format
-    files = search_files_by_format(db, format_id)
-    
-    # Display search results
-    await display_search_results(callback.message, files, lang)
-    
     # Reset state
     await state.clear()
     
+    # Search files with format
+    await display_search_results(callback.message, state, db, callback.from_user.id, lang, RESULTS_FORMAT, format_id)
+    
     # Answer callback
     await callback.answer()
 
-async def display_search_results(message, files, lang):
-    """Display search results."""
-    if not files:
+async def get_results_query(db: Session, state: FSMContext, telegram_id: int, kind: str, arg):
+    """Get the file query and order of a result list."""
+    if kind == RESULTS_MY_FILES:
+        user = get_cached_user(db, telegram_id)
+        return db.query(File).filter(File.owner_id == (user.id if user else 0)), MY_FILES_ORDER
+    
+    if kind == RESULTS_NAME:
+        data = await state.get_data()
+        search_query = data.get("search_query", "")
+        relevance = get_search_relevance(search_query)
+        query = apply_file_search(db.query(File), search_query, rank=False).options(with_expression(File.search_rank, relevance))
+        return query, KeysetOrder(relevance, File.id, lambda file: file.search_rank or 0, int)
+    
+    if kind == RESULTS_TAG:
+        query = db.query(File).join(file_tags, file_tags.c.file_id == File.id).filter(file_tags.c.tag_id == int(arg))
+    elif kind == RESULTS_CATEGORY:
+        query = db.query(File).filter(File.category_id == int(arg))
+    else:
+        query = db.query(File).filter(File.format_id == int(arg))
+    
+    return query, SEARCH_ORDER
+
+async def display_search_results(message, state: FSMContext, db: Session, telegram_id: int, lang: str, kind: str,
+                                 arg="", page: int = 1, direction: str = NEXT, cursor: str = None, edit: bool = True):
+    """Display one page of search results."""
+    # Load only the visible page
+    query, order = await get_results_query(db, state, telegram_id, kind, arg)
+    files, has_previous, has_next = fetch_page(query, order, cursor, direction)
+    
+    send = message.edit_text if edit else message.answer
+    
+    if not files and page == 1:
         # No results
         builder = InlineKeyboardBuilder()
-        builder.button(text=get_string("search_button", lang), callback_data="search")
+        
+        if kind == RESULTS_MY_FILES:
+            builder.button(text=get_string("upload_button", lang), callback_data="upload")
+            text = get_string("no_files", lang)
+        else:
+            builder.button(text=get_string("search_button", lang), callback_data="search")
+            text = get_string("no_results", lang)
+        
         builder.button(text=get_string("back_button", lang), callback_data="back_to_main")
         
-        await message.edit_text(
-            get_string("no_results", lang),
-            reply_markup=builder.as_markup()
-        )
+        await send(text, reply_markup=builder.as_markup())
         return
     
     # Create results keyboard
@@ -333,16 +334,53 @@ async def display_search_results(message, files, lang):
             callback_data=f"file_{file.id}"
         )
     
-    builder.button(text=get_string("search_button", lang), callback_data="search")
+    # Page buttons carry the key of the first or last visible file
+    navigation = 0
+    
+    if files and has_previous:
+        builder.button(
+            text=get_string("previous_page", lang),
+            callback_data=page_callback(kind, arg, page - 1, PREVIOUS, encode_cursor(order, files[0]))
+        )
+        navigation += 1
+    
+    if files and has_next:
+        builder.button(
+            text=get_string("next_page", lang),
+            callback_data=page_callback(kind, arg, page + 1, NEXT, encode_cursor(order, files[-1]))
+        )
+        navigation += 1
+    
+    if kind != RESULTS_MY_FILES:
+        builder.button(text=get_string("search_button", lang), callback_data="search")
+    
     builder.button(text=get_string("back_button", lang), callback_data="back_to_main")
-    builder.adjust(1)
+    builder.adjust(*([1] * len(files)), navigation or 1, 1)
     
     # Send results message
-    await message.edit_text(
-        get_string("search_results", lang).format(count=len(files)),
+    title = "my_files_page" if kind == RESULTS_MY_FILES else "search_results_page"
+    await send(
+        get_string(title, lang).format(page=page),
         reply_markup=builder.as_markup()
     )
 
+async def handle_results_page(callback: CallbackQuery, state: FSMContext, db: Session):
+    """Handle result page buttons."""
+    # Get user language
+    lang = get_user_language(callback.from_user.id, db)
+    
+    # Parse page from callback data
+    request = parse_page_callback(callback.data)
+    
+    # Display page
+    await display_search_results(
+        callback.message, state, db, callback.from_user.id, lang,
+        request.kind, request.arg, request.page, request.direction, request.cursor
+    )
+    
+    # Answer callback
+    await callback.answer()
+
 def register_search_handlers(dp):
     """Register search handlers."""
     # Search type handlers
@@ -360,5 +398,8 @@ def register_search_handlers(dp):
     dp.callback_query.register(handle_subcategory_selection_search, F.data.startswith("search_subcategory_"))
     dp.callback_query.register(handle_format_selection_search, F.data.startswith("search_format_"))
     
+    # Result page handlers
+    dp.callback_query.register(handle_results_page, F.data.startswith("pg:"))
+    
     # Add router to dispatcher
     dp.include_router(router)
\ No newline at end of file
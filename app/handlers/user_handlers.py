@@ -3,19 +3,17 @@ from aiogram.filters import Command, CommandStart
 from aiogram.types import Message, CallbackQuery
 from aiogram.fsm.context import FSMContext
 from aiogram.utils.keyboard import InlineKeyboardBuilder
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from ..database.db import get_db
 from ..database.models import User
 from ..utils.helpers import get_or_create_user, get_user_language, check_subscription, get_subscription_buttons
 from ..localization.strings import get_string
 
 router = Router()
 
-async def start_command(message: Message, state: FSMContext):
+async def start_command(message: Message, state: FSMContext, db: Session, async_db: AsyncSession):
     """Handle /start command."""
-    # Get database session
-    db = next(get_db())
-    
     # Get or create user
     user = get_or_create_user(
         db=db,
@@ -47,7 +45,7 @@ async def start_command(message: Message, state: FSMContext):
             file_code = param.replace("file_", "")
             # Redirect to file download handler
             from .file_handlers import download_file
-            await download_file(message, file_code)
+            await download_file(message, file_code, db, async_db)
             return
         
         # Handle referral
@@ -85,11 +83,8 @@ async def start_command(message: Message, state: FSMContext):
     # Reset state
     await state.clear()
 
-async def help_command(message: Message):
+async def help_command(message: Message, db: Session):
     """Handle /help command."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(message.from_user.id, db)
     
@@ -133,11 +128,8 @@ Contact the bot administrator for assistance.
         reply_markup=builder.as_markup()
     )
 
-async def settings_command(message: Message):
+async def settings_command(message: Message, db: Session):
     """Handle /settings command."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(message.from_user.id, db)
     
@@ -169,11 +161,8 @@ async def language_command(message: Message):
         reply_markup=builder.as_markup()
     )
 
-async def my_referral_command(message: Message):
+async def my_referral_command(message: Message, db: Session):
     """Handle /myref command."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user
     user = db.query(User).filter(User.telegram_id == message.from_user.id).first()
     
@@ -200,53 +189,17 @@ async def my_referral_command(message: Message):
         reply_markup=builder.as_markup()
     )
 
-async def my_files_command(message: Message):
+async def my_files_command(message: Message, state: FSMContext, db: Session):
     """Handle /myfiles command."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(message.from_user.id, db)
     
-    # Get user files
-    from ..utils.helpers import get_user_files
-    files = get_user_files(db, message.from_user.id)
-    
-    if not files:
-        # No files
-        builder = InlineKeyboardBuilder()
-        builder.button(text=get_string("upload_button", lang), callback_data="upload")
-        builder.button(text=get_string("back_button", lang), callback_data="back_to_main")
-        
-        await message.answer(
-            get_string("no_files", lang),
-            reply_markup=builder.as_markup()
-        )
-        return
-    
-    # Create files keyboard
-    builder = InlineKeyboardBuilder()
-    
-    for file in files:
-        builder.button(
-            text=f"{file.file_name} ({file.download_count} ⬇️)",
-            callback_data=f"file_{file.id}"
-        )
-    
-    builder.button(text=get_string("back_button", lang), callback_data="back_to_main")
-    builder.adjust(1)
-    
-    # Send files message
-    await message.answer(
-        get_string("my_files", lang),
-        reply_markup=builder.as_markup()
-    )
+    # Show the first page of user files
+    from .search_handlers import display_search_results, RESULTS_MY_FILES
+    await display_search_results(message, state, db, message.from_user.id, lang, RESULTS_MY_FILES, edit=False)
 
-async def upload_command(message: Message, state: FSMContext):
+async def upload_command(message: Message, state: FSMContext, db: Session):
     """Handle /upload command."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(message.from_user.id, db)
     
@@ -270,11 +223,8 @@ async def upload_command(message: Message, state: FSMContext):
         reply_markup=builder.as_markup()
     )
 
-async def search_command(message: Message, state: FSMContext):
+async def search_command(message: Message, state: FSMContext, db: Session):
     """Handle /search command."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(message.from_user.id, db)
     
@@ -293,11 +243,8 @@ async def search_command(message: Message, state: FSMContext):
         reply_markup=builder.as_markup()
     )
 
-async def cancel_command(message: Message, state: FSMContext):
+async def cancel_command(message: Message, state: FSMContext, db: Session):
     """Handle /cancel command."""
-    # Get database session
-    db = next(get_db())
-    
     # Get user language
     lang = get_user_language(message.from_user.id, db)
     
@@ -59,6 +59,9 @@ en_strings = {
     "search_prompt": "🔍 Please enter your search query:",
     "no_results": "❌ No results found.",
     "search_results": "🔍 Found {count} results:",
+    "search_results_page": "🔍 Search results (page {page}):",
+    "previous_page": "⬅️ Previous",
+    "next_page": "Next ➡️",
     
     # Settings
     "settings": "Settings",
@@ -69,6 +72,7 @@ en_strings = {
     # Files
     "no_files": "📂 You haven't uploaded any files yet.",
     "my_files": "📂 Your files:",
+    "my_files_page": "📂 Your files (page {page}):",
     
     # Subscription
     "subscription_required": "⚠️ You need to subscribe to our channels to use this bot:",
@@ -150,6 +154,9 @@ ar_strings = {
     "search_prompt": "🔍 يرجى إدخال استعلام البحث الخاص بك:",
     "no_results": "❌ لم يتم العثور على نتائج.",
     "search_results": "🔍 تم العثور على {count} نتيجة:",
+    "search_results_page": "🔍 نتائج البحث (الصفحة {page}):",
+    "previous_page": "⬅️ السابق",
+    "next_page": "التالي ➡️",
     
     # Settings
     "settings": "الإعدادات",
@@ -160,6 +167,7 @@ ar_strings = {
     # Files
     "no_files": "📂 لم تقم برفع أي ملفات بعد.",
     "my_files": "📂 ملفاتك:",
+    "my_files_page": "📂 ملفاتك (الصفحة {page}):",
     
     # Subscription
     "subscription_required": "⚠️ تحتاج إلى الاشتراك في قنواتنا لاستخدام هذا البوت:",
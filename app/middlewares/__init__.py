@@ -0,0 +1,5 @@
+from .database import DbSessionMiddleware
+
+__all__ = [
+    'DbSessionMiddleware'
+]
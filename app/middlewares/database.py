@@ -0,0 +1,60 @@
+"""
+Database session middleware for the bot.
+"""
+import time
+import logging
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Optional
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+from sqlalchemy import event
+
+from ..database.db import engine, async_engine, SessionLocal, AsyncSessionLocal
+
+# Number of statements executed by the session of the current update
+_query_counter: ContextVar[Optional[list]] = ContextVar("query_counter", default=None)
+
+@event.listens_for(engine, "before_cursor_execute")
+@event.listens_for(async_engine.sync_engine, "before_cursor_execute")
+def _count_query(conn, cursor, statement, parameters, context, executemany):
+    """Count statements executed while an update is being handled."""
+    counter = _query_counter.get()
+    if counter is not None:
+        counter[0] += 1
+
+class DbSessionMiddleware(BaseMiddleware):
+    """Open one database session per update and pass it to handlers as `db` and `async_db`."""
+    
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any]
+    ) -> Any:
+        # Open sessions and start counting queries
+        db = SessionLocal()
+        async_db = AsyncSessionLocal()
+        counter = [0]
+        token = _query_counter.set(counter)
+        started = time.perf_counter()
+        
+        data["db"] = db
+        data["async_db"] = async_db
+        
+        try:
+            result = await handler(event, data)
+            db.commit()
+            await async_db.commit()
+            return result
+        except Exception:
+            db.rollback()
+            await async_db.rollback()
+            raise
+        finally:
+            db.close()
+            await async_db.close()
+            _query_counter.reset(token)
+            
+            # Report session lifetime and query count
+            lifetime = (time.perf_counter() - started) * 1000
+            logging.debug(f"Update {getattr(event, 'update_id', '?')}: session open {lifetime:.1f} ms, {counter[0]} queries")
@@ -0,0 +1,62 @@
+"""
+Buffered user activity tracking.
+"""
+import os
+import logging
+import threading
+from datetime import datetime
+from typing import Dict
+from sqlalchemy import bindparam
+
+from ..database.db import engine
+from ..database.models import User
+
+# How often buffered activity is written to the database
+ACTIVITY_FLUSH_INTERVAL = int(os.getenv("ACTIVITY_FLUSH_INTERVAL", "30"))  # seconds
+
+class ActivityBuffer:
+    """Coalesce last activity updates and write them in one batch."""
+    
+    def __init__(self):
+        self._pending: Dict[int, datetime] = {}
+        self._lock = threading.Lock()
+    
+    def touch(self, telegram_id: int, when: datetime = None) -> None:
+        """Record user activity."""
+        with self._lock:
+            self._pending[telegram_id] = when or datetime.utcnow()
+    
+    def flush(self) -> int:
+        """Write buffered activity to the database."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        
+        if not pending:
+            return 0
+        
+        users = User.__table__
+        statement = users.update().where(
+            users.c.telegram_id == bindparam("b_telegram_id")
+        ).values(
+            last_activity=bindparam("b_last_activity")
+        )
+        
+        try:
+            with engine.begin() as connection:
+                connection.execute(statement, [
+                    {"b_telegram_id": telegram_id, "b_last_activity": last_activity}
+                    for telegram_id, last_activity in pending.items()
+                ])
+        except Exception as e:
+            logging.error(f"Error flushing user activity: {e}")
+            
+            # Keep the activity for the next flush unless newer activity arrived
+            with self._lock:
+                for telegram_id, last_activity in pending.items():
+                    self._pending.setdefault(telegram_id, last_activity)
+            return 0
+        
+        return len(pending)
+
+# Shared activity buffer
+activity_buffer = ActivityBuffer()
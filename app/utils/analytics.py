@@ -7,7 +7,7 @@ from typing import Dict, List, Tuple, Any
 from sqlalchemy.orm import Session
 from sqlalchemy import func
 
-from ..database.models import User, File, FileDownload, Category
+from ..database.models import User, File, FileDownload, Category, ApiLogRollup
 
 def get_user_growth(db: Session, days: int = 30) -> List[Tuple[str, int]]:
     """Get user growth over time."""
@@ -52,15 +52,15 @@ def get_file_downloads(db: Session, days: int = 30) -> List[Tuple[str, int]]:
     end_date = datetime.utcnow()
     start_date = end_date - timedelta(days=days)
     
-    # Query file downloads per day
+    # Query file downloads per day, by each user's last download of a file
     result = db.query(
-        func.date(FileDownload.download_date).label('date'),
+        func.date(FileDownload.last_download).label('date'),
         func.count(FileDownload.id).label('count')
     ).filter(
-        FileDownload.download_date >= start_date,
-        FileDownload.download_date <= end_date
+        FileDownload.last_download >= start_date,
+        FileDownload.last_download <= end_date
     ).group_by(
-        func.date(FileDownload.download_date)
+        func.date(FileDownload.last_download)
     ).all()
     
     # Convert to list of tuples (date_str, count)
@@ -118,6 +118,46 @@ def get_user_activity_heatmap(db: Session) -> Dict[str, Dict[str, int]]:
     
     return heatmap
 
+def get_api_usage(db: Session, days: int = 7) -> Dict[str, Any]:
+    """Get API usage from the hourly rollups."""
+    start_date = datetime.utcnow() - timedelta(days=days)
+    
+    # Query requests per day
+    requests_per_day = db.query(
+        func.date(ApiLogRollup.hour).label('date'),
+        func.sum(ApiLogRollup.request_count).label('count')
+    ).filter(
+        ApiLogRollup.hour >= start_date
+    ).group_by(
+        func.date(ApiLogRollup.hour)
+    ).all()
+    
+    # Query busiest endpoints with their worst hourly p95 latency
+    top_endpoints = db.query(
+        ApiLogRollup.method,
+        ApiLogRollup.endpoint,
+        func.sum(ApiLogRollup.request_count).label('count'),
+        func.max(ApiLogRollup.latency_p95_ms).label('p95')
+    ).filter(
+        ApiLogRollup.hour >= start_date
+    ).group_by(
+        ApiLogRollup.method, ApiLogRollup.endpoint
+    ).order_by(
+        func.sum(ApiLogRollup.request_count).desc()
+    ).limit(10).all()
+    
+    # Query failed requests
+    error_count = db.query(func.sum(ApiLogRollup.request_count)).filter(
+        ApiLogRollup.hour >= start_date,
+        ApiLogRollup.status_code >= 400
+    ).scalar() or 0
+    
+    return {
+        "requests_per_day": [(str(date), count) for date, count in requests_per_day],
+        "top_endpoints": [(method, endpoint, count, p95) for method, endpoint, count, p95 in top_endpoints],
+        "error_count": error_count
+    }
+
 def get_dashboard_stats(db: Session) -> Dict[str, Any]:
     """Get dashboard statistics."""
     # Get total counts
@@ -0,0 +1,164 @@
+"""
+API log rollups and retention.
+
+Raw api_logs rows are rolled up into hourly api_log_rollups rows (request
+count and p50/p95 latency per endpoint, method, status and user), and raw
+rows older than API_LOG_RETENTION_DAYS are deleted in small batches once
+their hour has been rolled up.
+"""
+import os
+import math
+import time
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy import delete, func, insert, select
+
+from ..database.db import engine
+from ..database.models import ApiLog, ApiLogRollup
+
+# Retention settings
+API_LOG_RETENTION_DAYS = int(os.getenv("API_LOG_RETENTION_DAYS", "7"))
+API_LOG_DELETE_BATCH_SIZE = int(os.getenv("API_LOG_DELETE_BATCH_SIZE", "5000"))
+API_LOG_DELETE_BATCH_PAUSE = float(os.getenv("API_LOG_DELETE_BATCH_PAUSE", "0.05"))  # seconds between batches
+API_LOG_ROLLUP_INTERVAL = int(os.getenv("API_LOG_ROLLUP_INTERVAL", "60"))  # minutes
+
+# Logs are written in batches, so an hour is only rolled up a little after it ends
+ROLLUP_GRACE = timedelta(minutes=5)
+
+GROUP_COLUMNS = (ApiLog.endpoint, ApiLog.method, ApiLog.status_code, ApiLog.user_id)
+
+def floor_hour(value: datetime) -> datetime:
+    """Truncate a datetime to the start of its hour."""
+    return value.replace(minute=0, second=0, microsecond=0)
+
+def percentile(values: List[int], fraction: float) -> Optional[int]:
+    """Get a nearest-rank percentile of sorted values."""
+    if not values:
+        return None
+    
+    return values[max(math.ceil(fraction * len(values)) - 1, 0)]
+
+def get_rollup_watermark(connection) -> Optional[datetime]:
+    """Get the first hour that hasn't been rolled up yet."""
+    last_hour = connection.execute(select(func.max(ApiLogRollup.hour))).scalar()
+    
+    if last_hour is not None:
+        return last_hour + timedelta(hours=1)
+    
+    first_log = connection.execute(select(func.min(ApiLog.created_at))).scalar()
+    return floor_hour(first_log) if first_log else None
+
+def rollup_hour(connection, hour: datetime) -> int:
+    """Replace the rollup rows of one hour from the raw logs."""
+    rows = connection.execute(
+        select(*GROUP_COLUMNS, ApiLog.latency_ms)
+        .where(ApiLog.created_at >= hour, ApiLog.created_at < hour + timedelta(hours=1))
+        .order_by(*GROUP_COLUMNS, ApiLog.latency_ms)
+        .execution_options(yield_per=5000)
+    )
+    
+    rollups = []
+    group = None
+    count = 0
+    latencies: List[int] = []
+    
+    def add_rollup():
+        rollups.append({
+            "hour": hour,
+            "endpoint": group[0],
+            "method": group[1],
+            "status_code": group[2],
+            "user_id": group[3],
+            "request_count": count,
+            "latency_p50_ms": percentile(latencies, 0.5),
+            "latency_p95_ms": percentile(latencies, 0.95)
+        })
+    
+    # Rows arrive grouped and sorted by latency
+    for row in rows:
+        key = tuple(row[:4])
+        
+        if key != group:
+            if group is not None:
+                add_rollup()
+            
+            group = key
+            count = 0
+            latencies = []
+        
+        count += 1
+        if row.latency_ms is not None:
+            latencies.append(row.latency_ms)
+    
+    if group is not None:
+        add_rollup()
+    
+    connection.execute(delete(ApiLogRollup).where(ApiLogRollup.hour == hour))
+    
+    if rollups:
+        connection.execute(insert(ApiLogRollup), rollups)
+    
+    return len(rollups)
+
+def rollup_api_logs(now: datetime = None) -> int:
+    """Roll up every complete hour that hasn't been rolled up yet."""
+    end = floor_hour((now or datetime.utcnow()) - ROLLUP_GRACE)
+    hours = 0
+    
+    with engine.connect() as connection:
+        hour = get_rollup_watermark(connection)
+    
+    while hour is not None and hour < end:
+        # One transaction per hour, skipping hours without logs
+        with engine.begin() as connection:
+            next_log = connection.execute(select(func.min(ApiLog.created_at)).where(ApiLog.created_at >= hour)).scalar()
+            
+            if next_log is None or floor_hour(next_log) >= end:
+                break
+            
+            hour = floor_hour(next_log)
+            rollup_hour(connection, hour)
+        
+        hour += timedelta(hours=1)
+        hours += 1
+    
+    return hours
+
+def delete_old_api_logs(now: datetime = None) -> int:
+    """Delete raw logs past the retention window whose hour has been rolled up."""
+    cutoff = (now or datetime.utcnow()) - timedelta(days=API_LOG_RETENTION_DAYS)
+    
+    with engine.connect() as connection:
+        watermark = get_rollup_watermark(connection)
+    
+    if watermark is None:
+        return 0
+    
+    cutoff = min(cutoff, watermark)
+    total = 0
+    
+    while True:
+        with engine.begin() as connection:
+            ids = connection.execute(
+                select(ApiLog.id).where(ApiLog.created_at < cutoff).order_by(ApiLog.id).limit(API_LOG_DELETE_BATCH_SIZE)
+            ).scalars().all()
+            
+            if not ids:
+                break
+            
+            connection.execute(delete(ApiLog).where(ApiLog.id.in_(ids)))
+        
+        total += len(ids)
+        time.sleep(API_LOG_DELETE_BATCH_PAUSE)
+    
+    return total
+
+def maintain_api_logs() -> None:
+    """Roll up API logs and apply the retention window."""
+    try:
+        hours = rollup_api_logs()
+        deleted = delete_old_api_logs()
+        logging.info(f"Rolled up {hours} hours of API logs, deleted {deleted} old rows")
+    except Exception as e:
+        logging.error(f"Error maintaining API logs: {e}")
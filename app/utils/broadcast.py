@@ -0,0 +1,323 @@
+"""
+Resumable broadcasts.
+
+A broadcast is a BroadcastJob row. Recipients are read from users in id
+order, BROADCAST_CHUNK_SIZE at a time, and sent concurrently through the
+shared rate limiter. After every chunk the job's last_user_id and counters
+are saved. A chunk interrupted by a shutdown saves the longest run of
+recipients it finished, so on restart the broadcast resumes after them.
+Errors are retried with backoff before the job is marked failed. Progress
+is shown by editing the admin's status message.
+"""
+import os
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from aiogram import Bot
+from aiogram.exceptions import TelegramBadRequest
+from aiogram.types import InlineKeyboardMarkup
+from aiogram.utils.keyboard import InlineKeyboardBuilder
+from sqlalchemy import func, select, update
+from sqlalchemy.orm import Session
+
+from ..database.db import AsyncSessionLocal, async_engine
+from ..database.models import BroadcastJob, User
+from ..localization.strings import get_string
+from .rate_limit import telegram_limiter
+
+# Broadcast settings
+BROADCAST_CHUNK_SIZE = int(os.getenv("BROADCAST_CHUNK_SIZE", "500"))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "25"))
+BROADCAST_PROGRESS_INTERVAL = float(os.getenv("BROADCAST_PROGRESS_INTERVAL", "5"))  # seconds between status edits
+BROADCAST_ACTIVE_DAYS = 7
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+BROADCAST_RETRY_DELAY = float(os.getenv("BROADCAST_RETRY_DELAY", "5"))  # seconds, doubled on every retry
+
+# Job statuses
+RUNNING = "running"
+DONE = "done"
+CANCELLED = "cancelled"
+FAILED = "failed"
+
+def get_recipient_filters(audience: str, active_days: Optional[int] = None, since: datetime = None) -> List:
+    """Get the conditions selecting the recipients of an audience."""
+    if audience == "active":
+        cutoff = (since or datetime.utcnow()) - timedelta(days=active_days or BROADCAST_ACTIVE_DAYS)
+        return [User.last_activity >= cutoff]
+    
+    return []
+
+def count_recipients(db: Session, audience: str, active_days: int = BROADCAST_ACTIVE_DAYS) -> int:
+    """Count the recipients of an audience."""
+    return db.query(func.count(User.id)).filter(*get_recipient_filters(audience, active_days)).scalar()
+
+def create_broadcast_job(db: Session, created_by: Optional[int], audience: str, message: str,
+                         admin_chat_id: int, status_message_id: int) -> BroadcastJob:
+    """Create a broadcast job."""
+    active_days = BROADCAST_ACTIVE_DAYS if audience == "active" else None
+    
+    job = BroadcastJob(
+        created_by=created_by,
+        audience=audience,
+        active_days=active_days,
+        message=message,
+        status=RUNNING,
+        total_count=count_recipients(db, audience, active_days),
+        admin_chat_id=admin_chat_id,
+        status_message_id=status_message_id
+    )
+    
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    
+    return job
+
+def format_broadcast_progress(job: BroadcastJob) -> str:
+    """Build the text of a broadcast's status message."""
+    done = job.sent_count + job.failed_count
+    percent = round(done * 100 / job.total_count) if job.total_count else 100
+    
+    if job.status == DONE:
+        title = "✅ Broadcast finished"
+    elif job.status == CANCELLED:
+        title = "🛑 Broadcast cancelled"
+    elif job.status == FAILED:
+        title = "❌ Broadcast failed"
+    else:
+        title = "⏳ Broadcasting message..."
+    
+    return (
+        f"📣 <b>{title}</b>\n\n"
+        f"Progress: {done}/{job.total_count} ({percent}%)\n"
+        f"Sent: {job.sent_count}\n"
+        f"Failed: {job.failed_count}"
+    )
+
+def broadcast_progress_markup(job: BroadcastJob, lang: str) -> InlineKeyboardMarkup:
+    """Build the keyboard of a broadcast's status message."""
+    builder = InlineKeyboardBuilder()
+    
+    if job.status == RUNNING:
+        builder.button(text=get_string("cancel_button", lang), callback_data=f"stop_broadcast_{job.id}")
+    else:
+        builder.button(text=get_string("back_button", lang), callback_data="back_to_admin")
+    
+    return builder.as_markup()
+
+class BroadcastManager:
+    """Runs broadcast jobs as tasks on the bot's event loop."""
+    
+    def __init__(self, chunk_size: int = BROADCAST_CHUNK_SIZE, concurrency: int = BROADCAST_CONCURRENCY):
+        self.chunk_size = chunk_size
+        self.concurrency = concurrency
+        self._tasks: Dict[int, asyncio.Task] = {}
+    
+    def start(self, bot: Bot, job_id: int) -> None:
+        """Start running a job."""
+        if job_id in self._tasks:
+            return
+        
+        task = asyncio.get_running_loop().create_task(self._run(bot, job_id))
+        self._tasks[job_id] = task
+        task.add_done_callback(lambda _: self._tasks.pop(job_id, None))
+    
+    async def resume(self, bot: Bot) -> int:
+        """Restart the jobs that were running when the bot stopped."""
+        async with async_engine.connect() as connection:
+            job_ids = (await connection.execute(
+                select(BroadcastJob.id).where(BroadcastJob.status == RUNNING).order_by(BroadcastJob.id)
+            )).scalars().all()
+        
+        for job_id in job_ids:
+            logging.info(f"Resuming broadcast {job_id}")
+            self.start(bot, job_id)
+        
+        return len(job_ids)
+    
+    async def cancel(self, job_id: int) -> Optional[BroadcastJob]:
+        """Cancel a running job, returning it if it was running."""
+        async with AsyncSessionLocal() as db:
+            job = await db.get(BroadcastJob, job_id)
+            
+            if job is None or job.status != RUNNING:
+                return None
+            
+            job.status = CANCELLED
+            job.finished_at = datetime.utcnow()
+            await db.commit()
+        
+        # The task notices at its next checkpoint, stop it now instead
+        task = self._tasks.get(job_id)
+        if task is not None:
+            task.cancel()
+        
+        return job
+    
+    async def stop(self) -> None:
+        """Stop all tasks, leaving their jobs to be resumed."""
+        tasks = list(self._tasks.values())
+        
+        for task in tasks:
+            task.cancel()
+        
+        await asyncio.gather(*tasks, return_exceptions=True)
+    
+    async def _run(self, bot: Bot, job_id: int) -> None:
+        """Send a job to its remaining recipients."""
+        async with AsyncSessionLocal() as db:
+            job = await db.get(BroadcastJob, job_id)
+            
+            if job is None or job.status != RUNNING:
+                return
+            
+            creator = await db.get(User, job.created_by) if job.created_by else None
+        
+        lang = creator.language_code if creator and creator.language_code else "en"
+        attempt = 0
+        failed_at = None
+        
+        while True:
+            try:
+                await self._send_remaining(bot, job, lang)
+                return
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # Count consecutive errors without progress in between
+                attempt = attempt + 1 if job.last_user_id == failed_at else 1
+                failed_at = job.last_user_id
+                
+                if attempt > BROADCAST_MAX_RETRIES:
+                    logging.error(f"Broadcast {job_id} failed: {e}")
+                    await self._fail(bot, job, lang)
+                    return
+                
+                delay = BROADCAST_RETRY_DELAY * 2 ** (attempt - 1)
+                logging.warning(f"Error running broadcast {job_id}, retrying in {delay}s: {e}")
+                await asyncio.sleep(delay)
+    
+    async def _send_remaining(self, bot: Bot, job: BroadcastJob, lang: str) -> None:
+        """Send a job to the recipients after its checkpoint, chunk by chunk."""
+        filters = get_recipient_filters(job.audience, job.active_days, job.created_at)
+        semaphore = asyncio.Semaphore(self.concurrency)
+        reported_at = time.monotonic()
+        
+        while True:
+            async with async_engine.connect() as connection:
+                rows = (await connection.execute(
+                    select(User.id, User.telegram_id)
+                    .where(User.id > job.last_user_id, *filters)
+                    .order_by(User.id)
+                    .limit(self.chunk_size)
+                )).all()
+            
+            if not rows:
+                break
+            
+            # Filled in as sends finish, None while pending
+            results: List[Optional[bool]] = [None] * len(rows)
+            
+            async def send(index: int, telegram_id: int) -> None:
+                results[index] = await self._send(bot, semaphore, telegram_id, job.message)
+            
+            try:
+                await asyncio.gather(*(send(index, row.telegram_id) for index, row in enumerate(rows)))
+            except asyncio.CancelledError:
+                # Stopped mid-chunk, keep what was sent so it isn't sent again
+                self._advance(job, rows, results)
+                await self._save_progress(job)
+                raise
+            
+            self._advance(job, rows, results)
+            
+            if not await self._save_progress(job):
+                return  # cancelled
+            
+            if time.monotonic() - reported_at >= BROADCAST_PROGRESS_INTERVAL:
+                await self._report(bot, job, lang)
+                reported_at = time.monotonic()
+        
+        job.status = DONE
+        job.finished_at = datetime.utcnow()
+        
+        if await self._save_progress(job):
+            logging.info(f"Broadcast {job.id} finished: {job.sent_count} sent, {job.failed_count} failed")
+            await self._report(bot, job, lang)
+    
+    def _advance(self, job: BroadcastJob, rows: List, results: List[Optional[bool]]) -> None:
+        """Move a job's checkpoint past the longest finished run of a chunk's recipients."""
+        finished = 0
+        while finished < len(results) and results[finished] is not None:
+            finished += 1
+        
+        if not finished:
+            return
+        
+        sent = sum(results[:finished])
+        job.last_user_id = rows[finished - 1].id
+        job.sent_count += sent
+        job.failed_count += finished - sent
+    
+    async def _fail(self, bot: Bot, job: BroadcastJob, lang: str) -> None:
+        """Mark a job failed and tell the admin."""
+        job.status = FAILED
+        job.finished_at = datetime.utcnow()
+        
+        try:
+            if not await self._save_progress(job):
+                return  # cancelled
+        except Exception as e:
+            # Still running in the database, so it is resumed on the next start
+            logging.error(f"Error saving failed broadcast {job.id}: {e}")
+        
+        await self._report(bot, job, lang)
+    
+    async def _send(self, bot: Bot, semaphore: asyncio.Semaphore, chat_id: int, text: str) -> bool:
+        """Send the broadcast to one recipient."""
+        async with semaphore:
+            try:
+                await telegram_limiter.send(chat_id, lambda: bot.send_message(chat_id=chat_id, text=text))
+                return True
+            except Exception as e:
+                logging.error(f"Error sending broadcast to user {chat_id}: {e}")
+                return False
+    
+    async def _save_progress(self, job: BroadcastJob) -> bool:
+        """Save a job's checkpoint, returning False if it was cancelled meanwhile."""
+        async with async_engine.begin() as connection:
+            result = await connection.execute(
+                update(BroadcastJob)
+                .where(BroadcastJob.id == job.id, BroadcastJob.status == RUNNING)
+                .values(
+                    status=job.status,
+                    last_user_id=job.last_user_id,
+                    sent_count=job.sent_count,
+                    failed_count=job.failed_count,
+                    finished_at=job.finished_at
+                )
+            )
+        
+        return result.rowcount > 0
+    
+    async def _report(self, bot: Bot, job: BroadcastJob, lang: str) -> None:
+        """Edit the admin's status message with the job's progress."""
+        if not job.admin_chat_id or not job.status_message_id:
+            return
+        
+        try:
+            await telegram_limiter.send(job.admin_chat_id, lambda: bot.edit_message_text(
+                text=format_broadcast_progress(job),
+                chat_id=job.admin_chat_id,
+                message_id=job.status_message_id,
+                reply_markup=broadcast_progress_markup(job, lang)
+            ))
+        except TelegramBadRequest as e:
+            # Unchanged or deleted status message
+            logging.debug(f"Could not update broadcast {job.id} status: {e}")
+        except Exception as e:
+            logging.error(f"Error updating broadcast {job.id} status: {e}")
+
+broadcasts = BroadcastManager()
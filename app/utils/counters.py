@@ -0,0 +1,138 @@
+"""
+Write-behind buffer for file download and view counters.
+"""
+import os
+import logging
+import threading
+from datetime import datetime
+from typing import Dict, Tuple
+from sqlalchemy import bindparam, func
+from sqlalchemy.dialects import mysql, postgresql, sqlite
+
+from ..database.db import engine
+from ..database.models import File, FileDownload
+
+# How often buffered counters are written to the database
+COUNTER_FLUSH_INTERVAL = int(os.getenv("COUNTER_FLUSH_INTERVAL", "10"))  # seconds
+
+class FileCounterBuffer:
+    """Collect per-file counter deltas and write them in batches."""
+    
+    def __init__(self):
+        self._downloads: Dict[int, int] = {}
+        self._views: Dict[int, int] = {}
+        self._user_downloads: Dict[Tuple[int, int], list] = {}
+        self._lock = threading.Lock()
+    
+    def add_download(self, file_id: int) -> None:
+        """Record a file download."""
+        with self._lock:
+            self._downloads[file_id] = self._downloads.get(file_id, 0) + 1
+    
+    def add_user_download(self, file_id: int, user_id: int) -> None:
+        """Record a file download by a user."""
+        now = datetime.utcnow()
+        
+        with self._lock:
+            entry = self._user_downloads.get((file_id, user_id))
+            if entry:
+                entry[0] += 1
+                entry[2] = now
+            else:
+                # [count, first download, last download]
+                self._user_downloads[(file_id, user_id)] = [1, now, now]
+    
+    def add_view(self, file_id: int) -> None:
+        """Record a file view."""
+        with self._lock:
+            self._views[file_id] = self._views.get(file_id, 0) + 1
+    
+    def flush(self) -> int:
+        """Write buffered counters to the database."""
+        with self._lock:
+            downloads, self._downloads = self._downloads, {}
+            views, self._views = self._views, {}
+            user_downloads, self._user_downloads = self._user_downloads, {}
+        
+        if not downloads and not views and not user_downloads:
+            return 0
+        
+        try:
+            with engine.begin() as connection:
+                self._write_file_counters(connection, downloads, views)
+                self._write_user_downloads(connection, user_downloads)
+        except Exception as e:
+            logging.error(f"Error flushing file counters: {e}")
+            self._restore(downloads, views, user_downloads)
+            return 0
+        
+        return len(downloads) + len(views) + len(user_downloads)
+    
+    def _write_file_counters(self, connection, downloads: Dict[int, int], views: Dict[int, int]) -> None:
+        """Increment download and view counts in place."""
+        files = File.__table__
+        rows = [
+            {"b_id": file_id, "b_downloads": downloads.get(file_id, 0), "b_views": views.get(file_id, 0)}
+            for file_id in set(downloads) | set(views)
+        ]
+        
+        if not rows:
+            return
+        
+        connection.execute(
+            files.update().where(files.c.id == bindparam("b_id")).values(
+                download_count=func.coalesce(files.c.download_count, 0) + bindparam("b_downloads"),
+                view_count=func.coalesce(files.c.view_count, 0) + bindparam("b_views")
+            ),
+            rows
+        )
+    
+    def _write_user_downloads(self, connection, user_downloads: Dict[Tuple[int, int], list]) -> None:
+        """Upsert per-user download records on their unique (file_id, user_id) index."""
+        if not user_downloads:
+            return
+        
+        stats = FileDownload.__table__
+        rows = [
+            {"file_id": file_id, "user_id": user_id, "download_count": count, "first_download": first, "last_download": last}
+            for (file_id, user_id), (count, first, last) in user_downloads.items()
+        ]
+        dialect = connection.dialect.name
+        
+        if dialect == "mysql":
+            statement = mysql.insert(stats)
+            statement = statement.on_duplicate_key_update(
+                download_count=func.coalesce(stats.c.download_count, 0) + statement.inserted.download_count,
+                last_download=statement.inserted.last_download
+            )
+        else:
+            statement = (postgresql if dialect == "postgresql" else sqlite).insert(stats)
+            statement = statement.on_conflict_do_update(
+                index_elements=[stats.c.file_id, stats.c.user_id],
+                set_={
+                    "download_count": func.coalesce(stats.c.download_count, 0) + statement.excluded.download_count,
+                    "last_download": statement.excluded.last_download
+                }
+            )
+        
+        connection.execute(statement, rows)
+    
+    def _restore(self, downloads: Dict[int, int], views: Dict[int, int], user_downloads: Dict[Tuple[int, int], list]) -> None:
+        """Put counters back after a failed flush."""
+        with self._lock:
+            for file_id, count in downloads.items():
+                self._downloads[file_id] = self._downloads.get(file_id, 0) + count
+            
+            for file_id, count in views.items():
+                self._views[file_id] = self._views.get(file_id, 0) + count
+            
+            for key, (count, first, last) in user_downloads.items():
+                entry = self._user_downloads.get(key)
+                if entry:
+                    entry[0] += count
+                    entry[1] = first
+                else:
+                    self._user_downloads[key] = [count, first, last]
+
+# Shared counter buffer
+file_counters = FileCounterBuffer()
@@ -1,15 +1,107 @@
 import os
+import asyncio
 import logging
 import secrets
 import string
 import hashlib
 import shutil
+import sqlite3
 from datetime import datetime, timedelta
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, NamedTuple
+from sqlalchemy import and_, or_, select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from aiogram import Bot
 
-from ..database.models import User, File, Category, Format, Tag, FileDownload, SubscriptionChannel
+from ..database.models import User, File, Category, Format, Tag, FileDownload, SubscriptionChannel, ChannelMember
+from .cache import TTLCache
+from .activity import activity_buffer
+from .counters import file_counters
+
+# User cache settings
+USER_CACHE_SIZE = int(os.getenv("USER_CACHE_SIZE", "10000"))
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "60"))  # seconds
+
+# Subscription cache settings
+SUBSCRIPTION_CACHE_SIZE = int(os.getenv("SUBSCRIPTION_CACHE_SIZE", "50000"))
+SUBSCRIPTION_CACHE_TTL = float(os.getenv("SUBSCRIPTION_CACHE_TTL", "300"))  # seconds, for members
+SUBSCRIPTION_NEGATIVE_TTL = float(os.getenv("SUBSCRIPTION_NEGATIVE_TTL", "15"))  # seconds, for non-members
+SUBSCRIPTION_CHANNELS_TTL = float(os.getenv("SUBSCRIPTION_CHANNELS_TTL", "300"))  # seconds
+CHANNEL_MEMBER_MAX_AGE = int(os.getenv("CHANNEL_MEMBER_MAX_AGE", "7"))  # days before a stored membership is checked again
+
+class CachedUser(NamedTuple):
+    """User fields needed on every update."""
+    id: int
+    telegram_id: int
+    language_code: str
+    is_admin: bool
+    is_moderator: bool
+    is_banned: bool
+    can_upload: bool
+
+# Cached users by telegram ID
+user_cache = TTLCache(maxsize=USER_CACHE_SIZE, ttl=USER_CACHE_TTL)
+
+def cache_user(user: User) -> CachedUser:
+    """Store a user in the user cache."""
+    cached = CachedUser(
+        id=user.id,
+        telegram_id=user.telegram_id,
+        language_code=user.language_code,
+        is_admin=bool(user.is_admin),
+        is_moderator=bool(user.is_moderator),
+        is_banned=bool(user.is_banned),
+        can_upload=bool(user.can_upload)
+    )
+    user_cache.set(user.telegram_id, cached)
+    return cached
+
+def get_cached_user(db: Session, telegram_id: int) -> Optional[CachedUser]:
+    """Get a user from the user cache, loading it on a miss."""
+    cached = user_cache.get(telegram_id)
+    
+    if cached is None:
+        user = db.query(User).filter(User.telegram_id == telegram_id).first()
+        
+        if not user:
+            return None
+        
+        cached = cache_user(user)
+    
+    return cached
+
+def invalidate_user(telegram_id: int) -> None:
+    """Drop a user from the user cache after it was changed."""
+    user_cache.invalidate(telegram_id)
+
+class CachedChannel(NamedTuple):
+    """Required subscription channel."""
+    channel_id: str
+    channel_name: str
+    channel_link: str
+
+# Required channels, and membership by (telegram ID, channel ID)
+channel_cache = TTLCache(maxsize=1, ttl=SUBSCRIPTION_CHANNELS_TTL)
+membership_cache = TTLCache(maxsize=SUBSCRIPTION_CACHE_SIZE, ttl=SUBSCRIPTION_CACHE_TTL)
+
+def get_required_channels(db: Session) -> List[CachedChannel]:
+    """Get the required subscription channels, loading them on a miss."""
+    channels = channel_cache.get("required")
+    
+    if channels is None:
+        channels = [
+            CachedChannel(channel.channel_id, channel.channel_name, channel.channel_link)
+            for channel in db.query(SubscriptionChannel).filter(SubscriptionChannel.is_required == True).all()
+        ]
+        channel_cache.set("required", channels)
+    
+    return channels
+
+def invalidate_subscription_channels() -> None:
+    """Drop cached channels and memberships after channels were changed."""
+    channel_cache.clear()
+    membership_cache.clear()
 
 def get_or_create_user(db: Session, telegram_id: int, username: str = None, first_name: str = None, last_name: str = None, language_code: str = "en") -> User:
     """Get or create a user."""
@@ -30,18 +122,23 @@ def get_or_create_user(db: Session, telegram_id: int, username: str = None, firs
         db.commit()
         db.refresh(user)
     else:
-        # Update user information
-        user.username = username
-        user.first_name = first_name
-        user.last_name = last_name
-        user.last_activity = datetime.utcnow()
-        db.commit()
+        # Update user information only if it changed
+        if (user.username, user.first_name, user.last_name) != (username, first_name, last_name):
+            user.username = username
+            user.first_name = first_name
+            user.last_name = last_name
+            db.commit()
+        
+        # Last activity is written in batches
+        activity_buffer.touch(telegram_id)
+    
+    cache_user(user)
     
     return user
 
 def get_user_language(telegram_id: int, db: Session) -> str:
     """Get user language."""
-    user = db.query(User).filter(User.telegram_id == telegram_id).first()
+    user = get_cached_user(db, telegram_id)
     
     if not user:
         # Default to English
@@ -51,7 +148,7 @@ def get_user_language(telegram_id: int, db: Session) -> str:
 
 def is_admin(telegram_id: int, db: Session) -> bool:
     """Check if user is admin."""
-    user = db.query(User).filter(User.telegram_id == telegram_id).first()
+    user = get_cached_user(db, telegram_id)
     
     if not user:
         return False
@@ -60,7 +157,7 @@ def is_admin(telegram_id: int, db: Session) -> bool:
 
 def can_upload(telegram_id: int, db: Session) -> bool:
     """Check if user can upload files."""
-    user = db.query(User).filter(User.telegram_id == telegram_id).first()
+    user = get_cached_user(db, telegram_id)
     
     if not user:
         return False
@@ -82,28 +179,109 @@ def can_upload(telegram_id: int, db: Session) -> bool:
     
     return False
 
+def cache_membership(telegram_id: int, channel_id: str, is_member: bool) -> None:
+    """Cache a membership, non-members only briefly so joining is noticed quickly."""
+    membership_cache.set((telegram_id, channel_id), is_member, None if is_member else SUBSCRIPTION_NEGATIVE_TTL)
+
+def get_stored_memberships(db: Session, telegram_id: int, channel_ids: List[str]) -> Dict[str, bool]:
+    """Get the recent memberships of a user stored from chat_member updates.
+    
+    Non-members are trusted only for SUBSCRIPTION_NEGATIVE_TTL, as a missed
+    join update would otherwise lock the user out until the row expires.
+    """
+    now = datetime.utcnow()
+    rows = db.query(ChannelMember.channel_id, ChannelMember.is_member).filter(
+        ChannelMember.telegram_id == telegram_id,
+        ChannelMember.channel_id.in_(channel_ids),
+        or_(
+            and_(ChannelMember.is_member == True, ChannelMember.updated_at >= now - timedelta(days=CHANNEL_MEMBER_MAX_AGE)),
+            ChannelMember.updated_at >= now - timedelta(seconds=SUBSCRIPTION_NEGATIVE_TTL)
+        )
+    ).all()
+    
+    return {row.channel_id: row.is_member for row in rows}
+
+def store_membership(db: Session, telegram_id: int, channel_id: str, is_member: bool) -> None:
+    """Store a user's membership of a channel."""
+    member = db.query(ChannelMember).filter(
+        ChannelMember.telegram_id == telegram_id,
+        ChannelMember.channel_id == channel_id
+    ).first()
+    
+    if member:
+        member.is_member = is_member
+        member.updated_at = datetime.utcnow()
+    else:
+        db.add(ChannelMember(telegram_id=telegram_id, channel_id=channel_id, is_member=is_member))
+    
+    try:
+        db.commit()
+    except IntegrityError:
+        # Stored meanwhile by a concurrent update
+        db.rollback()
+    
+    cache_membership(telegram_id, channel_id, is_member)
+
+async def get_live_membership(telegram_id: int, channel_id: str, bot: Bot) -> Optional[bool]:
+    """Ask Telegram if user is a member of a channel, None if it can't tell."""
+    try:
+        member = await bot.get_chat_member(channel_id, telegram_id)
+    except Exception as e:
+        logging.error(f"Error checking subscription: {e}")
+        return None
+    
+    # Check if user is a member (not left or kicked)
+    return member.status not in ["left", "kicked"]
+
 async def check_subscription(telegram_id: int, bot: Bot, db: Session) -> bool:
     """Check if user is subscribed to required channels."""
     # Get required channels
-    channels = db.query(SubscriptionChannel).filter(SubscriptionChannel.is_required == True).all()
+    channels = get_required_channels(db)
     
     if not channels:
         return True
     
+    # Cached memberships first
+    unknown = []
     for channel in channels:
-        try:
-            # Check if user is a member of the channel
-            member = await bot.get_chat_member(channel.channel_id, telegram_id)
-            
-            # Check if user is a member (not left or kicked)
-            if member.status in ["left", "kicked"]:
-                return False
-        except Exception as e:
-            logging.error(f"Error checking subscription: {e}")
-            # If there's an error, assume user is not subscribed
+        is_member = membership_cache.get((telegram_id, channel.channel_id))
+        
+        if is_member is False:
             return False
+        
+        if is_member is None:
+            unknown.append(channel.channel_id)
     
-    return True
+    if not unknown:
+        return True
+    
+    # Then memberships stored from chat_member updates
+    stored = get_stored_memberships(db, telegram_id, unknown)
+    
+    for channel_id, is_member in stored.items():
+        cache_membership(telegram_id, channel_id, is_member)
+    
+    if not all(stored.values()):
+        return False
+    
+    unknown = [channel_id for channel_id in unknown if channel_id not in stored]
+    
+    if not unknown:
+        return True
+    
+    # Ask Telegram about the rest, all channels at once
+    results = await asyncio.gather(*(get_live_membership(telegram_id, channel_id, bot) for channel_id in unknown))
+    
+    for channel_id, is_member in zip(unknown, results):
+        # Only members are stored, non-members are asked again once the
+        # short cache entry expires
+        if is_member:
+            store_membership(db, telegram_id, channel_id, is_member)
+        elif is_member is False:
+            cache_membership(telegram_id, channel_id, is_member)
+    
+    # If there's an error, assume user is not subscribed
+    return all(results)
 
 def get_subscription_buttons(db: Session, lang: str):
     """Get subscription buttons."""
@@ -111,7 +289,7 @@ def get_subscription_buttons(db: Session, lang: str):
     from ..localization.strings import get_string
     
     # Get required channels
-    channels = db.query(SubscriptionChannel).filter(SubscriptionChannel.is_required == True).all()
+    channels = get_required_channels(db)
     
     if not channels:
         return None
@@ -173,82 +351,33 @@ def get_or_create_tags(db: Session, tag_names: List[str]) -> List[Tag]:
     
     return tags
 
-def get_file_by_share_code(db: Session, share_code: str) -> Optional[File]:
+async def get_file_by_share_code(db: AsyncSession, share_code: str) -> Optional[File]:
     """Get file by share code."""
-    return db.query(File).filter(File.share_code == share_code).first()
+    result = await db.execute(select(File).where(File.share_code == share_code))
+    return result.scalars().first()
 
-def update_file_stats(db: Session, file_id: int, is_download: bool = False, is_view: bool = False) -> None:
-    """Update file statistics."""
-    file = db.query(File).filter(File.id == file_id).first()
-    
-    if not file:
-        return
-    
+def update_file_stats(file_id: int, is_download: bool = False, is_view: bool = False) -> None:
+    """Update file statistics (written in batches)."""
     if is_download:
-        file.download_count += 1
+        file_counters.add_download(file_id)
     
     if is_view:
-        file.view_count += 1
-    
-    db.commit()
+        file_counters.add_view(file_id)
 
-def add_file_download(db: Session, file_id: int, telegram_id: int) -> None:
-    """Add file download record."""
-    user = db.query(User).filter(User.telegram_id == telegram_id).first()
-    
-    if not user:
-        return
-    
-    # Check if download record already exists
-    download = db.query(FileDownload).filter(
-        FileDownload.file_id == file_id,
-        FileDownload.user_id == user.id
-    ).first()
+async def add_file_download(db: AsyncSession, file_id: int, telegram_id: int) -> None:
+    """Add file download record (written in batches)."""
+    cached = user_cache.get(telegram_id)
     
-    if download:
-        # Update existing record
-        download.download_count += 1
-        download.last_download = datetime.utcnow()
+    if cached:
+        user_id = cached.id
     else:
-        # Create new record
-        download = FileDownload(
-            file_id=file_id,
-            user_id=user.id,
-            download_count=1
-        )
-        db.add(download)
-    
-    db.commit()
-
-def get_user_files(db: Session, telegram_id: int) -> List[File]:
-    """Get files uploaded by user."""
-    user = db.query(User).filter(User.telegram_id == telegram_id).first()
+        result = await db.execute(select(User.id).where(User.telegram_id == telegram_id))
+        user_id = result.scalar()
     
-    if not user:
-        return []
-    
-    return db.query(File).filter(File.owner_id == user.id).all()
-
-def search_files_by_name(db: Session, query: str) -> List[File]:
-    """Search files by name."""
-    return db.query(File).filter(File.file_name.ilike(f"%{query}%")).all()
-
-def search_files_by_tag(db: Session, query: str) -> List[File]:
-    """Search files by tag."""
-    tag = db.query(Tag).filter(Tag.name.ilike(f"%{query}%")).first()
-    
-    if not tag:
-        return []
+    if not user_id:
+        return
     
-    return tag.files
-
-def search_files_by_category(db: Session, category_id: int) -> List[File]:
-    """Search files by category."""
-    return db.query(File).filter(File.category_id == category_id).all()
-
-def search_files_by_format(db: Session, format_id: int) -> List[File]:
-    """Search files by format."""
-    return db.query(File).filter(File.format_id == format_id).all()
+    file_counters.add_user_download(file_id, user_id)
 
 def get_active_users(db: Session, days: int = 7) -> List[User]:
     """Get active users in the last X days."""
@@ -260,11 +389,22 @@ def get_total_storage_used(db: Session) -> str:
     total_size = db.query(db.func.sum(File.file_size)).scalar() or 0
     return get_file_size_str(total_size)
 
+def checkpoint_sqlite(db_path: str) -> None:
+    """Move WAL contents into the main database file."""
+    connection = sqlite3.connect(db_path)
+    try:
+        connection.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    finally:
+        connection.close()
+
 def create_backup(db_path: str, backup_dir: str = "backups") -> Dict[str, Any]:
     """Create database backup."""
     # Create backup directory if it doesn't exist
     os.makedirs(backup_dir, exist_ok=True)
     
+    # Flush WAL so the copied file is complete
+    checkpoint_sqlite(db_path)
+    
     # Generate backup filename
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     backup_filename = os.path.join(backup_dir, f"backup_{timestamp}.db")
@@ -286,10 +426,17 @@ def restore_backup(backup_filename: str, db_path: str) -> None:
     if not os.path.exists(backup_filename):
         raise FileNotFoundError(f"Backup file not found: {backup_filename}")
     
+    # Flush WAL so it is not replayed over the restored file
+    checkpoint_sqlite(db_path)
+    
     # Create backup of current database
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     current_backup = f"{db_path}.{timestamp}.bak"
     shutil.copy2(db_path, current_backup)
     
     # Restore backup
-    shutil.copy2(backup_filename, db_path)
\ No newline at end of file
+    shutil.copy2(backup_filename, db_path)
+    
+    # Settings cached from the replaced database are stale
+    from ..database.db import invalidate_settings
+    invalidate_settings()
\ No newline at end of file
@@ -1,80 +1,209 @@
 """
 Notification utilities for the bot.
 """
+import os
+import html
+import asyncio
 import logging
-from typing import List, Optional, Union
-from datetime import datetime
+import threading
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, List, Optional, Tuple, TypeVar, Union
+from datetime import datetime, timedelta
+from sqlalchemy import insert, select
 from sqlalchemy.orm import Session
 from aiogram import Bot
 
+from ..database.db import async_engine
 from ..database.models import User, File, Notification
+from .helpers import get_cached_user
+from .rate_limit import telegram_limiter
+
+# Bulk send settings
+NOTIFICATION_CONCURRENCY = int(os.getenv("NOTIFICATION_CONCURRENCY", "20"))  # sends in flight
+NOTIFICATION_BATCH_SIZE = int(os.getenv("NOTIFICATION_BATCH_SIZE", "1000"))  # recipients fetched per round trip
+
+# Download digest settings
+DOWNLOAD_NOTIFICATION_WINDOW = int(os.getenv("DOWNLOAD_NOTIFICATION_WINDOW", "10"))  # minutes
+DIGEST_TOP_FILES = 5
+
+T = TypeVar("T")
+
+async def iterate(items: Union[Iterable[T], AsyncIterable[T]]) -> AsyncIterator[T]:
+    """Iterate over a sync or async iterable asynchronously."""
+    if hasattr(items, "__aiter__"):
+        async for item in items:
+            yield item
+    else:
+        for item in items:
+            yield item
+
+async def iter_telegram_ids(*filters, batch_size: int = NOTIFICATION_BATCH_SIZE) -> AsyncIterator[int]:
+    """Yield the telegram IDs of users matching filters, fetched in id-ordered batches.
+    
+    Every batch is a short query of its own, so no cursor or transaction
+    stays open while the notifications are sent.
+    """
+    last_id = 0
+    
+    while True:
+        async with async_engine.connect() as connection:
+            rows = (await connection.execute(
+                select(User.id, User.telegram_id)
+                .where(User.id > last_id, *filters)
+                .order_by(User.id)
+                .limit(batch_size)
+            )).all()
+        
+        for row in rows:
+            yield row.telegram_id
+        
+        if len(rows) < batch_size:
+            return
+        
+        last_id = rows[-1].id
 
 async def send_notification_to_user(bot: Bot, user_id: int, message: str) -> bool:
     """Send notification to a user."""
     try:
-        await bot.send_message(chat_id=user_id, text=message)
+        await telegram_limiter.send(user_id, lambda: bot.send_message(chat_id=user_id, text=message))
         return True
     except Exception as e:
         logging.error(f"Error sending notification to user {user_id}: {e}")
         return False
 
-async def send_notification_to_users(bot: Bot, user_ids: List[int], message: str) -> int:
-    """Send notification to multiple users."""
+async def send_notifications(bot: Bot, messages: Union[Iterable[Tuple[int, str]], AsyncIterable[Tuple[int, str]]],
+                             concurrency: int = NOTIFICATION_CONCURRENCY) -> int:
+    """Send (user ID, message) notifications, a bounded number at a time."""
     success_count = 0
-    for user_id in user_ids:
-        if await send_notification_to_user(bot, user_id, message):
-            success_count += 1
+    pending = set()
+    
+    # Only take the next recipient when a send slot is free
+    async for user_id, message in iterate(messages):
+        if len(pending) >= concurrency:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            success_count += sum(task.result() for task in done)
+        
+        pending.add(asyncio.ensure_future(send_notification_to_user(bot, user_id, message)))
+    
+    if pending:
+        done, _ = await asyncio.wait(pending)
+        success_count += sum(task.result() for task in done)
+    
     return success_count
 
+async def send_notification_to_users(bot: Bot, user_ids: Union[Iterable[int], AsyncIterable[int]], message: str,
+                                     concurrency: int = NOTIFICATION_CONCURRENCY) -> int:
+    """Send notification to multiple users."""
+    return await send_notifications(bot, ((user_id, message) async for user_id in iterate(user_ids)), concurrency)
+
 async def send_notification_to_all_users(bot: Bot, db: Session, message: str) -> int:
     """Send notification to all users."""
-    users = db.query(User).all()
-    user_ids = [user.telegram_id for user in users]
-    return await send_notification_to_users(bot, user_ids, message)
+    return await send_notification_to_users(bot, iter_telegram_ids(), message)
 
 async def send_notification_to_active_users(bot: Bot, db: Session, message: str, days: int = 7) -> int:
     """Send notification to active users."""
-    from .helpers import get_active_users
-    active_users = get_active_users(db, days)
-    user_ids = [user.telegram_id for user in active_users]
-    return await send_notification_to_users(bot, user_ids, message)
+    cutoff_date = datetime.utcnow() - timedelta(days=days)
+    return await send_notification_to_users(bot, iter_telegram_ids(User.last_activity >= cutoff_date), message)
 
-async def send_file_download_notification(bot: Bot, db: Session, file_id: int, downloader_id: int) -> bool:
-    """Send notification to file owner when someone downloads their file."""
-    # Get file
-    file = db.query(File).filter(File.id == file_id).first()
+class DownloadNotificationBuffer:
+    """Collect downloads per file owner and send each owner one digest per window."""
     
-    if not file:
-        return False
+    def __init__(self, window: int = DOWNLOAD_NOTIFICATION_WINDOW):
+        self.window = window
+        self._downloads: Dict[int, Dict[int, list]] = {}
+        self._lock = threading.Lock()
     
-    # Get file owner
-    owner = db.query(User).filter(User.id == file.owner_id).first()
+    def add(self, owner_id: int, file_id: int, file_name: str) -> None:
+        """Record a download of an owner's file."""
+        with self._lock:
+            files = self._downloads.setdefault(owner_id, {})
+            entry = files.get(file_id)
+            if entry:
+                entry[1] += 1
+            else:
+                # [file name, downloads]
+                files[file_id] = [file_name, 1]
     
-    if not owner:
-        return False
+    def format_digest(self, files: Dict[int, list]) -> str:
+        """Build the digest message of one owner."""
+        total = sum(count for _, count in files.values())
+        
+        if total == 1:
+            (file_name, _), = files.values()
+            return f"📥 Your file '{html.escape(file_name)}' was downloaded."
+        
+        top_files = sorted(files.values(), key=lambda entry: entry[1], reverse=True)[:DIGEST_TOP_FILES]
+        lines = [f"📥 Your files were downloaded {total} times in the last {self.window} min."]
+        lines.extend(f"• {html.escape(file_name)}: {count}" for file_name, count in top_files)
+        
+        if len(files) > len(top_files):
+            lines.append(f"… and {len(files) - len(top_files)} more files")
+        
+        return "\n".join(lines)
     
-    # Get downloader
-    downloader = db.query(User).filter(User.telegram_id == downloader_id).first()
+    async def flush(self, bot: Bot) -> int:
+        """Store and send the digests of the current window."""
+        with self._lock:
+            downloads, self._downloads = self._downloads, {}
+        
+        if not downloads:
+            return 0
+        
+        messages = {owner_id: self.format_digest(files) for owner_id, files in downloads.items()}
+        owner_ids = list(messages)
+        now = datetime.utcnow()
+        
+        try:
+            async with async_engine.begin() as connection:
+                # Look up owners in chunks
+                owners = {}
+                for start in range(0, len(owner_ids), 500):
+                    result = await connection.execute(
+                        select(User.id, User.telegram_id).where(User.id.in_(owner_ids[start:start + 500]))
+                    )
+                    owners.update(result.all())
+                
+                if owners:
+                    await connection.execute(insert(Notification), [
+                        {
+                            "user_id": owner_id,
+                            "message": messages[owner_id],
+                            "is_read": False,
+                            "notification_type": "file_download",
+                            "created_at": now
+                        }
+                        for owner_id in owners
+                    ])
+        except Exception as e:
+            logging.error(f"Error storing download notifications: {e}")
+            self._restore(downloads)
+            return 0
+        
+        return await send_notifications(bot, ((telegram_id, messages[owner_id]) for owner_id, telegram_id in owners.items()))
     
-    if not downloader:
-        return False
+    def _restore(self, downloads: Dict[int, Dict[int, list]]) -> None:
+        """Put downloads back after a failed flush, to go out with the next digest."""
+        with self._lock:
+            for owner_id, files in downloads.items():
+                current = self._downloads.setdefault(owner_id, {})
+                
+                for file_id, (file_name, count) in files.items():
+                    entry = current.get(file_id)
+                    if entry:
+                        entry[1] += count
+                    else:
+                        current[file_id] = [file_name, count]
+
+# Shared download digest buffer
+download_notifications = DownloadNotificationBuffer()
+
+def notify_file_download(db: Session, file: File, downloader_id: int) -> None:
+    """Add a download to the owner's next digest, unless the owner downloaded it."""
+    downloader = get_cached_user(db, downloader_id)
     
-    # Create notification message
-    downloader_name = downloader.username or f"{downloader.first_name or ''} {downloader.last_name or ''}".strip() or f"User {downloader.telegram_id}"
-    message = f"📥 Your file '{file.file_name}' was downloaded by {downloader_name}."
-    
-    # Store notification in database
-    notification = Notification(
-        user_id=owner.id,
-        message=message,
-        is_read=False,
-        notification_type="file_download"
-    )
-    db.add(notification)
-    db.commit()
+    if downloader and downloader.id == file.owner_id:
+        return
     
-    # Send notification
-    return await send_notification_to_user(bot, owner.telegram_id, message)
+    download_notifications.add(file.owner_id, file.id, file.file_name)
 
 async def send_system_notification(bot: Bot, db: Session, message: str, notification_type: str = "system") -> int:
     """Send system notification to all admin users."""
@@ -0,0 +1,131 @@
+"""
+Keyset pagination utilities for the bot.
+
+Result lists are paged by a descending (value, id) key instead of an
+offset, so every page costs the same no matter how deep the user goes.
+The key of the page boundary travels in the button's callback_data,
+which Telegram limits to 64 bytes, e.g. "pg:c:12:3:n1a.2f".
+"""
+import os
+import base64
+import binascii
+from datetime import datetime, timedelta
+from typing import Any, Callable, List, NamedTuple, Optional, Tuple
+from sqlalchemy import and_, or_
+
+# Items per result page
+PAGE_SIZE = int(os.getenv("PAGE_SIZE", "10"))
+
+CALLBACK_PREFIX = "pg"
+NEXT = "n"
+PREVIOUS = "p"
+
+EPOCH = datetime(1970, 1, 1)
+
+class KeysetOrder(NamedTuple):
+    """Descending (value, id) order of a result list."""
+    column: Any  # SQL expression of the value
+    id_column: Any
+    key: Callable[[Any], int]  # row -> integer value
+    from_key: Callable[[int], Any]  # integer value -> SQL value
+
+class PageRequest(NamedTuple):
+    """Page parsed from callback_data."""
+    kind: str
+    arg: str
+    page: int
+    direction: str
+    cursor: Optional[str]
+
+def to_base36(number: int) -> str:
+    """Encode a non-negative integer in base 36."""
+    digits = "0123456789abcdefghijklmnopqrstuvwxyz"
+    result = ""
+    
+    while True:
+        number, remainder = divmod(number, 36)
+        result = digits[remainder] + result
+        
+        if not number:
+            return result
+
+def datetime_to_key(value: datetime) -> int:
+    """Convert a datetime to microseconds since the epoch."""
+    delta = (value or EPOCH) - EPOCH
+    return (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+
+def key_to_datetime(key: int) -> datetime:
+    """Convert microseconds since the epoch to a datetime."""
+    return EPOCH + timedelta(microseconds=key)
+
+def encode_cursor(order: KeysetOrder, row) -> str:
+    """Encode the key of a row as a cursor."""
+    return f"{to_base36(order.key(row))}.{to_base36(row.id)}"
+
+def decode_cursor(cursor: str) -> Tuple[int, int]:
+    """Decode a cursor into its value and id."""
+    value, row_id = cursor.split(".")
+    return int(value, 36), int(row_id, 36)
+
+def encode_opaque_cursor(cursor: str) -> str:
+    """Wrap a cursor for API clients."""
+    return base64.urlsafe_b64encode(cursor.encode()).decode().rstrip("=")
+
+def decode_opaque_cursor(token: str) -> str:
+    """Unwrap an API cursor, raising ValueError if it is malformed."""
+    try:
+        cursor = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4)).decode()
+        decode_cursor(cursor)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise ValueError(f"Invalid cursor: {token}")
+    
+    return cursor
+
+def page_callback(kind: str, arg: Any, page: int, direction: str, cursor: str) -> str:
+    """Build the callback_data of a page button."""
+    return f"{CALLBACK_PREFIX}:{kind}:{arg}:{page}:{direction}{cursor}"
+
+def parse_page_callback(data: str) -> PageRequest:
+    """Parse the callback_data of a page button."""
+    _, kind, arg, page, position = data.split(":")
+    return PageRequest(kind, arg, int(page), position[:1], position[1:] or None)
+
+def keyset_filter(order: KeysetOrder, cursor: str, direction: str = NEXT):
+    """Get the condition selecting the rows after (NEXT) or before (PREVIOUS) a cursor."""
+    value, row_id = decode_cursor(cursor)
+    value = order.from_key(value)
+    
+    if direction == PREVIOUS:
+        return or_(order.column > value, and_(order.column == value, order.id_column > row_id))
+    
+    return or_(order.column < value, and_(order.column == value, order.id_column < row_id))
+
+def fetch_page(query, order: KeysetOrder, cursor: Optional[str] = None, direction: str = NEXT,
+               limit: int = None) -> Tuple[List[Any], bool, bool]:
+    """Fetch one page of a query.
+    
+    The cursor is the key of the last row of the previous page (NEXT) or of
+    the first row of the following page (PREVIOUS). Returns the rows in
+    display order, whether there is a previous page and whether there is
+    a next page.
+    """
+    limit = limit or PAGE_SIZE
+    
+    if cursor:
+        query = query.filter(keyset_filter(order, cursor, direction))
+    
+    if direction == PREVIOUS:
+        query = query.order_by(order.column.asc(), order.id_column.asc())
+    else:
+        query = query.order_by(order.column.desc(), order.id_column.desc())
+    
+    # One extra row tells whether there is another page
+    rows = query.limit(limit + 1).all()
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    
+    if direction == PREVIOUS:
+        rows.reverse()
+        return rows, has_more, True
+    
+    return rows, cursor is not None, has_more
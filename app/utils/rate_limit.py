@@ -0,0 +1,106 @@
+"""
+Send rate limiting for the bot.
+
+Telegram allows about 30 messages per second overall and about one
+message per second to the same chat, and answers 429 with a retry_after
+when a bot goes faster. Bulk senders go through a SendRateLimiter, which
+keeps a global token bucket and one per chat, and on a 429 pauses the
+global bucket for retry_after seconds before retrying.
+"""
+import os
+import time
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Hashable
+from aiogram.exceptions import TelegramRetryAfter
+
+from .cache import TTLCache
+
+# Rate settings
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "25"))  # messages per second
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))  # messages per second to one chat
+TELEGRAM_MAX_RETRIES = int(os.getenv("TELEGRAM_MAX_RETRIES", "3"))  # retries after a 429
+
+class TokenBucket:
+    """Token bucket refilled at rate tokens per second, up to capacity."""
+    
+    def __init__(self, rate: float, capacity: float = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = asyncio.Lock()
+    
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+    
+    async def acquire(self) -> None:
+        """Wait for a token."""
+        # Waiters are served one at a time, in order
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                
+                self._refill(now)
+                
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+    
+    def pause(self, seconds: float) -> None:
+        """Hand out no tokens for the given time, then start from empty."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.updated_at = self.paused_until
+        self.tokens = 0
+
+class SendRateLimiter:
+    """Global and per-chat send limits with retry on 429."""
+    
+    def __init__(self, rate: float = TELEGRAM_GLOBAL_RATE, chat_rate: float = TELEGRAM_CHAT_RATE,
+                 max_retries: int = TELEGRAM_MAX_RETRIES):
+        self.bucket = TokenBucket(rate)
+        self.chat_rate = chat_rate
+        self.max_retries = max_retries
+        self.retries = 0
+        self._chats = TTLCache(maxsize=10000, ttl=60)
+    
+    async def acquire(self, chat_id: Hashable) -> None:
+        """Wait until a message may be sent to a chat."""
+        bucket = self._chats.get(chat_id)
+        
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, 1)
+            self._chats.set(chat_id, bucket)
+        
+        await bucket.acquire()
+        await self.bucket.acquire()
+    
+    async def send(self, chat_id: Hashable, send: Callable[[], Awaitable[Any]]) -> Any:
+        """Call send() within the limits, retrying after a 429."""
+        attempt = 0
+        
+        while True:
+            await self.acquire(chat_id)
+            
+            try:
+                return await send()
+            except TelegramRetryAfter as e:
+                attempt += 1
+                self.retries += 1
+                
+                if attempt > self.max_retries:
+                    raise
+                
+                logging.warning(f"Flood limit hit sending to {chat_id}, pausing for {e.retry_after}s")
+                self.bucket.pause(e.retry_after)
+
+# Shared by everything that sends in bulk from the bot process
+telegram_limiter = SendRateLimiter()
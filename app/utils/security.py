@@ -106,6 +106,10 @@ def generate_api_key() -> str:
     """Generate an API key."""
     return f"api_{generate_secure_token(32)}"
 
+def hash_api_key(api_key: str) -> str:
+    """Hash an API key for storage and lookup."""
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
 def validate_api_key(api_key: str, db_api_key: str) -> bool:
     """Validate an API key."""
     return secrets.compare_digest(api_key, db_api_key)
@@ -10,11 +10,18 @@ import secrets
 import uvicorn
 from datetime import datetime, timedelta
 
-from ..database.db import get_db
+from ..database.db import get_db, get_engine_pool_stats, invalidate_settings
 from ..database.models import User, File, Category, Format, Tag, SubscriptionChannel, Settings, Backup
-from ..utils.helpers import get_file_size_str, create_backup, restore_backup
-from ..utils.analytics import get_dashboard_stats
-from ..api.api import api_app
+from ..database.search import apply_file_search
+from ..utils.helpers import (
+    get_file_size_str, create_backup, restore_backup, invalidate_user, user_cache,
+    invalidate_subscription_channels, membership_cache
+)
+from ..utils.analytics import get_dashboard_stats, get_api_usage
+from ..utils.security import generate_api_key, hash_api_key
+from ..api.api import api_app, api_key_cache, invalidate_api_key
+from ..api.request_log import api_request_log
+from ..api.upload_worker import upload_workers
 
 # Load environment variables
 load_dotenv()
@@ -40,6 +47,17 @@ app.mount("/static", StaticFiles(directory="app/web/static"), name="static")
 # Mount API
 app.mount("/api", api_app)
 
+@app.on_event("shutdown")
+async def write_api_logs():
+    """Write queued API request logs before exiting."""
+    # Mounted apps don't get lifespan events, so the admin app flushes them
+    await api_request_log.close()
+
+@app.on_event("shutdown")
+async def stop_upload_workers():
+    """Stop the API upload workers."""
+    await upload_workers.close()
+
 def verify_credentials(credentials: HTTPBasicCredentials = Depends(security)):
     """Verify admin credentials."""
     correct_username = secrets.compare_digest(credentials.username, WEB_ADMIN_USERNAME)
@@ -175,6 +193,61 @@ async def update_user(
     
     db.commit()
     
+    # Drop cached user so the bot and the API see the change
+    invalidate_user(user.telegram_id)
+    invalidate_api_key(user.api_key_hash)
+    
+    return RedirectResponse(url=f"/users/{user_id}", status_code=303)
+
+@app.post("/users/{user_id}/api-key/generate")
+async def generate_user_api_key(
+    user_id: int,
+    username: str = Depends(verify_credentials),
+    db: Session = Depends(get_db)
+):
+    """Generate a new API key for a user, replacing the old one."""
+    # Get user
+    user = db.query(User).filter(User.id == user_id).first()
+    
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    # Only the hash is stored, so the key is shown once
+    old_key_hash = user.api_key_hash
+    api_key = generate_api_key()
+    user.api_key_hash = hash_api_key(api_key)
+    user.api_key = None
+    
+    db.commit()
+    
+    # The old key stops working immediately
+    invalidate_api_key(old_key_hash)
+    invalidate_api_key(user.api_key_hash)
+    
+    return {"user_id": user.id, "api_key": api_key}
+
+@app.post("/users/{user_id}/api-key/revoke")
+async def revoke_user_api_key(
+    user_id: int,
+    username: str = Depends(verify_credentials),
+    db: Session = Depends(get_db)
+):
+    """Revoke the API key of a user."""
+    # Get user
+    user = db.query(User).filter(User.id == user_id).first()
+    
+    if not user:
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    old_key_hash = user.api_key_hash
+    user.api_key_hash = None
+    user.api_key = None
+    
+    db.commit()
+    
+    # The key stops working immediately
+    invalidate_api_key(old_key_hash)
+    
     return RedirectResponse(url=f"/users/{user_id}", status_code=303)
 
 @app.get("/categories", response_class=HTMLResponse)
@@ -392,6 +465,9 @@ async def add_subscription(
     db.add(channel)
     db.commit()
     
+    # Refresh cached channels
+    invalidate_subscription_channels()
+    
     return RedirectResponse(url="/subscriptions", status_code=303)
 
 @app.post("/subscriptions/{channel_id}/update")
@@ -419,6 +495,9 @@ async def update_subscription(
     
     db.commit()
     
+    # Refresh cached channels
+    invalidate_subscription_channels()
+    
     return RedirectResponse(url="/subscriptions", status_code=303)
 
 @app.get("/settings", response_class=HTMLResponse)
@@ -458,6 +537,9 @@ async def update_setting(
     
     db.commit()
     
+    # Reload cached settings on next access
+    invalidate_settings()
+    
     return RedirectResponse(url="/settings", status_code=303)
 
 @app.get("/backups", response_class=HTMLResponse)
@@ -571,7 +653,7 @@ async def files(
     query = db.query(File)
     
     if search:
-        query = query.filter(File.file_name.ilike(f"%{search}%"))
+        query = apply_file_search(query, search)
     
     total_files = query.count()
     files = query.order_by(File.upload_date.desc()).offset(offset).limit(limit).all()
@@ -652,14 +734,42 @@ async def analytics(
     # Get dashboard statistics
     stats = get_dashboard_stats(db)
     
+    # Get API usage from the hourly rollups
+    api_usage = get_api_usage(db)
+    
     return templates.TemplateResponse(
         "analytics.html",
         {
             "request": request,
-            "stats": stats
+            "stats": stats,
+            "api_usage": api_usage
         }
     )
 
+@app.get("/pool-stats")
+async def pool_stats(username: str = Depends(verify_credentials)):
+    """Database connection pool statistics."""
+    return get_engine_pool_stats()
+
+@app.get("/api-log-stats")
+async def api_log_stats(username: str = Depends(verify_credentials)):
+    """API request log queue statistics."""
+    return api_request_log.stats()
+
+@app.get("/upload-stats")
+async def upload_stats(username: str = Depends(verify_credentials)):
+    """API upload queue statistics."""
+    return upload_workers.stats()
+
+@app.get("/cache-stats")
+async def cache_stats(username: str = Depends(verify_credentials)):
+    """In-process cache statistics."""
+    return {
+        "users": user_cache.stats(),
+        "api_keys": api_key_cache.stats(),
+        "subscriptions": membership_cache.stats()
+    }
+
 def run_web_server():
     """Run web server."""
     uvicorn.run(app, host=WEB_HOST, port=WEB_PORT)
\ No newline at end of file
@@ -0,0 +1,161 @@
+"""
+Benchmark the hot queries with and without the secondary indexes.
+
+Builds a throwaway SQLite database with the bot schema, fills it with
+synthetic rows and prints the query plan and timing of each hot query
+before and after the model indexes are created.
+
+Usage: python benchmarks/index_query_plans.py [--files 1000000]
+"""
+import os
+import sys
+import time
+import random
+import hashlib
+import argparse
+import tempfile
+from datetime import datetime, timedelta
+
+# Use a throwaway database
+TEMP_DIR = tempfile.mkdtemp(prefix="index_bench_")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TEMP_DIR, 'bench.db')}"
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import text
+from app.database.db import engine, Base
+from app.database.migrations import run_migrations
+from app.database import models  # noqa: F401 (registers the tables)
+
+HOT_QUERIES = [
+    ("files by owner", "SELECT * FROM files WHERE owner_id = :user_id ORDER BY upload_date DESC LIMIT 20"),
+    ("files by category", "SELECT * FROM files WHERE category_id = :category_id LIMIT 20"),
+    ("files by format", "SELECT * FROM files WHERE format_id = :format_id LIMIT 20"),
+    ("recent files", "SELECT * FROM files ORDER BY upload_date DESC LIMIT 20"),
+    ("active users", "SELECT COUNT(*) FROM users WHERE last_activity >= :since"),
+    ("referred users", "SELECT COUNT(*) FROM users WHERE referred_by = :user_id"),
+    ("user by api key", "SELECT * FROM users WHERE api_key_hash = :api_key_hash"),
+    ("download record", "SELECT * FROM file_download_stats WHERE file_id = :file_id AND user_id = :user_id"),
+    ("unread notifications", "SELECT * FROM notifications WHERE user_id = :user_id AND is_read = 0 ORDER BY created_at DESC LIMIT 10"),
+    ("recent api logs", "SELECT COUNT(*) FROM api_logs WHERE created_at >= :since"),
+]
+
+def create_schema_without_indexes():
+    """Create the tables with their unique constraints but no secondary indexes."""
+    Base.metadata.create_all(bind=engine)
+    with engine.begin() as connection:
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                connection.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+
+def hash_key(api_key: str) -> str:
+    """Hash an API key the way the bot stores it."""
+    return hashlib.sha256(api_key.encode()).hexdigest()
+
+def fill(files: int):
+    """Insert synthetic rows."""
+    users = max(files // 50, 10)
+    now = datetime.utcnow()
+    random.seed(42)
+    
+    with engine.begin() as connection:
+        connection.execute(
+            text("INSERT INTO users (id, telegram_id, referral_code, last_activity, referred_by, api_key_hash) VALUES (:id, :id, :code, :last_activity, :referred_by, :api_key_hash)"),
+            [
+                {
+                    "id": i,
+                    "code": f"ref_{i}",
+                    "last_activity": now - timedelta(minutes=random.randint(0, 60 * 24 * 90)),
+                    "referred_by": random.randint(1, i) if i > 1 and random.random() < 0.3 else None,
+                    "api_key_hash": hash_key(f"api_{i}") if random.random() < 0.1 else None
+                }
+                for i in range(1, users + 1)
+            ]
+        )
+        
+        batch = []
+        for i in range(1, files + 1):
+            batch.append({
+                "id": i,
+                "owner_id": random.randint(1, users),
+                "category_id": random.randint(1, 13),
+                "format_id": random.randint(1, 21),
+                "upload_date": now - timedelta(seconds=random.randint(0, 3600 * 24 * 365)),
+                "code": f"code_{i}"
+            })
+            if len(batch) == 10000:
+                insert_files(connection, batch)
+                batch = []
+        if batch:
+            insert_files(connection, batch)
+        
+        connection.execute(
+            text("INSERT INTO file_download_stats (file_id, user_id, download_count) VALUES (:file_id, :user_id, 1)"),
+            [{"file_id": random.randint(1, files), "user_id": random.randint(1, users)} for _ in range(files // 2)]
+        )
+        connection.execute(
+            text("INSERT INTO notifications (user_id, message, is_read, created_at) VALUES (:user_id, 'n', :is_read, :created_at)"),
+            [
+                {"user_id": random.randint(1, users), "is_read": random.random() < 0.8, "created_at": now - timedelta(minutes=random.randint(0, 60 * 24 * 30))}
+                for _ in range(files // 2)
+            ]
+        )
+        connection.execute(
+            text("INSERT INTO api_logs (endpoint, method, status_code, created_at) VALUES ('/files', 'GET', 200, :created_at)"),
+            [{"created_at": now - timedelta(minutes=random.randint(0, 60 * 24 * 90))} for _ in range(files // 2)]
+        )
+    
+    return users
+
+def insert_files(connection, batch):
+    """Insert a batch of files."""
+    connection.execute(
+        text(
+            "INSERT INTO files (id, telegram_file_id, file_unique_id, file_name, file_size, file_type, message_id, "
+            "category_id, format_id, owner_id, share_link, share_code, upload_date, download_count, view_count) "
+            "VALUES (:id, 'x', 'x', 'file', 1, 'document', 1, :category_id, :format_id, :owner_id, 'l', :code, :upload_date, 0, 0)"
+        ),
+        batch
+    )
+
+def run_queries(label: str, params: dict):
+    """Print the plan and timing of every hot query."""
+    print(f"\n== {label} ==")
+    with engine.connect() as connection:
+        for name, sql in HOT_QUERIES:
+            plan = " | ".join(row[-1] for row in connection.execute(text(f"EXPLAIN QUERY PLAN {sql}"), params))
+            started = time.perf_counter()
+            for _ in range(5):
+                connection.execute(text(sql), params).fetchall()
+            elapsed = (time.perf_counter() - started) / 5 * 1000
+            print(f"{name:<22} {elapsed:>9.2f} ms  {plan}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark secondary indexes")
+    parser.add_argument("--files", type=int, default=1_000_000, help="Number of files to generate")
+    args = parser.parse_args()
+    
+    print(f"Building database with {args.files} files in {TEMP_DIR}...")
+    create_schema_without_indexes()
+    users = fill(args.files)
+    
+    params = {
+        "user_id": users // 2,
+        "category_id": 7,
+        "format_id": 11,
+        "file_id": args.files // 2,
+        "api_key_hash": hash_key(f"api_{users // 3}"),
+        "since": datetime.utcnow() - timedelta(days=1)
+    }
+    
+    run_queries("without secondary indexes", params)
+    
+    started = time.perf_counter()
+    run_migrations()
+    with engine.begin() as connection:
+        connection.execute(text("ANALYZE"))
+    print(f"\nCreated indexes in {time.perf_counter() - started:.1f} s")
+    
+    run_queries("with secondary indexes", params)
+
+if __name__ == "__main__":
+    main()
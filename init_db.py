@@ -2,6 +2,7 @@ import os
 import sys
 from dotenv import load_dotenv
 from app.database.db import init_db, add_admin_user
+from app.database.migrations import run_migrations
 from app.database.models import Category, Format, Settings, Base
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
@@ -153,10 +154,12 @@ def init_settings():
     
     print("Settings initialized successfully!")
 
-if __name__ == "__main__":
-    # Initialize database
+def main():
+    """Initialize database."""
+    # Apply schema migrations
     print("Initializing database...")
-    Base.metadata.create_all(engine)
+    applied = run_migrations()
+    print(f"Applied {applied} migrations")
     
     # Initialize data
     init_categories()
@@ -172,4 +175,7 @@ if __name__ == "__main__":
         for admin_id in admin_ids:
             add_admin_user(admin_id)
     
-    print("Database initialization completed successfully!")
\ No newline at end of file
+    print("Database initialization completed successfully!")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
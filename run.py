@@ -16,6 +16,7 @@ def main():
     if args.init_db:
         print("Initializing database...")
         import init_db
+        init_db.main()
         return
     
     # Run web admin panel only
@@ -0,0 +1,189 @@
+-- SQLite schema of the baseline release, before any versioned migration.
+-- Used to check that every migration upgrades an existing database.
+
+CREATE TABLE backups (
+	id INTEGER NOT NULL,
+	filename VARCHAR(255) NOT NULL,
+	size INTEGER NOT NULL,
+	is_auto BOOLEAN,
+	created_at DATETIME,
+	PRIMARY KEY (id)
+);
+
+CREATE TABLE categories (
+	id INTEGER NOT NULL,
+	name_en VARCHAR(255) NOT NULL,
+	name_ar VARCHAR(255) NOT NULL,
+	parent_id INTEGER,
+	is_active BOOLEAN,
+	created_at DATETIME,
+	PRIMARY KEY (id),
+	FOREIGN KEY(parent_id) REFERENCES categories (id)
+);
+
+CREATE TABLE settings (
+	id INTEGER NOT NULL,
+	"key" VARCHAR(255) NOT NULL,
+	value VARCHAR(255),
+	description VARCHAR(255),
+	updated_at DATETIME,
+	PRIMARY KEY (id),
+	UNIQUE ("key")
+);
+
+CREATE TABLE subscription_channels (
+	id INTEGER NOT NULL,
+	channel_id VARCHAR(255) NOT NULL,
+	channel_name VARCHAR(255) NOT NULL,
+	channel_link VARCHAR(255) NOT NULL,
+	is_required BOOLEAN,
+	created_at DATETIME,
+	PRIMARY KEY (id)
+);
+
+CREATE TABLE tags (
+	id INTEGER NOT NULL,
+	name VARCHAR(255) NOT NULL,
+	created_at DATETIME,
+	PRIMARY KEY (id),
+	UNIQUE (name)
+);
+
+CREATE TABLE users (
+	id INTEGER NOT NULL,
+	telegram_id INTEGER NOT NULL,
+	username VARCHAR(255),
+	first_name VARCHAR(255),
+	last_name VARCHAR(255),
+	language_code VARCHAR(10),
+	is_admin BOOLEAN,
+	is_moderator BOOLEAN,
+	is_banned BOOLEAN,
+	can_upload BOOLEAN,
+	created_at DATETIME,
+	last_activity DATETIME,
+	referral_code VARCHAR(255) NOT NULL,
+	referred_by INTEGER,
+	api_key VARCHAR(255),
+	PRIMARY KEY (id),
+	UNIQUE (telegram_id),
+	UNIQUE (referral_code),
+	FOREIGN KEY(referred_by) REFERENCES users (id)
+);
+
+CREATE TABLE api_logs (
+	id INTEGER NOT NULL,
+	user_id INTEGER,
+	endpoint VARCHAR(255) NOT NULL,
+	method VARCHAR(10) NOT NULL,
+	status_code INTEGER NOT NULL,
+	ip_address VARCHAR(50),
+	user_agent VARCHAR(255),
+	created_at DATETIME,
+	PRIMARY KEY (id),
+	FOREIGN KEY(user_id) REFERENCES users (id)
+);
+
+CREATE TABLE formats (
+	id INTEGER NOT NULL,
+	name VARCHAR(255) NOT NULL,
+	description_en VARCHAR(255),
+	description_ar VARCHAR(255),
+	category_id INTEGER,
+	is_active BOOLEAN,
+	created_at DATETIME,
+	PRIMARY KEY (id),
+	FOREIGN KEY(category_id) REFERENCES categories (id)
+);
+
+CREATE TABLE notifications (
+	id INTEGER NOT NULL,
+	user_id INTEGER NOT NULL,
+	message TEXT NOT NULL,
+	is_read BOOLEAN,
+	notification_type VARCHAR(50),
+	created_at DATETIME,
+	read_at DATETIME,
+	PRIMARY KEY (id),
+	FOREIGN KEY(user_id) REFERENCES users (id)
+);
+
+CREATE TABLE files (
+	id INTEGER NOT NULL,
+	telegram_file_id VARCHAR(255) NOT NULL,
+	file_unique_id VARCHAR(255) NOT NULL,
+	file_name VARCHAR(255) NOT NULL,
+	file_size INTEGER NOT NULL,
+	file_type VARCHAR(50) NOT NULL,
+	message_id INTEGER NOT NULL,
+	category_id INTEGER,
+	format_id INTEGER,
+	owner_id INTEGER NOT NULL,
+	source_url VARCHAR(255),
+	share_link VARCHAR(255) NOT NULL,
+	share_code VARCHAR(255) NOT NULL,
+	password VARCHAR(255),
+	is_encrypted BOOLEAN,
+	upload_date DATETIME,
+	expiry_date DATETIME,
+	download_count INTEGER,
+	view_count INTEGER,
+	rating FLOAT,
+	rating_count INTEGER,
+	PRIMARY KEY (id),
+	FOREIGN KEY(category_id) REFERENCES categories (id),
+	FOREIGN KEY(format_id) REFERENCES formats (id),
+	FOREIGN KEY(owner_id) REFERENCES users (id),
+	UNIQUE (share_code)
+);
+
+CREATE TABLE file_comments (
+	id INTEGER NOT NULL,
+	file_id INTEGER NOT NULL,
+	user_id INTEGER NOT NULL,
+	comment TEXT NOT NULL,
+	created_at DATETIME,
+	PRIMARY KEY (id),
+	FOREIGN KEY(file_id) REFERENCES files (id),
+	FOREIGN KEY(user_id) REFERENCES users (id)
+);
+
+CREATE TABLE file_download_stats (
+	id INTEGER NOT NULL,
+	file_id INTEGER NOT NULL,
+	user_id INTEGER NOT NULL,
+	download_count INTEGER,
+	first_download DATETIME,
+	last_download DATETIME,
+	PRIMARY KEY (id),
+	FOREIGN KEY(file_id) REFERENCES files (id),
+	FOREIGN KEY(user_id) REFERENCES users (id)
+);
+
+CREATE TABLE file_downloads (
+	file_id INTEGER NOT NULL,
+	user_id INTEGER NOT NULL,
+	download_date DATETIME,
+	PRIMARY KEY (file_id, user_id),
+	FOREIGN KEY(file_id) REFERENCES files (id),
+	FOREIGN KEY(user_id) REFERENCES users (id)
+);
+
+CREATE TABLE file_ratings (
+	id INTEGER NOT NULL,
+	file_id INTEGER NOT NULL,
+	user_id INTEGER NOT NULL,
+	rating INTEGER NOT NULL,
+	created_at DATETIME,
+	PRIMARY KEY (id),
+	FOREIGN KEY(file_id) REFERENCES files (id),
+	FOREIGN KEY(user_id) REFERENCES users (id)
+);
+
+CREATE TABLE file_tags (
+	file_id INTEGER NOT NULL,
+	tag_id INTEGER NOT NULL,
+	PRIMARY KEY (file_id, tag_id),
+	FOREIGN KEY(file_id) REFERENCES files (id),
+	FOREIGN KEY(tag_id) REFERENCES tags (id)
+);
@@ -0,0 +1,19 @@
+"""
+Test setup.
+
+The app reads DATABASE_URL when app.database.db is imported, so a
+throwaway SQLite database is configured here before any test imports it.
+Files the app creates on import (the encryption key) go to a temp
+directory instead of the working tree.
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEST_DIR = tempfile.mkdtemp(prefix="telegram_file_bot_tests_")
+
+sys.path.insert(0, ROOT)
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(TEST_DIR, 'test.db')}"
+os.environ["MIGRATION_BATCH_PAUSE"] = "0"
+os.chdir(TEST_DIR)
@@ -0,0 +1,122 @@
+"""
+API log rollup and retention tests.
+"""
+import os
+import re
+from datetime import datetime, timedelta
+import pytest
+from jinja2 import Environment, FileSystemLoader
+from sqlalchemy import insert
+
+from app.database.db import SessionLocal, engine, init_db
+from app.database.models import ApiLog, ApiLogRollup
+from app.utils import api_logs
+from app.utils.analytics import get_api_usage, get_dashboard_stats
+from app.utils.api_logs import delete_old_api_logs, get_rollup_watermark, rollup_api_logs
+
+HOUR = datetime(2024, 1, 1, 10)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+templates = Environment(loader=FileSystemLoader(os.path.join(ROOT, "app", "web", "templates")))
+
+def add_logs(*rows) -> None:
+    """Insert raw logs as (endpoint, status code, latency, created at)."""
+    with engine.begin() as connection:
+        connection.execute(insert(ApiLog), [
+            {"endpoint": endpoint, "method": "GET", "status_code": status_code, "latency_ms": latency_ms, "created_at": created_at}
+            for endpoint, status_code, latency_ms, created_at in rows
+        ])
+
+def get_rollups() -> dict:
+    """Get the rollups by (hour, endpoint, status code)."""
+    db = SessionLocal()
+    
+    try:
+        return {
+            (rollup.hour, rollup.endpoint, rollup.status_code): (rollup.request_count, rollup.latency_p50_ms, rollup.latency_p95_ms)
+            for rollup in db.query(ApiLogRollup).all()
+        }
+    finally:
+        db.close()
+
+def count_logs() -> int:
+    """Count the raw logs."""
+    db = SessionLocal()
+    
+    try:
+        return db.query(ApiLog).count()
+    finally:
+        db.close()
+
+@pytest.fixture(autouse=True)
+def clean_logs(monkeypatch):
+    init_db()
+    monkeypatch.setattr(api_logs, "API_LOG_DELETE_BATCH_SIZE", 5)
+    monkeypatch.setattr(api_logs, "API_LOG_DELETE_BATCH_PAUSE", 0)
+    
+    with engine.begin() as connection:
+        connection.execute(ApiLog.__table__.delete())
+        connection.execute(ApiLogRollup.__table__.delete())
+
+def test_rollup_counts_and_latency_percentiles():
+    add_logs(*[("/files", 200, latency, HOUR + timedelta(minutes=latency // 10)) for latency in range(100, 0, -10)])
+    add_logs(("/files/{file_id}", 404, None, HOUR + timedelta(minutes=30)))
+    
+    # The hour ends at 11:00 and is rolled up after the grace period
+    assert rollup_api_logs(now=HOUR + timedelta(hours=1, minutes=1)) == 0
+    assert rollup_api_logs(now=HOUR + timedelta(hours=1, minutes=10)) == 1
+    
+    assert get_rollups() == {
+        (HOUR, "/files", 200): (10, 50, 100),
+        (HOUR, "/files/{file_id}", 404): (1, None, None)
+    }
+
+def test_rollup_watermark_skips_rolled_up_hours():
+    add_logs(("/files", 200, 10, HOUR + timedelta(minutes=5)), ("/tags", 200, 20, HOUR + timedelta(hours=3)))
+    
+    with engine.connect() as connection:
+        assert get_rollup_watermark(connection) == HOUR
+    
+    # Hours without logs in between are skipped
+    assert rollup_api_logs(now=HOUR + timedelta(hours=5)) == 2
+    
+    with engine.connect() as connection:
+        assert get_rollup_watermark(connection) == HOUR + timedelta(hours=4)
+    
+    # Already rolled up hours are left alone
+    add_logs(("/files", 200, 30, HOUR + timedelta(minutes=10)))
+    assert rollup_api_logs(now=HOUR + timedelta(hours=5)) == 0
+    assert get_rollups()[(HOUR, "/files", 200)] == (1, 10, 10)
+
+def test_retention_deletes_only_rolled_up_logs():
+    add_logs(*[("/files", 200, 10, HOUR + timedelta(minutes=minute)) for minute in range(12)])
+    add_logs(("/files", 200, 10, HOUR + timedelta(hours=1, minutes=30)))
+    
+    # Nothing is deleted before it is rolled up
+    assert delete_old_api_logs(now=HOUR + timedelta(days=30)) == 0
+    
+    rollup_api_logs(now=HOUR + timedelta(hours=1, minutes=10))
+    
+    # Within the retention window
+    assert delete_old_api_logs(now=HOUR + timedelta(days=1)) == 0
+    
+    # Past it, in batches, keeping the hour that isn't rolled up
+    assert delete_old_api_logs(now=HOUR + timedelta(days=30)) == 12
+    assert count_logs() == 1
+
+def test_analytics_page_shows_rollups():
+    add_logs(
+        ("/api/files", 200, 42, datetime.utcnow() - timedelta(hours=3)),
+        ("/api/files", 401, 5, datetime.utcnow() - timedelta(hours=3))
+    )
+    rollup_api_logs()
+    
+    db = SessionLocal()
+    try:
+        html = templates.get_template("analytics.html").render(stats=get_dashboard_stats(db), api_usage=get_api_usage(db))
+    finally:
+        db.close()
+    
+    assert "<td>/api/files</td>" in html
+    assert "42 ms" in html
+    assert re.search(r"API Errors \(7d\)</h5>\s*<p class=\"card-text display-4\">1</p>", html)
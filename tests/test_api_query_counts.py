@@ -0,0 +1,111 @@
+"""
+API query count tests.
+
+The list and detail endpoints load their relations eagerly, so the number
+of statements they run must not grow with the number of rows returned.
+"""
+import asyncio
+from contextlib import contextmanager
+import httpx
+import pytest
+from sqlalchemy import event
+
+from app.api.api import api_app, api_key_cache
+from app.api.request_log import api_request_log
+from app.database.db import SessionLocal, async_engine, engine, init_db
+from app.database.models import Category, File, Format, Tag, User, file_tags
+from app.utils.security import hash_api_key
+
+API_KEY = "query-count-key"
+ENDPOINTS = ["/files", "/files/{file_id}", "/categories", "/formats", "/tags"]
+
+@contextmanager
+def count_statements():
+    """Count the statements run on both engines, without the API log writes."""
+    statements = []
+    
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if "api_logs" not in statement:
+            statements.append(statement)
+    
+    engines = [engine, async_engine.sync_engine]
+    for bind in engines:
+        event.listen(bind, "before_cursor_execute", before_cursor_execute)
+    
+    try:
+        yield statements
+    finally:
+        for bind in engines:
+            event.remove(bind, "before_cursor_execute", before_cursor_execute)
+
+def seed(count: int) -> int:
+    """Replace the catalog with count rows of each kind, returning a file id."""
+    db = SessionLocal()
+    
+    try:
+        db.execute(file_tags.delete())
+        for model in (File, Tag, Format, Category, User):
+            db.query(model).delete()
+        
+        owner = User(telegram_id=1, referral_code="ref_1", is_admin=True, api_key_hash=hash_api_key(API_KEY))
+        db.add(owner)
+        db.flush()
+        
+        files = []
+        for i in range(count):
+            category = Category(name_en=f"Category {i}", name_ar=f"Category {i}")
+            db.add(category)
+            db.flush()
+            
+            db.add(Category(name_en=f"Sub {i}", name_ar=f"Sub {i}", parent_id=category.id))
+            file_format = Format(name=f"Format {i}", category_id=category.id)
+            tags = [Tag(name=f"tag {i}"), Tag(name=f"other {i}")]
+            file = File(
+                telegram_file_id=f"tg{i}", file_unique_id=f"u{i}", file_name=f"file {i}.pdf",
+                file_size=1024, file_type="document", message_id=i, category=category,
+                format=file_format, owner=owner, share_link=f"link{i}", share_code=f"code{i}", tags=tags
+            )
+            db.add(file)
+            files.append(file)
+        
+        db.commit()
+        
+        return files[0].id
+    finally:
+        db.close()
+
+async def count_endpoint_statements(file_id: int) -> dict:
+    """Call every endpoint once and count its statements."""
+    api_key_cache.clear()
+    counts = {}
+    
+    transport = httpx.ASGITransport(app=api_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", headers={"X-API-Key": API_KEY}) as client:
+        # Resolve the API key first, it is cached afterwards
+        assert (await client.get("/users/me")).status_code == 200
+        
+        for endpoint in ENDPOINTS:
+            with count_statements() as statements:
+                response = await client.get(endpoint.format(file_id=file_id))
+            
+            assert response.status_code == 200
+            counts[endpoint] = len(statements)
+    
+    await api_request_log.close()
+    
+    return counts
+
+@pytest.fixture(scope="module", autouse=True)
+def database():
+    init_db()
+
+def test_query_counts_do_not_grow_with_rows():
+    small = asyncio.run(count_endpoint_statements(seed(2)))
+    large = asyncio.run(count_endpoint_statements(seed(50)))
+    
+    assert small == large
+    
+    # Detail pages load the file and its tags, lists run one or two queries
+    assert large["/files/{file_id}"] <= 2
+    assert large["/files"] <= 3
+    assert large["/categories"] == large["/formats"] == large["/tags"] == 1
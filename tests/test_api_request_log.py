@@ -0,0 +1,38 @@
+"""
+API request log tests.
+"""
+import asyncio
+import httpx
+
+from app.api.api import api_app
+from app.api.request_log import api_request_log
+from app.database.db import SessionLocal, init_db
+from app.database.models import ApiLog
+
+async def request(*paths: str) -> None:
+    """Request the paths and write their log rows."""
+    transport = httpx.ASGITransport(app=api_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        for path in paths:
+            await client.get(path, headers={"X-API-Key": "unknown"})
+    
+    await api_request_log.close()
+
+def test_requests_are_logged_by_route_template():
+    init_db()
+    db = SessionLocal()
+    
+    try:
+        db.query(ApiLog).delete()
+        db.commit()
+        
+        asyncio.run(request("/files/1", "/files/2", "/no-such-route"))
+        
+        rows = db.query(ApiLog.endpoint, ApiLog.status_code).order_by(ApiLog.id).all()
+        assert [tuple(row) for row in rows] == [
+            ("/files/{file_id}", 401),
+            ("/files/{file_id}", 401),
+            ("/no-such-route", 404)
+        ]
+    finally:
+        db.close()
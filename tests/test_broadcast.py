@@ -0,0 +1,108 @@
+"""
+Broadcast job tests.
+"""
+import asyncio
+from sqlalchemy import func
+
+from app.database.db import SessionLocal, init_db
+from app.database.models import BroadcastJob, User
+from app.utils import broadcast
+from app.utils.broadcast import DONE, FAILED, RUNNING, BroadcastManager
+
+class FakeBot:
+    """Bot recording sent messages, never answering for one chat."""
+    
+    def __init__(self, hang_chat_id: int = None):
+        self.hang_chat_id = hang_chat_id
+        self.sent = []
+        self.edits = []
+    
+    async def send_message(self, chat_id, text, **kwargs):
+        if chat_id == self.hang_chat_id:
+            await asyncio.Event().wait()
+        
+        self.sent.append(chat_id)
+    
+    async def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        self.edits.append(text)
+
+def create_job(telegram_ids, **kwargs) -> int:
+    """Create recipients and a job sending to them only."""
+    init_db()
+    db = SessionLocal()
+    
+    try:
+        last_user_id = db.query(func.max(User.id)).scalar() or 0
+        db.add_all(User(telegram_id=telegram_id, referral_code=f"ref_{telegram_id}") for telegram_id in telegram_ids)
+        job = BroadcastJob(audience="all", message="Hello", status=RUNNING, last_user_id=last_user_id,
+                           total_count=len(telegram_ids), **kwargs)
+        db.add(job)
+        db.commit()
+        return job.id
+    finally:
+        db.close()
+
+def get_job(job_id: int) -> BroadcastJob:
+    """Get a job as saved."""
+    db = SessionLocal()
+    
+    try:
+        return db.get(BroadcastJob, job_id)
+    finally:
+        db.close()
+
+async def wait_for(condition, timeout: float = 5) -> None:
+    """Wait until condition() is true."""
+    for _ in range(int(timeout / 0.02)):
+        if condition():
+            return
+        await asyncio.sleep(0.02)
+    
+    raise AssertionError("Timed out")
+
+def test_stopped_broadcast_resumes_without_duplicates():
+    telegram_ids = list(range(7001, 7007))
+    job_id = create_job(telegram_ids)
+    
+    async def run():
+        # The fourth recipient never finishes, the rest of the chunk does
+        bot = FakeBot(hang_chat_id=7004)
+        manager = BroadcastManager(chunk_size=10, concurrency=10)
+        manager.start(bot, job_id)
+        await wait_for(lambda: len(bot.sent) == 5)
+        await manager.stop()
+        
+        job = get_job(job_id)
+        assert job.status == RUNNING
+        assert job.sent_count == 3
+        
+        # Only the recipients after the finished run are sent again
+        bot = FakeBot()
+        manager = BroadcastManager(chunk_size=10, concurrency=10)
+        await manager.resume(bot)
+        await wait_for(lambda: get_job(job_id).status == DONE)
+        
+        return bot.sent
+    
+    assert sorted(asyncio.run(run())) == [7004, 7005, 7006]
+    
+    job = get_job(job_id)
+    assert (job.sent_count, job.failed_count) == (6, 0)
+
+def test_broadcast_fails_after_retries(monkeypatch):
+    job_id = create_job([7101], admin_chat_id=1, status_message_id=1)
+    
+    def get_recipient_filters(*args):
+        raise RuntimeError("database is locked")
+    
+    monkeypatch.setattr(broadcast, "get_recipient_filters", get_recipient_filters)
+    monkeypatch.setattr(broadcast, "BROADCAST_MAX_RETRIES", 2)
+    monkeypatch.setattr(broadcast, "BROADCAST_RETRY_DELAY", 0)
+    bot = FakeBot()
+    
+    asyncio.run(BroadcastManager()._run(bot, job_id))
+    
+    job = get_job(job_id)
+    assert job.status == FAILED
+    assert job.finished_at is not None
+    assert "Broadcast failed" in bot.edits[-1]
@@ -0,0 +1,46 @@
+"""
+File counter buffer tests.
+"""
+from app.database.db import SessionLocal, init_db
+from app.database.models import File, FileDownload, User
+from app.utils.counters import FileCounterBuffer
+
+def create_file() -> tuple:
+    """Create a file and a user downloading it."""
+    init_db()
+    db = SessionLocal()
+    
+    try:
+        user = User(telegram_id=800, referral_code="ref_800")
+        db.add(user)
+        db.flush()
+        file = File(telegram_file_id="tg_800", file_unique_id="u_800", file_name="a.pdf", file_size=1,
+                    file_type="document", message_id=1, owner_id=user.id, share_link="link_800", share_code="code_800")
+        db.add(file)
+        db.commit()
+        return file.id, user.id
+    finally:
+        db.close()
+
+def test_flushes_from_two_buffers_share_one_record():
+    file_id, user_id = create_file()
+    
+    # Two processes buffering downloads of the same file by the same user
+    first, second = FileCounterBuffer(), FileCounterBuffer()
+    for _ in range(2):
+        first.add_download(file_id)
+        first.add_user_download(file_id, user_id)
+    second.add_download(file_id)
+    second.add_user_download(file_id, user_id)
+    
+    assert first.flush() == 2
+    assert second.flush() == 2
+    
+    db = SessionLocal()
+    try:
+        records = db.query(FileDownload).filter(FileDownload.file_id == file_id).all()
+        assert [(record.user_id, record.download_count) for record in records] == [(user_id, 3)]
+        assert records[0].last_download >= records[0].first_download
+        assert db.get(File, file_id).download_count == 3
+    finally:
+        db.close()
@@ -0,0 +1,21 @@
+"""
+Database URL tests.
+"""
+import pytest
+
+from app.database.db import get_async_database_url
+
+@pytest.mark.parametrize("database_url, async_url", [
+    ("sqlite:///app/database/bot.db", "sqlite+aiosqlite:///app/database/bot.db"),
+    ("postgres://bot@db/bot", "postgresql+asyncpg://bot@db/bot"),
+    ("postgresql://bot@db/bot", "postgresql+asyncpg://bot@db/bot"),
+    ("mysql://bot@db/bot", "mysql+aiomysql://bot@db/bot"),
+    ("mysql+pymysql://bot@db/bot", "mysql+aiomysql://bot@db/bot"),
+    ("mysql+asyncmy://bot@db/bot", "mysql+asyncmy://bot@db/bot"),
+])
+def test_async_database_url(database_url, async_url):
+    assert get_async_database_url(database_url) == async_url
+
+def test_unknown_driver_names_async_database_url():
+    with pytest.raises(ValueError, match="ASYNC_DATABASE_URL"):
+        get_async_database_url("mssql+pyodbc://bot@db/bot")
@@ -0,0 +1,80 @@
+"""
+Schema migration tests.
+"""
+import os
+import hashlib
+from sqlalchemy import create_engine, inspect, text
+
+from app.database.migrations import MIGRATIONS, run_migrations
+
+BASELINE_SCHEMA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline_schema.sql")
+
+def create_baseline_engine(path):
+    """Create a SQLite database with the baseline schema and some rows."""
+    engine = create_engine(f"sqlite:///{path}")
+    
+    with open(BASELINE_SCHEMA, encoding="utf-8") as schema:
+        connection = engine.raw_connection()
+        try:
+            connection.executescript(schema.read())
+            connection.executescript("""
+                INSERT INTO users (id, telegram_id, referral_code, api_key) VALUES (1, 100, 'ref_1', 'secret-key');
+                INSERT INTO users (id, telegram_id, referral_code, api_key) VALUES (2, 200, 'ref_2', 'shared-key');
+                INSERT INTO users (id, telegram_id, referral_code, api_key) VALUES (3, 300, 'ref_3', 'shared-key');
+                INSERT INTO categories (id, name_en, name_ar) VALUES (1, 'Documents', 'مستندات');
+                INSERT INTO formats (id, name) VALUES (1, 'PDF');
+                INSERT INTO tags (id, name) VALUES (1, 'report');
+                INSERT INTO files (id, telegram_file_id, file_unique_id, file_name, file_size, file_type, message_id,
+                                   category_id, format_id, owner_id, share_link, share_code)
+                VALUES (1, 'tg1', 'u1', 'annual report.pdf', 10, 'document', 1, 1, 1, 1, 'link', 'code');
+                INSERT INTO file_tags (file_id, tag_id) VALUES (1, 1);
+                INSERT INTO file_download_stats (file_id, user_id, download_count, first_download, last_download)
+                VALUES (1, 1, 2, '2020-01-01 00:00:00', '2020-01-02 00:00:00'),
+                       (1, 1, 3, '2020-01-03 00:00:00', '2020-01-04 00:00:00');
+                INSERT INTO api_logs (endpoint, method, status_code, created_at)
+                VALUES ('/files', 'GET', 200, '2020-01-01 00:00:00');
+            """)
+            connection.commit()
+        finally:
+            connection.close()
+    
+    return engine
+
+def test_migrations_upgrade_baseline_database(tmp_path):
+    engine = create_baseline_engine(tmp_path / "baseline.db")
+    
+    assert run_migrations(engine) == len(MIGRATIONS)
+    
+    inspector = inspect(engine)
+    user_indexes = {index["name"] for index in inspector.get_indexes("users")}
+    assert {"ix_users_last_activity", "ix_users_api_key_hash"} <= user_indexes
+    assert "ix_users_api_key" not in user_indexes
+    assert {"files_count"} <= {column["name"] for column in inspector.get_columns("categories")}
+    assert inspector.has_table("channel_members")
+    
+    with engine.connect() as connection:
+        # Backfills ran over the existing rows
+        assert connection.execute(text("SELECT files_count FROM categories")).scalar() == 1
+        assert connection.execute(text("SELECT files_count FROM tags")).scalar() == 1
+        
+        users = connection.execute(text("SELECT api_key, api_key_hash FROM users ORDER BY id")).all()
+        assert [tuple(user) for user in users] == [
+            (None, hashlib.sha256(b"secret-key").hexdigest()),
+            # Keys shared by several users are cleared
+            (None, None),
+            (None, None)
+        ]
+        
+        # Duplicate download records are merged before the unique index
+        record = connection.execute(text("SELECT download_count, first_download, last_download FROM file_download_stats")).one()
+        assert tuple(record) == (5, "2020-01-01 00:00:00", "2020-01-04 00:00:00")
+    
+    # Everything is recorded as applied
+    assert run_migrations(engine) == 0
+
+def test_migrations_create_fresh_database(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'fresh.db'}")
+    
+    assert run_migrations(engine) == len(MIGRATIONS)
+    assert run_migrations(engine) == 0
+    assert inspect(engine).has_table("broadcast_jobs")
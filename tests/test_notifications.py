@@ -0,0 +1,82 @@
+"""
+Download digest tests.
+"""
+import asyncio
+
+from app.database.db import SessionLocal, init_db
+from app.database.models import Notification, User
+from app.utils import notifications
+from app.utils.notifications import DownloadNotificationBuffer, iter_telegram_ids, send_notification_to_users
+
+class FakeBot:
+    """Bot recording the messages it sends."""
+    
+    def __init__(self):
+        self.sent = []
+    
+    async def send_message(self, chat_id, text, **kwargs):
+        self.sent.append((chat_id, text))
+
+class FailingEngine:
+    """Engine whose transactions fail to start."""
+    
+    def begin(self):
+        raise RuntimeError("database is locked")
+
+def test_digests_are_kept_when_storing_fails(monkeypatch):
+    init_db()
+    db = SessionLocal()
+    
+    try:
+        db.query(Notification).delete()
+        owner = db.query(User).filter(User.telegram_id == 500).first()
+        if owner is None:
+            owner = User(telegram_id=500, referral_code="ref_500")
+            db.add(owner)
+        db.commit()
+        owner_id = owner.id
+    finally:
+        db.close()
+    
+    buffer = DownloadNotificationBuffer(window=5)
+    buffer.add(owner_id, 1, "report.pdf")
+    bot = FakeBot()
+    
+    # The failed window is merged into the next one
+    monkeypatch.setattr(notifications, "async_engine", FailingEngine())
+    assert asyncio.run(buffer.flush(bot)) == 0
+    monkeypatch.undo()
+    
+    buffer.add(owner_id, 1, "report.pdf")
+    buffer.add(owner_id, 2, "notes.txt")
+    
+    assert asyncio.run(buffer.flush(bot)) == 1
+    assert bot.sent == [(500, buffer.format_digest({1: ["report.pdf", 2], 2: ["notes.txt", 1]}))]
+    assert "3 times" in bot.sent[0][1]
+    
+    db = SessionLocal()
+    try:
+        assert db.query(Notification).filter(Notification.user_id == owner_id).count() == 1
+    finally:
+        db.close()
+
+def test_recipients_are_fetched_in_batches():
+    init_db()
+    db = SessionLocal()
+    
+    try:
+        db.add_all(User(telegram_id=telegram_id, referral_code=f"ref_{telegram_id}") for telegram_id in range(5001, 5006))
+        db.commit()
+    finally:
+        db.close()
+    
+    async def send():
+        bot = FakeBot()
+        recipients = iter_telegram_ids(User.telegram_id.between(5001, 5005), batch_size=2)
+        sent = await send_notification_to_users(bot, recipients, "Hello", concurrency=2)
+        return sent, bot.sent
+    
+    sent, messages = asyncio.run(send())
+    
+    assert sent == 5
+    assert sorted(chat_id for chat_id, _ in messages) == list(range(5001, 5006))
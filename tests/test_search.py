@@ -0,0 +1,87 @@
+"""
+File search tests.
+"""
+import asyncio
+from sqlalchemy import text
+
+from app.database import search
+from app.database.db import SessionLocal, engine, init_db
+from app.database.models import File, User
+from app.database.search import apply_file_search, get_search_backend, reset_search_backend
+from app.handlers.search_handlers import RESULTS_NAME, get_results_query
+from app.utils.pagination import NEXT, encode_cursor, fetch_page
+
+def test_search_index_created_later_is_picked_up(monkeypatch):
+    init_db()
+    reset_search_backend()
+    
+    with engine.begin() as connection:
+        connection.execute(text("ALTER TABLE files_fts RENAME TO files_fts_hidden"))
+    
+    try:
+        assert get_search_backend() == "like"
+        
+        # Checked again only after the recheck interval
+        with engine.begin() as connection:
+            connection.execute(text("ALTER TABLE files_fts_hidden RENAME TO files_fts"))
+        
+        assert get_search_backend() == "like"
+        
+        monkeypatch.setattr(search, "SEARCH_BACKEND_RECHECK", 0)
+        assert get_search_backend() == "fts5"
+        
+        # Found indexes are kept
+        monkeypatch.setattr(search, "detect_search_backend", lambda: "like")
+        assert get_search_backend() == "fts5"
+    finally:
+        with engine.begin() as connection:
+            if engine.dialect.has_table(connection, "files_fts_hidden"):
+                connection.execute(text("ALTER TABLE files_fts_hidden RENAME TO files_fts"))
+        
+        reset_search_backend()
+
+class FakeState:
+    """FSM context holding a search query."""
+    
+    def __init__(self, search_query: str):
+        self.search_query = search_query
+    
+    async def get_data(self):
+        return {"search_query": self.search_query}
+
+def test_name_search_pages_by_relevance():
+    init_db()
+    reset_search_backend()
+    db = SessionLocal()
+    
+    try:
+        owner = User(telegram_id=900, referral_code="ref_900")
+        db.add(owner)
+        db.flush()
+        
+        # Enough other files for the search term to be rare
+        names = ["quarterly budget", "budget budget budget", "budget notes", "old budget draft", "budget"]
+        names += [f"travel plan {i}" for i in range(20)]
+        for i, name in enumerate(names):
+            db.add(File(telegram_file_id=f"tg_9{i}", file_unique_id=f"u_9{i}", file_name=name, file_size=1,
+                        file_type="document", message_id=i, owner_id=owner.id, share_link=f"link_9{i}",
+                        share_code=f"code_9{i}", download_count=10 - i))
+        db.commit()
+        
+        best = apply_file_search(db.query(File), "budget").first()
+        
+        query, order = asyncio.run(get_results_query(db, FakeState("budget"), 900, RESULTS_NAME, ""))
+        files, _, has_next = fetch_page(query, order, limit=2)
+        pages = [files]
+        
+        while has_next:
+            files, _, has_next = fetch_page(query, order, encode_cursor(order, files[-1]), NEXT, limit=2)
+            pages.append(files)
+        
+        results = [file for page in pages for file in page]
+        
+        assert results[0].id == best.id
+        assert sorted(file.file_name for file in results) == sorted(name for name in names if "budget" in name)
+        assert [file.search_rank for file in results] == sorted((file.search_rank for file in results), reverse=True)
+    finally:
+        db.close()
@@ -0,0 +1,27 @@
+"""
+Settings cache tests.
+"""
+from app.database.db import SessionLocal, get_setting, init_db, update_setting
+from app.database.models import Settings
+
+def test_updated_setting_is_read_back():
+    init_db()
+    db = SessionLocal()
+    
+    try:
+        assert get_setting(db, "max_file_size") == "50"
+        assert update_setting(db, "max_file_size", "20")
+        assert get_setting(db, "max_file_size") == "20"
+    finally:
+        update_setting(db, "max_file_size", "50")
+        db.close()
+
+def test_update_of_missing_setting_fails():
+    init_db()
+    db = SessionLocal()
+    
+    try:
+        assert not update_setting(db, "no_such_setting", "1")
+        assert db.query(Settings).filter(Settings.key == "no_such_setting").count() == 0
+    finally:
+        db.close()
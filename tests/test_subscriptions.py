@@ -0,0 +1,71 @@
+"""
+Subscription check tests.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+import pytest
+
+from app.database.db import SessionLocal, init_db
+from app.database.models import ChannelMember, SubscriptionChannel
+from app.utils.helpers import check_subscription, invalidate_subscription_channels, membership_cache
+
+CHANNEL_ID = "@required"
+
+class FakeBot:
+    """Bot answering get_chat_member with a fixed status."""
+    
+    def __init__(self, status: str):
+        self.status = status
+        self.calls = 0
+    
+    async def get_chat_member(self, chat_id, user_id):
+        self.calls += 1
+        return SimpleNamespace(status=self.status)
+
+@pytest.fixture
+def db():
+    init_db()
+    session = SessionLocal()
+    session.query(ChannelMember).delete()
+    session.query(SubscriptionChannel).delete()
+    session.add(SubscriptionChannel(channel_id=CHANNEL_ID, channel_name="Required", channel_link="https://t.me/required"))
+    session.commit()
+    invalidate_subscription_channels()
+    
+    yield session
+    
+    session.close()
+    invalidate_subscription_channels()
+
+def test_live_non_member_is_not_stored(db):
+    bot = FakeBot("left")
+    
+    assert asyncio.run(check_subscription(1, bot, db)) is False
+    assert db.query(ChannelMember).count() == 0
+    
+    # Once the short cache entry is gone, Telegram is asked again
+    membership_cache.clear()
+    bot.status = "member"
+    
+    assert asyncio.run(check_subscription(1, bot, db)) is True
+    assert bot.calls == 2
+    assert db.query(ChannelMember).one().is_member
+
+def test_old_stored_non_member_is_checked_again(db):
+    db.add(ChannelMember(telegram_id=1, channel_id=CHANNEL_ID, is_member=False,
+                         updated_at=datetime.utcnow() - timedelta(hours=1)))
+    db.commit()
+    bot = FakeBot("member")
+    
+    assert asyncio.run(check_subscription(1, bot, db)) is True
+    assert bot.calls == 1
+
+def test_recent_stored_member_is_trusted(db):
+    db.add(ChannelMember(telegram_id=1, channel_id=CHANNEL_ID, is_member=True,
+                         updated_at=datetime.utcnow() - timedelta(days=1)))
+    db.commit()
+    bot = FakeBot("left")
+    
+    assert asyncio.run(check_subscription(1, bot, db)) is True
+    assert bot.calls == 0
@@ -0,0 +1,97 @@
+"""
+API upload worker tests.
+"""
+import asyncio
+from types import SimpleNamespace
+
+from app.api.upload_worker import DONE, FAILED, UploadJob, UploadWorkerPool
+from app.database.db import SessionLocal, init_db
+from app.database.models import File, User
+
+class FakeBot:
+    """Bot storing documents in a fake channel."""
+    
+    def __init__(self, error: Exception = None):
+        self.error = error
+        self.sent = []
+    
+    async def send_document(self, chat_id, document, caption=None):
+        if self.error:
+            raise self.error
+        
+        self.sent.append(document.filename)
+        file_id = f"upload_{len(self.sent)}"
+        return SimpleNamespace(
+            message_id=len(self.sent),
+            document=SimpleNamespace(file_id=file_id, file_unique_id=file_id),
+            video=None,
+            audio=None,
+            animation=None
+        )
+    
+    async def get_me(self):
+        return SimpleNamespace(username="file_bot")
+
+def get_owner_id() -> int:
+    """Get the id of the uploading user."""
+    init_db()
+    db = SessionLocal()
+    
+    try:
+        user = db.query(User).filter(User.telegram_id == 600).first()
+        if user is None:
+            user = User(telegram_id=600, referral_code="ref_600", can_upload=True)
+            db.add(user)
+            db.commit()
+        return user.id
+    finally:
+        db.close()
+
+def spool(tmp_path, name: str) -> str:
+    """Write a spooled upload."""
+    path = tmp_path / name
+    path.write_bytes(b"content")
+    return str(path)
+
+def run_job(bot: FakeBot, job: UploadJob) -> None:
+    """Process a job with a fake bot."""
+    pool = UploadWorkerPool(workers=1)
+    pool._bot = bot
+    
+    async def process():
+        pool._ensure_started()
+        await pool.process(job)
+        for task in pool._tasks:
+            task.cancel()
+    
+    asyncio.run(process())
+
+def test_job_without_content_type_is_saved(tmp_path):
+    job = UploadJob(get_owner_id(), spool(tmp_path, "a.bin"), "a.bin", None, 7, tags=["upload"])
+    bot = FakeBot()
+    
+    run_job(bot, job)
+    
+    assert job.status == DONE
+    assert bot.sent == ["a.bin"]
+    assert not (tmp_path / "a.bin").exists()
+    
+    db = SessionLocal()
+    try:
+        file = db.query(File).filter(File.id == job.file["id"]).one()
+        assert file.file_type == "application/octet-stream"
+        assert file.share_link.startswith("https://t.me/file_bot?start=")
+        assert [tag.name for tag in file.tags] == ["upload"]
+    finally:
+        db.close()
+
+def test_failed_send_fails_job(tmp_path):
+    job = UploadJob(get_owner_id(), spool(tmp_path, "b.pdf"), "b.pdf", "application/pdf", 7)
+    
+    run_job(FakeBot(RuntimeError("chat not found")), job)
+    
+    assert job.status == FAILED
+    assert job.error == "chat not found"
+    assert job.file is None
+    assert job.finished_at is not None
+    assert not (tmp_path / "b.pdf").exists()